@@ -0,0 +1,310 @@
+"""
+The benchmark cases run by ``benchmarks/run.py``.
+
+Each case is a function decorated with :func:`benchmark` which does any setup
+and returns the function to be timed (called without arguments).
+"""
+import datetime
+import decimal
+import json
+import uuid
+
+from django import forms
+from django.contrib import messages
+from django.contrib.messages.constants import DEFAULT_TAGS
+from django.contrib.messages.storage import base as messages_base
+from django.contrib.messages.storage.session import SessionStorage
+from django.db import connection
+from django.forms.formsets import formset_factory
+from django.http import HttpRequest
+from django.utils.functional import lazy
+from django.views.generic import TemplateView
+
+from jsonit.binary import CBORFormat, MessagePackFormat
+from jsonit.compat import text_type
+from jsonit.encoder import RawJSON, encode, get_encoder
+from jsonit.http import JSONFormResponse, JSONResponse
+from jsonit.schema import Schema
+from jsonit.views import AJAXTemplateResponseMixin
+
+from benchmarks.models import Author, Book
+
+#: The registered cases, as a list of ``(name, setup function)`` tuples.
+CASES = []
+
+
+def benchmark(name):
+    def register(func):
+        CASES.append((name, func))
+        return func
+    return register
+
+
+def make_request(ajax=True):
+    request = HttpRequest()
+    request.method = 'GET'
+    request.path = '/benchmark/'
+    if ajax:
+        request.META['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+    request.session = {}
+    request._messages = SessionStorage(request)
+    messages_base.LEVEL_TAGS = DEFAULT_TAGS
+    return request
+
+
+# encode() -------------------------------------------------------------------
+
+def flat_payload(size):
+    return dict(('key%d' % i, i * 1.5 if i % 2 else 'value %d' % i)
+                for i in range(size))
+
+
+def nested_payload(depth, width):
+    if not depth:
+        return list(range(width))
+    return dict(('level%d_%d' % (depth, i), nested_payload(depth - 1, width))
+                for i in range(width))
+
+
+def typed_payload(size):
+    lazy_text = lazy(lambda: 'lazy text', text_type)
+    now = datetime.datetime(2011, 9, 29, 15, 20, 35)
+    return [
+        {
+            'created': now,
+            'day': now.date(),
+            'label': lazy_text(),
+            'price': decimal.Decimal('%d.99' % i),
+            'uuid': uuid.UUID(int=i),
+        }
+        for i in range(size)
+    ]
+
+
+PAYLOADS = [
+    ('encode.flat.10', lambda: flat_payload(10)),
+    ('encode.flat.1000', lambda: flat_payload(1000)),
+    ('encode.nested', lambda: nested_payload(4, 6)),
+    ('encode.typed.10', lambda: typed_payload(10)),
+    ('encode.typed.1000', lambda: typed_payload(1000)),
+]
+
+for name, build_payload in PAYLOADS:
+    @benchmark(name)
+    def encode_payload(build_payload=build_payload):
+        payload = build_payload()
+        return lambda: encode(payload)
+
+
+# Pre-encoded fragments, spliced in or decoded to be encoded again.
+FRAGMENTS = [encode(flat_payload(20)) for i in range(100)]
+
+
+@benchmark('encode.raw.100')
+def encode_raw():
+    return lambda: encode({'rows': [RawJSON(fragment, validate=False)
+                                    for fragment in FRAGMENTS]})
+
+
+@benchmark('encode.reencoded.100')
+def encode_reencoded():
+    return lambda: encode({'rows': [json.loads(fragment)
+                                    for fragment in FRAGMENTS]})
+
+
+# Binary formats, against the JSON encoding of the same payloads -----------
+
+FORMATS = [
+    ('msgpack', MessagePackFormat),
+    ('cbor', CBORFormat),
+]
+
+BINARY_PAYLOADS = [
+    ('flat.1000', lambda: flat_payload(1000)),
+    ('typed.1000', lambda: typed_payload(1000)),
+]
+
+for payload_name, build_payload in BINARY_PAYLOADS:
+    @benchmark('decode.json.%s' % payload_name)
+    def decode_json(build_payload=build_payload):
+        encoded = encode(build_payload())
+        return lambda: json.loads(encoded)
+
+    for format_name, format_class in FORMATS:
+        @benchmark('%s.%s' % (format_name, payload_name))
+        def encode_binary(build_payload=build_payload,
+                          format_class=format_class):
+            payload = build_payload()
+            format = format_class(get_encoder())
+            return lambda: format.encode(payload)
+
+        @benchmark('decode.%s.%s' % (format_name, payload_name))
+        def decode_binary(build_payload=build_payload,
+                          format_class=format_class):
+            format = format_class(get_encoder())
+            encoded = format.encode(build_payload())
+            return lambda: format.decode(encoded)
+
+
+def setup_database(books=500):
+    """
+    Create the tables for the benchmark models in the in-memory database,
+    with a number of books.
+    """
+    with connection.schema_editor() as editor:
+        editor.create_model(Author)
+        editor.create_model(Book)
+    author = Author.objects.create(
+        name='Chris', joined=datetime.datetime(2011, 9, 29))
+    Book.objects.bulk_create([
+        Book(author=author, title='Book %d' % i,
+             price=decimal.Decimal('9.99'),
+             published=datetime.date(2011, 9, 29))
+        for i in range(books)])
+
+
+@benchmark('encode.queryset.500')
+def encode_queryset():
+    return lambda: encode(Book.objects.all())
+
+
+@benchmark('encode.models.500')
+def encode_models():
+    books = list(Book.objects.all())
+    return lambda: encode(books)
+
+
+# JSONResponse ---------------------------------------------------------------
+
+@benchmark('response.small')
+def response_small():
+    request = make_request()
+    details = {'id': 1, 'name': 'Chris'}
+    return lambda: JSONResponse(request, details=details).render()
+
+
+@benchmark('response.small.messages')
+def response_messages():
+    request = make_request()
+    details = {'id': 1, 'name': 'Chris'}
+
+    def run():
+        # A new storage, as each request gets from the message middleware.
+        request._messages = SessionStorage(request)
+        for i in range(3):
+            messages.info(request, 'Message %d' % i)
+        return JSONResponse(request, details=details).render()
+
+    return run
+
+
+@benchmark('response.large')
+def response_large():
+    request = make_request()
+    details = {'rows': typed_payload(1000)}
+    return lambda: JSONResponse(request, details=details).render()
+
+
+# Schema ---------------------------------------------------------------------
+
+TYPED_SCHEMA = Schema({'rows': [{
+    'created': datetime.datetime,
+    'day': datetime.date,
+    'label': str,
+    'price': decimal.Decimal,
+    'uuid': uuid.UUID,
+}]})
+
+
+@benchmark('schema.typed.1000')
+def schema_typed():
+    details = {'rows': typed_payload(1000)}
+    return lambda: TYPED_SCHEMA.encode(details, validate=False)
+
+
+@benchmark('response.large.schema')
+def response_large_schema():
+    request = make_request()
+    details = {'rows': typed_payload(1000)}
+    return lambda: JSONResponse(request, details=details,
+                                schema=TYPED_SCHEMA).render()
+
+
+# JSONFormResponse -----------------------------------------------------------
+
+LargeForm = type('LargeForm', (forms.Form,), dict(
+    ('field%d' % i,
+     forms.IntegerField() if i % 2 else forms.CharField(max_length=10))
+    for i in range(50)))
+
+
+def form_data(valid, prefix=None):
+    data = {}
+    for i in range(50):
+        name = 'field%d' % i
+        if prefix:
+            name = '%s-%s' % (prefix, name)
+        data[name] = (i if i % 2 else 'x') if valid else 'not valid' * 2
+    return data
+
+
+@benchmark('form.large.valid')
+def form_valid():
+    request = make_request()
+    data = form_data(valid=True)
+    return lambda: JSONFormResponse(
+        request, forms=[LargeForm(data=data)]).render()
+
+
+@benchmark('form.large.invalid')
+def form_invalid():
+    request = make_request()
+    data = form_data(valid=False)
+    return lambda: JSONFormResponse(
+        request, forms=[LargeForm(data=data)]).render()
+
+
+def formset_case(rows, indexed_errors=False):
+    request = make_request()
+    LargeFormSet = formset_factory(LargeForm, extra=0, max_num=rows)
+    data = {'form-TOTAL_FORMS': str(rows), 'form-INITIAL_FORMS': '0'}
+    for i in range(rows):
+        data.update(form_data(valid=i % 2, prefix='form-%d' % i))
+    return lambda: JSONFormResponse(
+        request, forms=[LargeFormSet(data=data)],
+        indexed_errors=indexed_errors).render()
+
+
+@benchmark('formset.20.invalid')
+def formset_invalid():
+    return formset_case(20)
+
+
+@benchmark('formset.200.invalid')
+def formset_large_invalid():
+    return formset_case(200)
+
+
+@benchmark('formset.200.indexed')
+def formset_large_indexed():
+    return formset_case(200, indexed_errors=True)
+
+
+# AJAXTemplateResponseMixin --------------------------------------------------
+
+class AJAXTemplateView(AJAXTemplateResponseMixin, TemplateView):
+    template_name = 'benchmarks/page.html'
+
+
+@benchmark('views.get_template_names')
+def get_template_names():
+    view = AJAXTemplateView()
+    view.request = make_request()
+    return view.get_template_names
+
+
+@benchmark('views.template_response')
+def template_response():
+    view = AJAXTemplateView.as_view()
+    request = make_request()
+    return lambda: view(request).render()
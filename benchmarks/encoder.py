@@ -0,0 +1,90 @@
+"""
+Benchmark :class:`jsonit.encoder.JsonitEncoder` on payloads holding many
+custom-typed values.
+
+Compares the per-type dispatch cache against the previous linear
+``isinstance`` scan of the encoders. Run from the project root with::
+
+    python benchmarks/encoder.py
+
+The regression suite is run with ``benchmarks/run.py``.
+"""
+import datetime
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from django.conf import settings
+
+if not settings.configured:
+    settings.configure()
+
+from django.utils.functional import lazy
+
+from jsonit.compat import text_type
+from jsonit.encoder import JsonitEncoder
+
+
+class LinearScanEncoder(JsonitEncoder):
+    """The original encoder, checking every encoder for every object."""
+
+    def default(self, o):
+        for cls, func in self.encoders:
+            if isinstance(o, cls):
+                return func(o)
+        return super(JsonitEncoder, self).default(o)
+
+
+class Custom(object):
+
+    def __init__(self, value):
+        self.value = value
+
+
+def make_extra_encoders(count):
+    """
+    Build ``count`` extra encoders, as a project registering encoders for its
+    own types would. Only the last one matches the :class:`Custom` values.
+    """
+    encoders = [(type('Unused%d' % i, (object,), {}), repr)
+                for i in range(count - 1)]
+    encoders.append((Custom, lambda o: o.value))
+    return encoders
+
+
+def build_payload(size):
+    lazy_text = lazy(lambda: 'lazy text', text_type)
+    now = datetime.datetime(2011, 9, 29, 15, 20, 35)
+    today = now.date()
+    return [
+        {
+            'created': now,
+            'day': today,
+            'label': lazy_text(),
+            'custom': Custom(i),
+        }
+        for i in range(size)
+    ]
+
+
+def main(sizes=(100, 1000, 10000), repeat=7):
+    extra_encoders = make_extra_encoders(8)
+    for size in sizes:
+        payload = build_payload(size)
+        number = max(1, 10000 // size)
+        results = []
+        for encoder_class in (LinearScanEncoder, JsonitEncoder):
+            encoder = encoder_class(extra_encoders=extra_encoders)
+            assert encoder.encode(payload)
+            timer = timeit.Timer(lambda: encoder.encode(payload))
+            best = min(timer.repeat(repeat=repeat, number=number)) / number
+            results.append(best)
+        linear, cached = results
+        print('%6d objects: linear %8.2fms  cached %8.2fms  (%.2fx)' % (
+            size, linear * 1000, cached * 1000, linear / cached))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,87 @@
+"""
+Compare the peak memory allocated while encoding a large payload as a
+string which is then encoded as UTF-8 (as responses used to), against
+encoding it straight to bytes, with each available backend and with and
+without ``DEBUG`` indentation.
+
+Run from the project root::
+
+    python benchmarks/memory.py [--rows N]
+
+The peaks are measured with :mod:`tracemalloc`, in KiB above the memory used
+before encoding, next to the size of the encoded output.
+"""
+import argparse
+import gc
+import os
+import sys
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+
+django.setup()
+
+from django.test.utils import override_settings
+
+from jsonit.backends import available_backends
+from jsonit.encoder import encode, encode_bytes
+from jsonit.http import JSONResponse
+
+from benchmarks import cases
+
+
+def measure_peak(func):
+    """
+    Return the peak memory allocated while calling ``func`` (in bytes, above
+    the memory allocated before), and its result.
+    """
+    gc.collect()
+    tracemalloc.start()
+    try:
+        start = tracemalloc.get_traced_memory()[0]
+        result = func()
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    return peak - start, result
+
+
+def run(rows=5000, out=sys.stdout):
+    details = {'rows': [cases.flat_payload(20) for i in range(rows)]}
+    request = cases.make_request()
+    variants = [
+        ('str', lambda: encode(details).encode('utf-8')),
+        ('bytes', lambda: encode_bytes(details)),
+        ('response', lambda: JSONResponse(
+            request, details=details, compress=False).render().content),
+    ]
+    out.write('%-16s %10s' % ('', 'size') +
+              ''.join('%10s' % name for name, func in variants) + '\n')
+    for backend in available_backends():
+        for debug in (False, True):
+            with override_settings(JSONIT_BACKEND=backend, DEBUG=debug):
+                # Build and cache the encoder before measuring.
+                encode([])
+                peaks = []
+                for name, func in variants:
+                    peak, encoded = measure_peak(func)
+                    peaks.append(peak)
+            label = '%s%s' % (backend, ' (debug)' if debug else '')
+            out.write('%-16s %10d' % (label, len(encoded) // 1024) +
+                      ''.join('%10d' % (peak // 1024) for peak in peaks) +
+                      '\n')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--rows', type=int, default=5000,
+                        help='The number of rows in the payload.')
+    args = parser.parse_args(argv)
+    run(args.rows)
+
+
+if __name__ == '__main__':
+    main()
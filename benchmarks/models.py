@@ -0,0 +1,15 @@
+from django.db import models
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=50)
+    joined = models.DateTimeField()
+    jsonit_fields = ('id', 'name', 'joined')
+
+
+class Book(models.Model):
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    title = models.CharField(max_length=100)
+    price = models.DecimalField(max_digits=6, decimal_places=2)
+    published = models.DateField()
+    jsonit_fields = ('id', 'author', 'title', 'price', 'published')
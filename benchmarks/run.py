@@ -0,0 +1,126 @@
+"""
+Run the JSONit benchmark suite (see ``benchmarks/cases.py``).
+
+Run from the project root::
+
+    python benchmarks/run.py [--json FILE] [--compare BASELINE] [PATTERN ...]
+
+Only the cases whose names contain one of the patterns are run. Results can
+be saved as JSON with ``--json`` and compared against a previously saved run
+with ``--compare``: cases which are slower than the baseline by more than
+``--threshold`` (a fraction, ``0.1`` by default) are reported as regressions
+and the exit status is ``1``.
+"""
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+
+django.setup()
+
+import jsonit
+from jsonit.encoder import get_backend_name
+
+from benchmarks import cases
+
+
+def time_case(func, repeat, min_time):
+    """
+    Time a benchmark function, returning a dictionary of the best and median
+    time per call (in seconds), the number of calls in each timing and the
+    number of timings.
+    """
+    timer = timeit.Timer(func)
+    number = 1
+    while timer.timeit(number) < min_time:
+        number *= 2
+    times = sorted(t / number for t in timer.repeat(repeat, number))
+    return {
+        'best': times[0],
+        'median': times[len(times) // 2],
+        'number': number,
+        'repeat': repeat,
+    }
+
+
+def run(patterns=(), repeat=5, min_time=0.1, out=sys.stdout):
+    cases.setup_database()
+    results = {}
+    out.write('%-32s %14s %14s\n' % ('', 'best', 'median'))
+    for name, setup in cases.CASES:
+        if patterns and not any(pattern in name for pattern in patterns):
+            continue
+        results[name] = result = time_case(setup(), repeat, min_time)
+        out.write('%-32s %12.2fus %12.2fus\n' % (
+            name, result['best'] * 1e6, result['median'] * 1e6))
+    return {
+        'meta': {
+            'jsonit': jsonit.get_version(),
+            'django': django.get_version(),
+            'python': platform.python_version(),
+            'implementation': platform.python_implementation(),
+            'backend': get_backend_name(),
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold, out=sys.stdout):
+    """
+    Compare the best times of the current run against a baseline run,
+    returning the names of the cases which regressed by more than
+    ``threshold``.
+    """
+    regressions = []
+    out.write('%-32s %12s %12s %8s\n' % ('', 'baseline', 'current',
+                                         'change'))
+    for name, result in sorted(current['results'].items()):
+        if name not in baseline['results']:
+            continue
+        before = baseline['results'][name]['best']
+        after = result['best']
+        change = after / before - 1
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        out.write('%-32s %10.2fus %10.2fus %+7.1f%%%s\n' % (
+            name, before * 1e6, after * 1e6, change * 100, flag))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Run the JSONit benchmarks.')
+    parser.add_argument('patterns', nargs='*',
+                        help='Only run cases whose names contain a pattern.')
+    parser.add_argument('--json', help='Save the results to this file.')
+    parser.add_argument('--compare',
+                        help='Compare against results saved with --json.')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='The slowdown reported as a regression.')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--min-time', type=float, default=0.1,
+                        help='The minimum seconds for each timing.')
+    args = parser.parse_args(argv)
+    results = run(args.patterns, repeat=args.repeat, min_time=args.min_time)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(results, f, indent=2, sort_keys=True)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print('')
+        if compare(results, baseline, args.threshold):
+            return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
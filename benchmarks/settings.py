@@ -0,0 +1,22 @@
+SECRET_KEY = 'benchmarks'
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+INSTALLED_APPS = [
+    'jsonit',
+    'benchmarks',
+]
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
+
+TEMPLATES = [
+    {
+        'BACKEND': 'django.template.backends.django.DjangoTemplates',
+        'APP_DIRS': True,
+    },
+]
@@ -0,0 +1,41 @@
+"""
+Compare the encoded sizes of the benchmark payloads (see
+``benchmarks/cases.py``) as JSON and in each binary format, uncompressed and
+gzipped.
+
+Run from the project root::
+
+    python benchmarks/sizes.py
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+
+django.setup()
+
+from jsonit.compression import compress_gzip
+from jsonit.encoder import encode, get_encoder
+
+from benchmarks import cases
+
+
+def main(out=sys.stdout):
+    columns = ['json'] + [name for name, format_class in cases.FORMATS]
+    out.write('%-20s' % '' + ''.join('%12s %12s' % (name, 'gzip')
+                                      for name in columns) + '\n')
+    for name, build_payload in cases.PAYLOADS:
+        payload = build_payload()
+        encoded = [encode(payload).encode('utf-8')]
+        for format_name, format_class in cases.FORMATS:
+            encoded.append(format_class(get_encoder()).encode(payload))
+        out.write('%-20s' % name + ''.join(
+            '%12d %12d' % (len(data), len(compress_gzip(data)))
+            for data in encoded) + '\n')
+
+
+if __name__ == '__main__':
+    main()
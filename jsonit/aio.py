@@ -0,0 +1,254 @@
+"""
+Asynchronous counterparts of the JSONit views and decorators, for projects
+served over ASGI (requires Python 3.5+).
+
+The mixins are used just like their synchronous versions, but their
+:meth:`~AsyncJSONResponseMixin.get_json_response` and ``post`` methods are
+coroutines. JSON responses are rendered without blocking the event loop: the
+user's messages are retrieved in a thread, and so is the encoding of large
+responses (those with more values than the ``JSONIT_ASYNC_ENCODE_THRESHOLD``
+setting, which defaults to ``1000``, or with querysets or iterators, which may
+access the database).
+"""
+import asyncio
+import functools
+try:
+    from collections.abc import Iterator, Mapping
+except ImportError:     # Python < 3.3
+    from collections import Iterator, Mapping
+
+from django.conf import settings
+from django.db.models.query import QuerySet
+
+from jsonit.encoder import RawJSON
+from jsonit.http import JSONFormResponse, JSONResponse, has_messages
+from jsonit.request import (InvalidJSONBody, error_response, get_json_body,
+                            is_json_request)
+from jsonit.views import AJAXFormMixin, AJAXMixin, JSONResponseMixin
+
+try:
+    from asgiref.sync import sync_to_async
+except ImportError:     # Django < 3.0
+    sync_to_async = None
+
+DEFAULT_ENCODE_THRESHOLD = 1000
+
+
+async def run_sync(func, *args, **kwargs):
+    """
+    Run a synchronous function in a thread, returning its result.
+    """
+    if sync_to_async is not None:
+        return await sync_to_async(func)(*args, **kwargs)
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(
+        None, functools.partial(func, *args, **kwargs))
+
+
+def estimate_size(value, limit):
+    """
+    Estimate the number of values that will be encoded for ``value``,
+    counting no further than ``limit``.
+
+    Returns ``limit + 1`` for querysets and iterators since they can't be
+    counted without consuming them.
+    """
+    count = 0
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        count += 1
+        if count > limit:
+            break
+        if isinstance(value, Mapping):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+        elif isinstance(value, RawJSON):
+            # Roughly one value per 16 characters.
+            count += len(value.encoded) // 16
+        elif isinstance(value, (QuerySet, Iterator)):
+            return limit + 1
+    return count
+
+
+def get_encode_threshold():
+    return getattr(settings, 'JSONIT_ASYNC_ENCODE_THRESHOLD',
+                   DEFAULT_ENCODE_THRESHOLD)
+
+
+async def render_response(response):
+    """
+    Render a :class:`~jsonit.http.JSONResponse` without blocking the event
+    loop, returning the response.
+
+    Form responses and responses estimated to be large (see
+    :func:`estimate_size`) are rendered in a thread. Otherwise only the
+    messages are retrieved in a thread (if there may be any, see
+    :func:`jsonit.http.has_messages`) and the (small) content is encoded
+    directly.
+
+    The rendered response no longer has a ``render`` method, so Django's
+    asynchronous request handler doesn't call it again (in a thread, since
+    it is synchronous).
+    """
+    if not response.is_rendered:
+        threshold = get_encode_threshold()
+        if (isinstance(response, JSONFormResponse) or
+                estimate_size([response.details, response.extra_context],
+                              threshold) > threshold):
+            response = await run_sync(response.render)
+        else:
+            if (response.exception is None and
+                    has_messages(response.request, load=False) is not False):
+                await run_sync(response.prefetch_messages)
+            response = response.render()
+    if isinstance(response, JSONResponse):
+        response.render = None
+    return response
+
+
+class AsyncJSONResponseMixin(JSONResponseMixin):
+    """
+    An asynchronous version of :class:`~jsonit.views.JSONResponseMixin`,
+    where :meth:`get_json_response` is a coroutine.
+
+    The :attr:`~jsonit.views.JSONResponseMixin.json_cache` attribute isn't
+    used by asynchronous views, use the
+    :func:`~jsonit.decorators.cache_json_response` decorator instead.
+
+    :meth:`as_view` always returns a coroutine function, which Django's
+    request handlers run as an asynchronous view (Django 3.1+), even when
+    some of the view's handler methods are synchronous. Synchronous handler
+    methods are run in a thread, so they can access the database.
+    """
+    # Django 4.1+ would only mark the view as asynchronous if all of its
+    # handler methods are coroutines, as_view() takes care of it instead.
+    view_is_async = False
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super(AsyncJSONResponseMixin, cls).as_view(**initkwargs)
+
+        async def async_view(request, *args, **kwargs):
+            return await view(request, *args, **kwargs)
+
+        functools.update_wrapper(async_view, view)
+        return async_view
+
+    async def dispatch(self, request, *args, **kwargs):
+        method = request.method.lower()
+        if method in self.http_method_names:
+            handler = getattr(self, method, self.http_method_not_allowed)
+        else:
+            handler = self.http_method_not_allowed
+        if asyncio.iscoroutinefunction(handler):
+            return await handler(request, *args, **kwargs)
+        response = await run_sync(handler, request, *args, **kwargs)
+        if asyncio.iscoroutine(response):
+            # For example, the handler returned get_json_response().
+            response = await response
+        return response
+
+    async def get_json_response(self, response, details=None, redirect=None):
+        """
+        Override a standard response for AJAX initiated requests, instead
+        returning a JSON response which has been rendered without blocking
+        the event loop.
+
+        Takes the same arguments as
+        :meth:`jsonit.views.JSONResponseMixin.get_json_response`.
+        """
+        response = super(AsyncJSONResponseMixin, self).get_json_response(
+            response, details=details, redirect=redirect)
+        if isinstance(response, JSONResponse):
+            response = await render_response(response)
+        return response
+
+
+class AsyncAJAXMixin(AsyncJSONResponseMixin, AJAXMixin):
+    """
+    An asynchronous version of :class:`~jsonit.views.AJAXMixin`.
+
+    The view's own (synchronous) ``post`` method is run in a thread.
+    """
+
+    async def post(self, *args, **kwargs):
+        """
+        If the request was AJAX initiated, return a :class:`JSONFormResponse`.
+        """
+        post = super(AJAXMixin, self).post
+        if asyncio.iscoroutinefunction(post):
+            response = await post(*args, **kwargs)
+        else:
+            response = await run_sync(post, *args, **kwargs)
+        return await self.get_json_response(response)
+
+
+class AsyncAJAXFormMixin(AsyncAJAXMixin, AJAXFormMixin):
+    """
+    An asynchronous version of :class:`~jsonit.views.AJAXFormMixin`.
+    """
+
+    async def post(self, *args, **kwargs):
+        try:
+            return await super(AsyncAJAXFormMixin, self).post(*args, **kwargs)
+        except InvalidJSONBody as e:
+            return await render_response(error_response(self.request, e))
+
+
+def catch_ajax_exceptions_async(func):
+    """
+    The coroutine function version of
+    :func:`~jsonit.decorators.catch_ajax_exceptions`.
+    """
+
+    @functools.wraps(func)
+    async def dec(request, *args, **kwargs):
+        try:
+            return await func(request, *args, **kwargs)
+        except Exception as e:
+            if request.is_ajax():
+                return await render_response(
+                    JSONResponse(request, exception=e))
+            raise
+
+    return dec
+
+
+def cache_json_response_async(cache, func):
+    """
+    The coroutine function version of
+    :func:`~jsonit.decorators.cache_json_response`, using the
+    :class:`~jsonit.cache.JSONResponseCache` instance ``cache``.
+    """
+
+    @functools.wraps(func)
+    async def dec(request, *args, **kwargs):
+        if not cache.is_cacheable(request):
+            return await func(request, *args, **kwargs)
+        response = await run_sync(cache.get_response, request)
+        if response is None:
+            response = await cache.call_view(request, func, *args, **kwargs)
+            await run_sync(cache.set_response, request, response)
+        return response
+
+    return dec
+
+
+def parse_json_body_async(max_size, func):
+    """
+    The coroutine function version of
+    :func:`~jsonit.decorators.parse_json_body`.
+    """
+
+    @functools.wraps(func)
+    async def dec(request, *args, **kwargs):
+        try:
+            if is_json_request(request):
+                await run_sync(get_json_body, request, max_size)
+            return await func(request, *args, **kwargs)
+        except InvalidJSONBody as e:
+            return await render_response(error_response(request, e))
+
+    return dec
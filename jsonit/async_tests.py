@@ -0,0 +1,319 @@
+"""
+Tests for :mod:`jsonit.aio` and other tests using Python 3 only syntax,
+imported by :mod:`jsonit.tests` on Python 3.5+.
+"""
+import asyncio
+import json
+import threading
+
+from django import forms
+from django.contrib import messages
+from django.core.cache import cache
+from django.db import connection
+from django.test import RequestFactory
+try:
+    from asgiref.sync import async_to_sync
+    from django.test import AsyncClient
+except ImportError:     # Django < 3.1
+    AsyncClient = None
+from django.test.utils import override_settings
+from django.views.generic import FormView, View
+
+from jsonit.aio import (AsyncAJAXFormMixin, AsyncJSONResponseMixin,
+                        render_response)
+from jsonit.decorators import (cache_json_response, catch_ajax_exceptions,
+                               parse_json_body)
+from jsonit.http import JSONResponse, NDJSONResponse
+from jsonit.middleware import JSONExceptionMiddleware
+from jsonit.request import get_json_body
+
+
+def run(coroutine):
+    loop = asyncio.new_event_loop()
+    try:
+        return loop.run_until_complete(coroutine)
+    finally:
+        loop.close()
+
+
+def get_content(response):
+    return json.loads(response.content.decode('utf-8'))
+
+
+class AsyncMixinTest(object):
+    """
+    Mixed into :class:`jsonit.tests.MessageTest` subclasses.
+    """
+
+    def setUp(self):
+        super(AsyncMixinTest, self).setUp()
+        self.request.method = 'GET'
+        self.request.path = '/async/'
+        self.threads = []
+
+    def get_messages(self, request):
+        self.threads.append(threading.current_thread())
+        return []
+
+
+class AsyncRenderTest(AsyncMixinTest):
+
+    def test_small(self):
+        messages.info(self.request, 'Hello')
+        response = JSONResponse(self.request, details={'test': 1})
+        self.assertIs(run(render_response(response)), response)
+        self.assertTrue(response.is_rendered)
+        # Django's request handler won't render the response in a thread.
+        self.assertIsNone(response.render)
+        self.assertEqual(get_content(response)['messages'],
+                         [{'message': 'Hello', 'class': 'info'}])
+
+    def test_messages_in_thread(self):
+        messages.info(self.request, 'Hello')
+        response = JSONResponse(self.request)
+        response.get_messages = lambda: self.get_messages(self.request)
+        run(render_response(response))
+        self.assertEqual(len(self.threads), 1)
+        self.assertIsNot(self.threads[0], threading.current_thread())
+
+    def test_no_messages(self):
+        response = JSONResponse(self.request)
+        response.prefetch_messages = lambda: self.get_messages(self.request)
+        run(render_response(response))
+        self.assertEqual(self.threads, [])
+
+    def test_large_in_thread(self):
+        threads = []
+
+        def build_json(exception=None):
+            threads.append(threading.current_thread())
+            return '{}'
+
+        with override_settings(JSONIT_ASYNC_ENCODE_THRESHOLD=10):
+            response = JSONResponse(self.request,
+                                    details={'rows': list(range(20))})
+            response.build_json = build_json
+            run(render_response(response))
+        self.assertIsNot(threads[0], threading.current_thread())
+
+    def test_mixin(self):
+
+        class AsyncView(AsyncJSONResponseMixin, View):
+            async def get(self, request):
+                return await self.get_json_response(None, details={'a': 1})
+
+        response = run(AsyncView.as_view()(self.request))
+        self.assertTrue(response.is_rendered)
+        self.assertEqual(get_content(response)['details'], {'a': 1})
+
+    def test_form_mixin(self):
+
+        class NameForm(forms.Form):
+            name = forms.CharField()
+
+        class AsyncFormView(AsyncAJAXFormMixin, FormView):
+            form_class = NameForm
+            template_name = 'form.html'
+            success_url = '/done/'
+
+        factory = RequestFactory()
+        request = factory.post('/', {'name': ''},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        response = run(AsyncFormView.as_view()(request))
+        content = get_content(response)
+        self.assertFalse(content['success'])
+        self.assertEqual(list(content['details']['form_errors']), ['id_name'])
+        request = factory.post('/', {'name': 'Chris'},
+                               HTTP_X_REQUESTED_WITH='XMLHttpRequest')
+        content = get_content(run(AsyncFormView.as_view()(request)))
+        self.assertTrue(content['success'])
+        self.assertEqual(content['redirect'], 'http://testserver/done/')
+        request = factory.post('/', b'{"name": ""}',
+                               content_type='application/json')
+        content = get_content(run(AsyncFormView.as_view()(request)))
+        self.assertEqual(list(content['details']['form_errors']), ['id_name'])
+        request = factory.post('/', b'{"name"',
+                               content_type='application/json')
+        response = run(AsyncFormView.as_view()(request))
+        self.assertEqual(response.status_code, 400)
+
+
+class AsyncDecoratorTest(AsyncMixinTest):
+
+    def setUp(self):
+        super(AsyncDecoratorTest, self).setUp()
+        cache.clear()
+
+    def test_catch_ajax_exceptions(self):
+
+        @catch_ajax_exceptions
+        async def view(request):
+            raise ValueError('Broken')
+
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        response = run(view(self.request))
+        self.assertFalse(get_content(response)['success'])
+        del self.request.META['HTTP_X_REQUESTED_WITH']
+        self.assertRaises(ValueError, run, view(self.request))
+
+    def test_cache_json_response(self):
+        calls = []
+
+        @cache_json_response(key_prefix='async')
+        async def view(request):
+            calls.append(request)
+            return JSONResponse(request, details={'calls': len(calls)})
+
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        run(view(self.request)).render()
+        response = run(view(self.request))
+        self.assertEqual(get_content(response)['details'], {'calls': 1})
+
+    def test_parse_json_body(self):
+
+        @parse_json_body(max_size=10)
+        async def view(request):
+            return JSONResponse(request, details=get_json_body(request))
+
+        self.assertTrue(asyncio.iscoroutinefunction(view))
+        factory = RequestFactory()
+        request = factory.post('/', b'{"a": 1}',
+                               content_type='application/json')
+        self.assertEqual(get_content(run(view(request)))['details'], {'a': 1})
+        request = factory.post('/', b'[1, 2, 3, 4, 5]',
+                               content_type='application/json')
+        self.assertEqual(run(view(request)).status_code, 413)
+
+
+class AsyncDetailsView(AsyncJSONResponseMixin, View):
+
+    async def get(self, request):
+        return await self.get_json_response(None, details={'a': 1})
+
+
+class AsyncDatabaseView(AsyncJSONResponseMixin, View):
+
+    def get(self, request):
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT 1')
+            row = cursor.fetchone()
+        return self.get_json_response(None, details={'row': list(row)})
+
+
+class NameForm(forms.Form):
+    name = forms.CharField()
+
+
+class AsyncNameFormView(AsyncAJAXFormMixin, FormView):
+    form_class = NameForm
+    template_name = 'form.html'
+    success_url = '/done/'
+
+
+class AsyncViewClientTest(object):
+    """
+    Asynchronous class-based views requested through the test clients, for
+    both request handlers.
+    """
+
+    def setUp(self):
+        if AsyncClient is None:
+            self.skipTest('Asynchronous views require Django 3.1+.')
+        super(AsyncViewClientTest, self).setUp()
+
+    def request(self, method, path, data=None, **extra):
+        ajax = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'}
+        response = getattr(self.client, method)(path, data, **dict(
+            extra, **ajax))
+
+        async def request():
+            return await getattr(AsyncClient(), method)(
+                path, data, **dict(extra, **{
+                    'X-Requested-With': 'XMLHttpRequest'}))
+
+        async_response = async_to_sync(request)()
+        self.assertEqual(response.status_code, async_response.status_code)
+        self.assertEqual(get_content(response), get_content(async_response))
+        return response
+
+    def test_as_view(self):
+        self.assertTrue(asyncio.iscoroutinefunction(
+            AsyncDetailsView.as_view()))
+        self.assertIs(AsyncDetailsView.as_view().view_class,
+                      AsyncDetailsView)
+
+    def test_mixin(self):
+        response = self.request('get', '/async/details/')
+        self.assertEqual(get_content(response)['details'], {'a': 1})
+
+    def test_sync_handler(self):
+        # Synchronous handlers run outside of the event loop, so they can
+        # access the database.
+        response = self.request('get', '/async/database/')
+        self.assertEqual(get_content(response)['details'], {'row': [1]})
+
+    def test_form_mixin(self):
+        # Django 3.2's AsyncClient can't post multipart data on Python
+        # 3.11+, so use a JSON body which the mixin also accepts.
+        response = self.request('post', '/async/form/', {'name': ''},
+                                content_type='application/json')
+        self.assertEqual(list(get_content(response)['details']
+                              ['form_errors']), ['id_name'])
+        response = self.request('post', '/async/form/', {'name': 'Chris'},
+                                content_type='application/json')
+        self.assertTrue(get_content(response)['success'])
+
+
+class NDJSONReturnTest(object):
+    """
+    Mixed into :class:`jsonit.tests.MessageTest` subclasses.
+    """
+
+    def test_returned_details(self):
+        def run():
+            yield 1
+            return {'total': 1}
+
+        response = NDJSONResponse(self.request, run())
+        lines = [json.loads(chunk.decode('utf-8'))
+                 for chunk in response.streaming_content]
+        self.assertEqual(lines[-1]['details'], {'total': 1})
+
+
+async def async_middleware_error(request):
+    messages.info(request, 'Kept')
+    raise ValueError('Broken')
+
+
+class ASGIMiddlewareTest(object):
+    """
+    Mixed into a :class:`jsonit.tests.MiddlewareTestMixin` test case to run
+    its tests through the ASGI request handler.
+    """
+
+    def setUp(self):
+        if AsyncClient is None:
+            self.skipTest('The ASGI handler requires Django 3.1+.')
+        super(ASGIMiddlewareTest, self).setUp()
+
+    def get(self, path, ajax=True):
+        extra = {'X-Requested-With': 'XMLHttpRequest'} if ajax else {}
+
+        async def get():
+            return await AsyncClient().get(path, **extra)
+
+        return async_to_sync(get)()
+
+    def test_async_capable(self):
+        async def get_response(request):
+            pass
+
+        self.assertTrue(asyncio.iscoroutinefunction(
+            JSONExceptionMiddleware(get_response)))
+        self.assertFalse(asyncio.iscoroutinefunction(
+            JSONExceptionMiddleware(lambda request: None)))
+
+    def test_async_view(self):
+        response = self.get('/middleware/async-error/')
+        self.assertFalse(get_content(response)['success'])
+        self.assertTrue(response.cookies['messages'].value)
@@ -0,0 +1,361 @@
+"""
+JSON backends used by :func:`jsonit.encoder.encode` and
+:func:`jsonit.encoder.decode`.
+
+The backend is chosen with the ``JSONIT_BACKEND`` setting, which can be the
+name of a registered backend or the dotted path to a backend class. The
+standard library ``json`` module is used by default. Set it to ``'auto'`` to
+use the fastest JSON library which can be imported.
+
+Every backend uses the type hooks of :class:`~jsonit.encoder.JsonitEncoder`
+(for lazy translations, messages, dates and any extra encoders) through its
+library's own default-hook mechanism, so the decoded output is identical
+whichever backend is used.
+
+Like the standard library, every backend encodes subclasses of ``str``,
+``int``, ``float``, ``list``, ``tuple`` and ``dict`` as their base type, so
+extra encoders are never used for them.
+"""
+import copy
+import io
+import json
+import threading
+import uuid
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from jsonit.compat import text_type
+
+# Backends tried in order when ``JSONIT_BACKEND`` is set to ``'auto'``.
+AUTO_BACKENDS = ('orjson', 'simplejson', 'json')
+
+_backends = {}
+
+
+class BaseBackend(object):
+    """
+    A JSON library that can be used to encode objects.
+
+    Subclasses must implement :meth:`encode`, and should override
+    :meth:`encode_bytes` if the library can build bytes more efficiently.
+    """
+
+    def __init__(self, encoder):
+        """
+        :param encoder: A configured :class:`~jsonit.encoder.JsonitEncoder`.
+            Its :meth:`~jsonit.encoder.JsonitEncoder.default` method provides
+            the type hooks and its ``indent`` is used for the output.
+        """
+        self.encoder = encoder
+
+    @classmethod
+    def is_available(cls):
+        """
+        Return whether the library this backend uses can be imported.
+        """
+        return True
+
+    def encode(self, object):
+        """
+        Return a JSON string representation of ``object``.
+        """
+        raise NotImplementedError
+
+    def encode_bytes(self, object):
+        """
+        Return the JSON representation of ``object`` as UTF-8 bytes.
+
+        By default the string returned by :meth:`encode` is encoded, backends
+        which can should avoid building the intermediate string.
+        """
+        return self.encode(object).encode('utf-8')
+
+    def decode(self, data):
+        """
+        Return the value decoded from a JSON document (a string, or UTF-8
+        bytes), raising ``ValueError`` if it isn't valid.
+        """
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return json.loads(data)
+
+
+class StdlibBackend(BaseBackend):
+    """
+    Encode using the standard library ``json`` module.
+
+    The C encoder builds the whole (compact) output before returning any of
+    it, so :meth:`encode_bytes` encodes large lists and dictionaries in
+    slices of :attr:`split_size` items, each written to the output buffer
+    before the next is encoded.
+    """
+    #: The number of small chunks joined before each write to the buffer of
+    #: :meth:`encode_bytes`.
+    batch_size = 1024
+    #: Lists (and tuples) and dictionaries with more items than this are
+    #: encoded in slices by :meth:`encode_bytes`...
+    split_size = 100
+    #: ...when they are found within this many levels of nested
+    #: dictionaries.
+    split_depth = 3
+
+    def encode(self, object):
+        return self.encoder.encode(object)
+
+    def encode_bytes(self, object):
+        # Write each chunk to a single buffer as it is encoded, rather than
+        # joining them into a string which is then copied as bytes.
+        buffer = io.BytesIO()
+        write = buffer.write
+        if (self.encoder.indent is None and not self.encoder.sort_keys and
+                self.is_large(object, self.split_depth)):
+            self.write_sliced(object, write, self.split_depth)
+            return buffer.getvalue()
+        chunks = self.encoder.iterencode(object, _one_shot=True)
+        if isinstance(chunks, list):
+            # The C encoder returns its (large) chunks all at once, each is
+            # released once it has been written.
+            chunks.reverse()
+            while chunks:
+                write(chunks.pop().encode('utf-8'))
+        else:
+            # Indented output is encoded in Python, in many small chunks.
+            batch = []
+            for chunk in chunks:
+                batch.append(chunk)
+                if len(batch) == self.batch_size:
+                    write(''.join(batch).encode('utf-8'))
+                    del batch[:]
+            write(''.join(batch).encode('utf-8'))
+        # The buffer's bytes are returned without being copied.
+        return buffer.getvalue()
+
+    def is_large(self, object, depth):
+        """
+        Return whether ``object`` is (or its dictionaries contain, within
+        ``depth`` levels) a list or dictionary with more than
+        :attr:`split_size` items.
+        """
+        if isinstance(object, (list, tuple)):
+            return len(object) > self.split_size
+        if not isinstance(object, dict):
+            return False
+        if len(object) > self.split_size:
+            return True
+        return depth > 1 and any(self.is_large(value, depth - 1)
+                                 for value in object.values())
+
+    def write_sliced(self, object, write, depth):
+        """
+        Write the UTF-8 encoded JSON representation of ``object``, encoding
+        its large lists and dictionaries (see :meth:`is_large`) in slices.
+        """
+        encode = self.encoder.encode
+        size = self.split_size
+        if isinstance(object, dict) and len(object) <= size:
+            if depth <= 1 or not all(isinstance(key, text_type)
+                                     for key in object):
+                write(encode(object).encode('utf-8'))
+                return
+            write(b'{')
+            for i, (key, value) in enumerate(object.items()):
+                if i:
+                    write(self.encoder.item_separator.encode('utf-8'))
+                write((encode(key) +
+                       self.encoder.key_separator).encode('utf-8'))
+                self.write_sliced(value, write, depth - 1)
+            write(b'}')
+        elif (isinstance(object, (dict, list, tuple)) and
+                len(object) > size):
+            if isinstance(object, dict):
+                items, container, brackets = list(object.items()), dict, b'{}'
+            else:
+                items, container, brackets = object, list, b'[]'
+            write(brackets[:1])
+            for start in range(0, len(items), size):
+                if start:
+                    write(self.encoder.item_separator.encode('utf-8'))
+                # Strip the brackets of each slice's encoded container.
+                encoded = encode(container(items[start:start + size]))
+                write(encoded[1:-1].encode('utf-8'))
+            write(brackets[1:])
+        else:
+            write(encode(object).encode('utf-8'))
+
+
+class SimplejsonBackend(BaseBackend):
+    """
+    Encode using `simplejson <https://pypi.python.org/pypi/simplejson>`_ (with
+    its C speedups, if they are compiled).
+    """
+
+    def __init__(self, encoder):
+        super(SimplejsonBackend, self).__init__(encoder)
+        import simplejson
+        self.loads = simplejson.loads
+        # Turn off simplejson's own handling of types the standard library
+        # can't encode so the same type hooks are used for them.
+        self.json_encoder = simplejson.JSONEncoder(
+            default=encoder.default, indent=encoder.indent,
+            use_decimal=False, namedtuple_as_object=False,
+            tuple_as_array=True)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import simplejson
+        except ImportError:
+            return False
+        return True
+
+    def encode(self, object):
+        return self.json_encoder.encode(object)
+
+    def decode(self, data):
+        if isinstance(data, bytes):
+            data = data.decode('utf-8')
+        return self.loads(data)
+
+
+class OrjsonBackend(BaseBackend):
+    """
+    Encode using `orjson <https://pypi.python.org/pypi/orjson>`_.
+
+    orjson can't encode integers outside of the 64-bit range, objects
+    containing them are encoded by the standard library encoder instead
+    (reusing the items of any iterators orjson already consumed).
+
+    Unlike the standard library, which outputs the invalid JSON ``NaN`` and
+    ``Infinity``, orjson encodes non-finite floats as ``null``.
+    """
+
+    def __init__(self, encoder):
+        super(OrjsonBackend, self).__init__(encoder)
+        import orjson
+        self.dumps = orjson.dumps
+        self.loads = orjson.loads
+        self.encode_error = orjson.JSONEncodeError
+        # Copies of the encoder which record the items of the iterators
+        # orjson consumes, and replay them for the standard library encoder.
+        self.local = threading.local()
+        self.recording_encoder = copy.copy(encoder)
+        self.recording_encoder._dispatch = {}
+        self.recording_encoder.encode_iterator = self.record_iterator
+        self.fallback_encoder = copy.copy(encoder)
+        self.fallback_encoder._dispatch = {}
+        self.fallback_encoder.encode_iterator = self.replay_iterator
+        # Dates are passed through to the type hooks since orjson's native
+        # formatting differs from ``isoformat()``, and dataclasses and
+        # subclasses of the JSON types are passed through so they are
+        # handled like the standard library does.
+        self.option = (orjson.OPT_PASSTHROUGH_DATETIME |
+                       orjson.OPT_PASSTHROUGH_DATACLASS |
+                       orjson.OPT_PASSTHROUGH_SUBCLASS |
+                       orjson.OPT_NON_STR_KEYS)
+        if encoder.indent:
+            self.option |= orjson.OPT_INDENT_2
+        # orjson always encodes UUIDs itself, so if an extra encoder would
+        # handle them the standard library encoder is used instead.
+        default_encoders = set(encoder.default_encoders)
+        self.native_uuid = not any(
+            issubclass(cls, uuid.UUID) or issubclass(uuid.UUID, cls)
+            for cls, func in encoder.encoders
+            if (cls, func) not in default_encoders)
+
+    @classmethod
+    def is_available(cls):
+        try:
+            import orjson
+        except ImportError:
+            return False
+        return True
+
+    def encode(self, object):
+        return self.encode_bytes(object).decode('utf-8')
+
+    def encode_bytes(self, object):
+        if not self.native_uuid:
+            return self.encoder.encode(object).encode('utf-8')
+        # Encoding may be nested (for example by an extra encoder).
+        previous = getattr(self.local, 'iterators', None)
+        self.local.iterators = {}
+        try:
+            return self.dumps(object, default=self.recording_encoder.default,
+                              option=self.option)
+        except self.encode_error as e:
+            if 'Integer exceeds' not in str(e):
+                raise
+            return self.fallback_encoder.encode(object).encode('utf-8')
+        finally:
+            self.local.iterators = previous
+
+    def record_iterator(self, o):
+        """
+        Convert an iterator to a list for orjson, recording the list.
+        """
+        items = self.encoder.encode_iterator(o)
+        self.local.iterators[id(o)] = (o, items)
+        return items
+
+    def replay_iterator(self, o):
+        """
+        Return the list recorded for an iterator orjson already consumed.
+        """
+        iterators = getattr(self.local, 'iterators', None) or {}
+        recorded = iterators.get(id(o))
+        if recorded is not None and recorded[0] is o:
+            return recorded[1]
+        return self.encoder.encode_iterator(o)
+
+    def decode(self, data):
+        # orjson reads UTF-8 bytes directly.
+        return self.loads(data)
+
+
+def register_backend(name, backend_class):
+    """
+    Register a backend class so that it can be selected by ``name`` in the
+    ``JSONIT_BACKEND`` setting.
+    """
+    _backends[name] = backend_class
+
+
+def get_backend_class(name):
+    """
+    Return the backend class for a registered backend name (or dotted path to
+    a backend class).
+
+    ``'auto'`` returns the first available backend from
+    :data:`AUTO_BACKENDS`.
+    """
+    if name == 'auto':
+        for name in AUTO_BACKENDS:
+            backend_class = _backends[name]
+            if backend_class.is_available():
+                return backend_class
+    if name in _backends:
+        backend_class = _backends[name]
+    else:
+        try:
+            backend_class = import_string(name)
+        except ImportError as e:
+            raise ImproperlyConfigured(
+                'Error importing JSONit backend %s: "%s"' % (name, e))
+    if not backend_class.is_available():
+        raise ImproperlyConfigured(
+            'The JSONit backend %s is not available.' % name)
+    return backend_class
+
+
+def available_backends():
+    """
+    Return a list of the names of registered backends which can be used.
+    """
+    return [name for name, backend_class in sorted(_backends.items())
+            if backend_class.is_available()]
+
+
+register_backend('json', StdlibBackend)
+register_backend('simplejson', SimplejsonBackend)
+register_backend('orjson', OrjsonBackend)
@@ -0,0 +1,365 @@
+"""
+A view which handles a batch of AJAX requests in a single HTTP request.
+
+Pages which make many small AJAX requests on load can instead post a JSON
+list of sub-requests to a :class:`BatchView`::
+
+    [
+        {"path": "/inbox/count/"},
+        {"path": "/search/", "params": {"q": "jsonit"}},
+        {"path": "/profile/", "method": "POST", "params": {"name": "Chris"}}
+    ]
+
+Each sub-request is dispatched directly to the view its path resolves to,
+sharing the batch request's session, user and message storage. The views are
+expected to return a JSON response (such as those built with
+:class:`~jsonit.views.JSONResponseMixin`).
+
+Only views which opt in can be batched: mark them with a ``batch_allowed``
+attribute set to ``True`` (on the view function or, for class-based views,
+on the view class). Sub-requests for any other view get a ``400`` result.
+
+Sub-requests skip all middleware, only the batch request itself goes through
+it. Sub-requests get the batch request's ``user`` (set by the authentication
+middleware) and are covered by its CSRF check, but no middleware runs for
+each view: there are no ``process_view`` or ``process_exception`` hooks, and
+no middleware changes the sub-requests' responses. Views which rely on
+middleware of their own shouldn't be batched.
+
+The response details contain a ``responses`` list, with a dictionary for each
+sub-request containing its ``path``, ``method``, ``status`` code, ``time``
+taken (in milliseconds) and ``content``. For JSON responses, ``content`` is
+the response's JSON dictionary (without any messages, which are all returned
+once in the batch response's own ``messages``). For other responses it is the
+text of the response.
+
+Views which are safe to run concurrently with the other views of a batch can
+be marked with a ``batch_concurrent`` attribute set to ``True`` as well
+(which also allows them to be batched). These sub-requests
+are run in a thread pool, each with its own copy of the batch request's
+session and message storage: the changes they make to the session and the
+messages they add are applied to the batch request once all of them have
+finished.
+
+Exceptions raised by the views are reported as they would be for a request
+(they are logged to the ``django.request`` logger and the
+``got_request_exception`` signal is sent), and are returned in a ``500``
+result.
+"""
+import copy
+import json
+import logging
+import timeit
+try:
+    from concurrent.futures import ThreadPoolExecutor
+except ImportError:     # Python 2 without the futures backport.
+    ThreadPoolExecutor = None
+try:
+    from urllib.parse import urlsplit
+except ImportError:     # Python 2
+    from urlparse import urlsplit
+
+from django import http
+from django.contrib.messages.storage.base import BaseStorage
+from django.contrib.sessions.backends.base import SessionBase
+from django.core.exceptions import PermissionDenied
+from django.core.signals import got_request_exception
+from django.db import close_old_connections
+try:
+    from django.urls import Resolver404, resolve
+except ImportError:     # Django < 1.10
+    from django.core.urlresolvers import Resolver404, resolve
+from django.views.generic import View
+
+from jsonit.compat import text_type
+from jsonit.http import BaseJSONResponse, JSONResponse
+
+# Request attributes shared with sub-requests.
+SHARED_ATTRIBUTES = ('session', 'user', '_messages', 'LANGUAGE_CODE',
+                     'COOKIES', 'urlconf')
+# Headers which only apply to the batch response itself.
+BATCH_HEADERS = ('HTTP_ACCEPT', 'HTTP_ACCEPT_ENCODING', 'HTTP_IF_NONE_MATCH',
+                 'HTTP_IF_MODIFIED_SINCE', 'CONTENT_LENGTH', 'CONTENT_TYPE')
+
+logger = logging.getLogger('django.request')
+
+
+class SessionCopy(SessionBase):
+    """
+    A copy of the batch request's session for a concurrent sub-request, which
+    is never saved itself.
+    """
+
+    def __init__(self, session):
+        self.original = copy.deepcopy(dict(session.items()))
+        super(SessionCopy, self).__init__()
+        # The copy has no session key, so it would never be loaded.
+        self._session_cache = self.load()
+
+    def load(self):
+        return copy.deepcopy(self.original)
+
+    def exists(self, session_key):
+        return False
+
+    def create(self):
+        pass
+
+    def save(self, must_create=False):
+        pass
+
+    def delete(self, session_key=None):
+        pass
+
+    def apply(self, session):
+        """
+        Apply the changes made to the copy to ``session``.
+        """
+        for key in self.original:
+            if key not in self:
+                del session[key]
+        for key, value in self.items():
+            if key not in self.original or value != self.original[key]:
+                session[key] = value
+
+
+class QueuedMessageStorage(BaseStorage):
+    """
+    Collects the messages added by a concurrent sub-request.
+    """
+
+    def _get(self, *args, **kwargs):
+        return [], True
+
+    def _store(self, messages, response, *args, **kwargs):
+        return []
+
+
+class BatchView(View):
+    """
+    Handle a batch of AJAX requests posted as a JSON list.
+    """
+    http_method_names = ['post']
+    #: The maximum number of sub-requests in a batch.
+    max_requests = 20
+    #: The maximum number of threads used to run concurrent sub-requests.
+    max_workers = 4
+
+    def post(self, request, *args, **kwargs):
+        try:
+            subrequests = self.get_subrequests(request)
+        except ValueError as e:
+            response = JSONResponse(request, success=False,
+                                    details={'error': text_type(e)})
+            response.status_code = 400
+            return response
+        results = [None] * len(subrequests)
+        concurrent = []
+        for i, subrequest in enumerate(subrequests):
+            if ThreadPoolExecutor is not None and self.is_concurrent(
+                    subrequest):
+                concurrent.append((i, subrequest))
+            else:
+                results[i] = self.run(subrequest)
+        if concurrent:
+            merges = [self.isolate(request, subrequest[0])
+                      for i, subrequest in concurrent]
+            workers = min(self.max_workers, len(concurrent))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [(i, executor.submit(self.run_in_thread, subrequest))
+                           for i, subrequest in concurrent]
+                for i, future in futures:
+                    results[i] = future.result()
+            for merge in merges:
+                merge()
+        return JSONResponse(request, details={'responses': results})
+
+    def get_subrequests(self, request):
+        """
+        Parse the posted sub-requests, returning a list of
+        ``(request, match)`` tuples (see :meth:`build_subrequest`).
+
+        Raises ``ValueError`` if the batch isn't valid.
+        """
+        try:
+            batch = json.loads(request.body.decode(request.encoding or
+                                                   'utf-8'))
+        except ValueError:
+            raise ValueError('The batch is not valid JSON.')
+        if not isinstance(batch, list):
+            raise ValueError('The batch must be a list of requests.')
+        if len(batch) > self.max_requests:
+            raise ValueError('A batch may contain at most %s requests.' %
+                             self.max_requests)
+        subrequests = []
+        for item in batch:
+            if not isinstance(item, dict) or 'path' not in item:
+                raise ValueError('Each request must contain a path.')
+            path = item['path']
+            method = item.get('method', 'GET')
+            params = item.get('params') or {}
+            if not isinstance(path, text_type):
+                raise ValueError('The path of a request must be a string.')
+            if not isinstance(method, text_type):
+                raise ValueError('The method of a request must be a string.')
+            if not isinstance(params, dict):
+                raise ValueError('The params of a request must be an object.')
+            subrequests.append(self.build_subrequest(request, path, method,
+                                                     params))
+        return subrequests
+
+    def build_subrequest(self, request, path, method, params):
+        """
+        Build a sub-request, returning a ``(request, match)`` tuple where
+        ``match`` is the resolved URL (or ``None`` if it didn't resolve).
+        """
+        url = urlsplit(path)
+        subrequest = http.HttpRequest()
+        subrequest.method = method.upper()
+        subrequest.path = subrequest.path_info = url.path
+        subrequest.META = dict(request.META, REQUEST_METHOD=subrequest.method,
+                               PATH_INFO=url.path, QUERY_STRING=url.query)
+        for header in BATCH_HEADERS:
+            subrequest.META.pop(header, None)
+        for attr in SHARED_ATTRIBUTES:
+            if hasattr(request, attr):
+                setattr(subrequest, attr, getattr(request, attr))
+        query = http.QueryDict(url.query, mutable=True)
+        data = query if subrequest.method == 'GET' else http.QueryDict(
+            mutable=True)
+        for name, value in params.items():
+            if not isinstance(value, list):
+                value = [value]
+            data.setlist(name, [text_type(v) for v in value])
+        subrequest.GET = query
+        if data is not query:
+            subrequest.POST = data
+        try:
+            match = resolve(url.path, getattr(request, 'urlconf', None))
+        except Resolver404:
+            match = None
+        if match is not None:
+            subrequest.resolver_match = match
+        return subrequest, match
+
+    def get_view_option(self, match, name):
+        """
+        Return whether the view of a resolved URL is marked with the
+        ``name`` attribute (on the view function, or on its view class).
+        """
+        view = match.func
+        return bool(getattr(view, name, False) or
+                    getattr(getattr(view, 'view_class', None), name, False))
+
+    def is_allowed(self, subrequest):
+        """
+        Return whether the view for a sub-request may be batched.
+        """
+        request, match = subrequest
+        return (self.get_view_option(match, 'batch_allowed') or
+                self.get_view_option(match, 'batch_concurrent'))
+
+    def is_concurrent(self, subrequest):
+        """
+        Return whether the view for a sub-request can be run concurrently.
+        """
+        request, match = subrequest
+        if match is None:
+            return False
+        return self.get_view_option(match, 'batch_concurrent')
+
+    def isolate(self, request, subrequest):
+        """
+        Give a sub-request which is run concurrently its own copies of the
+        batch request's session and message storage (which aren't thread
+        safe), returning a function which applies the changes made to them
+        to the batch request.
+        """
+        session = getattr(request, 'session', None)
+        storage = getattr(request, '_messages', None)
+        user = getattr(request, 'user', None)
+        if user is not None:
+            # Load a lazy user before the threads share it.
+            getattr(user, 'pk', None)
+        if session is not None:
+            subrequest.session = SessionCopy(session)
+        if storage is not None:
+            subrequest._messages = QueuedMessageStorage(subrequest)
+            subrequest._messages.level = storage.level
+
+        def merge():
+            if session is not None:
+                subrequest.session.apply(session)
+            if storage is not None:
+                for message in subrequest._messages._queued_messages:
+                    storage.add(message.level, message.message,
+                                message.extra_tags)
+
+        return merge
+
+    def run_in_thread(self, subrequest):
+        close_old_connections()
+        try:
+            return self.run(subrequest)
+        finally:
+            close_old_connections()
+
+    def run(self, subrequest):
+        """
+        Dispatch a sub-request to its view, returning its result dictionary.
+        """
+        request, match = subrequest
+        start = timeit.default_timer()
+        if match is None:
+            response = http.HttpResponseNotFound()
+        elif (getattr(match.func, 'view_class', None) is type(self) or
+                not self.is_allowed(subrequest)):
+            response = http.HttpResponseBadRequest()
+        else:
+            try:
+                response = match.func(request, *match.args, **match.kwargs)
+            except http.Http404:
+                response = http.HttpResponseNotFound()
+            except PermissionDenied:
+                response = http.HttpResponseForbidden()
+            except Exception as e:
+                self.report_exception(request)
+                response = JSONResponse(request, exception=e)
+                response.status_code = 500
+        result = {
+            'path': request.get_full_path(),
+            'method': request.method,
+            'status': response.status_code,
+            'content': self.get_content(response),
+        }
+        result['time'] = round((timeit.default_timer() - start) * 1000, 3)
+        return result
+
+    def report_exception(self, request):
+        """
+        Report the exception being handled for a sub-request, as Django does
+        for the exceptions of a request.
+        """
+        got_request_exception.send(sender=self.__class__, request=request)
+        logger.error('Internal Server Error (batch): %s', request.path,
+                     exc_info=True,
+                     extra={'status_code': 500, 'request': request})
+
+    def get_content(self, response):
+        """
+        Return the content of a sub-request's response for the results.
+        """
+        if response.status_code == 304:
+            return None
+        if (isinstance(response, BaseJSONResponse) and
+                not response.streaming and not response.is_rendered):
+            response.consume_messages = False
+            return response.build_content(response.exception)
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+        content = content.decode(response.charset)
+        if response.get('Content-Type', '').startswith('application/json'):
+            return json.loads(content)
+        return content
@@ -0,0 +1,538 @@
+"""
+Binary encodings of the JSON dictionary, for clients which would rather not
+parse JSON text.
+
+When binary encodings are turned on (with the ``JSONIT_BINARY`` setting, or
+for individual responses with their ``binary`` argument), a
+:class:`~jsonit.http.JSONResponse` is encoded as `MessagePack
+<https://msgpack.org/>`_ or `CBOR <https://cbor.io/>`_ (:rfc:`8949`) for
+requests whose ``Accept`` header prefers ``application/msgpack`` or
+``application/cbor`` over ``application/json``. Wildcards never select a
+binary encoding, so browsers keep receiving JSON.
+
+The dictionary is the same as the JSON one, and values are converted with the
+same type hooks (see :class:`~jsonit.encoder.JsonitEncoder`), so lazy
+translations, messages, dates, models and the response's extra encoders are
+represented just as they are in JSON. :class:`~jsonit.encoder.RawJSON` values
+are decoded first. Dictionary keys are converted to strings as JSON converts
+them (so ``{1: 'one'}`` becomes ``{'1': 'one'}``), so clients receive the
+same shape whichever format they prefer.
+
+The `msgpack <https://pypi.python.org/pypi/msgpack>`_ and `cbor2
+<https://pypi.python.org/pypi/cbor2>`_ libraries are used if they can be
+imported, otherwise the pure Python implementations in this module are used.
+"""
+import json
+import struct
+
+from django.conf import settings
+
+from jsonit.compat import PY2, integer_types, text_type
+from jsonit.encoder import RawJSON, get_encoder
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+try:
+    import cbor2
+except ImportError:
+    cbor2 = None
+
+
+def binary_enabled():
+    """
+    Return whether JSON responses negotiate binary encodings by default (the
+    ``JSONIT_BINARY`` setting).
+    """
+    return getattr(settings, 'JSONIT_BINARY', False)
+
+
+def parse_accept(header):
+    """
+    Return a dictionary of the media types in an ``Accept`` header, mapped to
+    their quality values.
+    """
+    accepted = {}
+    for media_range in header.split(','):
+        params = media_range.split(';')
+        media_type = params[0].strip().lower()
+        if not media_type:
+            continue
+        quality = 1.0
+        for param in params[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[media_type] = quality
+    return accepted
+
+
+def json_key(key):
+    """
+    Return a dictionary key converted to a string, as JSON converts it.
+    """
+    if isinstance(key, text_type):
+        return key
+    if PY2 and isinstance(key, bytes):
+        return key.decode('utf-8')
+    if key is None or isinstance(key, (bool, float) + integer_types):
+        return text_type(json.dumps(key))
+    raise TypeError('Dictionary keys must be strings, numbers, booleans or '
+                    'None, not %r.' % key)
+
+
+def get_format(request, encoders=None):
+    """
+    Return the binary format which the client making the request prefers to
+    JSON, or ``None``.
+
+    :param encoders: The extra encoders of the response (see
+        :func:`~jsonit.encoder.get_encoder`).
+    """
+    header = request.META.get('HTTP_ACCEPT')
+    if not header:
+        return None
+    accepted = parse_accept(header)
+    best_quality = max(accepted.get('application/json', 0),
+                       accepted.get('application/*', 0),
+                       accepted.get('*/*', 0))
+    best = None
+    for format_class in FORMATS:
+        quality = max(accepted.get(content_type, 0)
+                      for content_type in format_class.content_types)
+        if quality > best_quality:
+            best, best_quality = format_class, quality
+    if best is None:
+        return None
+    return best(get_encoder(encoders))
+
+
+class BaseFormat(object):
+    """
+    A binary encoding of the JSON dictionary.
+
+    Subclasses must implement :meth:`encode` and :meth:`decode`.
+    """
+    #: The name of the format.
+    name = None
+    #: The media types which select the format, the first being used as the
+    #: response's ``Content-Type``.
+    content_types = ()
+
+    def __init__(self, encoder):
+        """
+        :param encoder: A configured :class:`~jsonit.encoder.JsonitEncoder`,
+            which provides the type hooks.
+        """
+        self.encoder = encoder
+
+    @property
+    def content_type(self):
+        return self.content_types[0]
+
+    def default(self, value):
+        """
+        Convert a value which the format can't represent, using the JSON
+        type hooks.
+        """
+        if isinstance(value, RawJSON):
+            return json.loads(value.encoded)
+        return self.encoder.default(value)
+
+    def prepare(self, value):
+        """
+        Return ``value`` with the keys of any dictionaries converted to
+        strings (see :func:`json_key`), as they are in JSON.
+
+        The pure Python encoders convert keys as they go, this is only needed
+        for the libraries (which have no hook for keys).
+        """
+        if isinstance(value, dict):
+            return dict((key if isinstance(key, text_type) else json_key(key),
+                         self.prepare(item))
+                        for key, item in value.items())
+        if isinstance(value, (list, tuple)):
+            return [self.prepare(item) for item in value]
+        return value
+
+    def prepare_default(self, value):
+        return self.prepare(self.default(value))
+
+    def encode(self, value):
+        """
+        Return the encoded bytes of ``value``.
+        """
+        raise NotImplementedError
+
+    def decode(self, data):
+        """
+        Return the value decoded from ``data`` (bytes).
+        """
+        raise NotImplementedError
+
+
+class MessagePackFormat(BaseFormat):
+    name = 'msgpack'
+    content_types = ('application/msgpack', 'application/x-msgpack')
+
+    def encode(self, value):
+        if msgpack is not None:
+            return msgpack.packb(self.prepare(value),
+                                 default=self.prepare_default,
+                                 use_bin_type=True)
+        return pack_msgpack(value, self.default, json_key)
+
+    def decode(self, data):
+        if msgpack is not None:
+            return msgpack.unpackb(data, raw=False, strict_map_key=False)
+        return unpack_msgpack(data)
+
+
+class CBORFormat(BaseFormat):
+    name = 'cbor'
+    content_types = ('application/cbor',)
+
+    def encode(self, value):
+        if cbor2 is not None:
+            return cbor2.dumps(self.prepare(value),
+                               default=self.cbor2_default)
+        return pack_cbor(value, self.default, json_key)
+
+    def cbor2_default(self, encoder, value):
+        encoder.encode(self.prepare_default(value))
+
+    def decode(self, data):
+        if cbor2 is not None:
+            return cbor2.loads(data)
+        return unpack_cbor(data)
+
+
+#: The binary formats, in order of preference.
+FORMATS = [MessagePackFormat, CBORFormat]
+
+
+class Reader(object):
+    """
+    Reads the encoded data for the pure Python decoders.
+    """
+
+    def __init__(self, data):
+        if PY2:
+            data = bytearray(data)
+        self.data = data
+        self.offset = 0
+
+    def byte(self):
+        try:
+            value = self.data[self.offset]
+        except IndexError:
+            raise ValueError('Truncated data.')
+        self.offset += 1
+        return value
+
+    def read(self, size):
+        start = self.offset
+        self.offset += size
+        if self.offset > len(self.data):
+            raise ValueError('Truncated data.')
+        return bytes(self.data[start:self.offset])
+
+    def unpack(self, fmt):
+        size = struct.calcsize(fmt)
+        return struct.unpack(fmt, self.read(size))[0]
+
+    def finish(self, value):
+        if self.offset != len(self.data):
+            raise ValueError('Extra data after the encoded value.')
+        return value
+
+
+# MessagePack -----------------------------------------------------------------
+
+def pack_msgpack(value, default, convert_key=None):
+    """
+    Encode ``value`` as MessagePack, calling ``default`` to convert any
+    values of other types than ``None``, booleans, numbers, strings, bytes,
+    lists, tuples and dictionaries.
+
+    :param convert_key: An optional function converting dictionary keys
+        which aren't strings.
+    """
+    chunks = []
+    _pack_msgpack(value, default, chunks.append, convert_key)
+    return b''.join(chunks)
+
+
+def _pack_msgpack_header(size, fix, fix_max, markers, write):
+    if size <= fix_max:
+        write(struct.pack('B', fix | size))
+    elif size <= 0xffff and markers[0] is not None:
+        write(struct.pack('>BH', markers[0], size))
+    else:
+        write(struct.pack('>BI', markers[1], size))
+
+
+def _pack_msgpack(value, default, write, convert_key=None):
+    if value is None:
+        write(b'\xc0')
+    elif value is True:
+        write(b'\xc3')
+    elif value is False:
+        write(b'\xc2')
+    elif isinstance(value, integer_types):
+        if 0 <= value < 0x80:
+            write(struct.pack('B', value))
+        elif -32 <= value < 0:
+            write(struct.pack('b', value))
+        elif value > 0:
+            for marker, fmt, limit in ((0xcc, '>BB', 0xff),
+                                       (0xcd, '>BH', 0xffff),
+                                       (0xce, '>BI', 0xffffffff),
+                                       (0xcf, '>BQ', 0xffffffffffffffff)):
+                if value <= limit:
+                    write(struct.pack(fmt, marker, value))
+                    break
+            else:
+                raise OverflowError('Integer too large for MessagePack.')
+        else:
+            for marker, fmt, limit in ((0xd0, '>Bb', -0x80),
+                                       (0xd1, '>Bh', -0x8000),
+                                       (0xd2, '>Bi', -0x80000000),
+                                       (0xd3, '>Bq', -0x8000000000000000)):
+                if value >= limit:
+                    write(struct.pack(fmt, marker, value))
+                    break
+            else:
+                raise OverflowError('Integer too small for MessagePack.')
+    elif isinstance(value, float):
+        write(struct.pack('>Bd', 0xcb, value))
+    elif isinstance(value, text_type):
+        data = value.encode('utf-8')
+        size = len(data)
+        if size < 32:
+            write(struct.pack('B', 0xa0 | size))
+        elif size <= 0xff:
+            write(struct.pack('>BB', 0xd9, size))
+        else:
+            _pack_msgpack_header(size, 0, -1, (0xda, 0xdb), write)
+        write(data)
+    elif isinstance(value, bytes):
+        size = len(value)
+        if size <= 0xff:
+            write(struct.pack('>BB', 0xc4, size))
+        else:
+            _pack_msgpack_header(size, 0, -1, (0xc5, 0xc6), write)
+        write(value)
+    elif isinstance(value, (list, tuple)):
+        _pack_msgpack_header(len(value), 0x90, 15, (0xdc, 0xdd), write)
+        for item in value:
+            _pack_msgpack(item, default, write, convert_key)
+    elif isinstance(value, dict):
+        _pack_msgpack_header(len(value), 0x80, 15, (0xde, 0xdf), write)
+        for key, item in value.items():
+            if convert_key is not None and not isinstance(key, text_type):
+                key = convert_key(key)
+            _pack_msgpack(key, default, write)
+            _pack_msgpack(item, default, write, convert_key)
+    else:
+        _pack_msgpack(default(value), default, write, convert_key)
+
+
+def unpack_msgpack(data):
+    """
+    Decode a value encoded as MessagePack. Extension types aren't supported.
+    """
+    reader = Reader(data)
+    return reader.finish(_unpack_msgpack(reader))
+
+
+_MSGPACK_FORMATS = {
+    0xca: '>f', 0xcb: '>d',
+    0xcc: '>B', 0xcd: '>H', 0xce: '>I', 0xcf: '>Q',
+    0xd0: '>b', 0xd1: '>h', 0xd2: '>i', 0xd3: '>q',
+}
+_MSGPACK_SIZES = {
+    0xc4: '>B', 0xc5: '>H', 0xc6: '>I',
+    0xd9: '>B', 0xda: '>H', 0xdb: '>I',
+    0xdc: '>H', 0xdd: '>I',
+    0xde: '>H', 0xdf: '>I',
+}
+
+
+def _unpack_msgpack(reader):
+    marker = reader.byte()
+    if marker < 0x80:
+        return marker
+    if marker >= 0xe0:
+        return marker - 0x100
+    if marker < 0x90:
+        return _unpack_msgpack_map(reader, marker & 0x0f)
+    if marker < 0xa0:
+        return _unpack_msgpack_array(reader, marker & 0x0f)
+    if marker < 0xc0:
+        return reader.read(marker & 0x1f).decode('utf-8')
+    if marker == 0xc0:
+        return None
+    if marker == 0xc2:
+        return False
+    if marker == 0xc3:
+        return True
+    if marker in _MSGPACK_FORMATS:
+        return reader.unpack(_MSGPACK_FORMATS[marker])
+    if marker in _MSGPACK_SIZES:
+        size = reader.unpack(_MSGPACK_SIZES[marker])
+        if marker <= 0xc6:
+            return reader.read(size)
+        if marker <= 0xdb:
+            return reader.read(size).decode('utf-8')
+        if marker <= 0xdd:
+            return _unpack_msgpack_array(reader, size)
+        return _unpack_msgpack_map(reader, size)
+    raise ValueError('Unsupported MessagePack type 0x%02x.' % marker)
+
+
+def _unpack_msgpack_array(reader, size):
+    return [_unpack_msgpack(reader) for i in range(size)]
+
+
+def _unpack_msgpack_map(reader, size):
+    value = {}
+    for i in range(size):
+        key = _unpack_msgpack(reader)
+        value[key] = _unpack_msgpack(reader)
+    return value
+
+
+# CBOR ------------------------------------------------------------------------
+
+def pack_cbor(value, default, convert_key=None):
+    """
+    Encode ``value`` as CBOR, calling ``default`` to convert any values of
+    other types than ``None``, booleans, numbers, strings, bytes, lists,
+    tuples and dictionaries.
+
+    Integers too large for 64 bits are encoded as bignums.
+
+    :param convert_key: An optional function converting dictionary keys
+        which aren't strings.
+    """
+    chunks = []
+    _pack_cbor(value, default, chunks.append, convert_key)
+    return b''.join(chunks)
+
+
+def _pack_cbor_header(major, size, write):
+    major <<= 5
+    if size < 24:
+        write(struct.pack('B', major | size))
+    elif size <= 0xff:
+        write(struct.pack('>BB', major | 24, size))
+    elif size <= 0xffff:
+        write(struct.pack('>BH', major | 25, size))
+    elif size <= 0xffffffff:
+        write(struct.pack('>BI', major | 26, size))
+    else:
+        write(struct.pack('>BQ', major | 27, size))
+
+
+def _pack_cbor(value, default, write, convert_key=None):
+    if value is None:
+        write(b'\xf6')
+    elif value is True:
+        write(b'\xf5')
+    elif value is False:
+        write(b'\xf4')
+    elif isinstance(value, integer_types):
+        major = 0
+        if value < 0:
+            major, value = 1, -1 - value
+        if value <= 0xffffffffffffffff:
+            _pack_cbor_header(major, value, write)
+        else:
+            # A positive (tag 2) or negative (tag 3) bignum.
+            _pack_cbor_header(6, 2 + major, write)
+            data = bytearray()
+            while value:
+                data.insert(0, value & 0xff)
+                value >>= 8
+            _pack_cbor(bytes(data), default, write)
+    elif isinstance(value, float):
+        write(struct.pack('>Bd', 0xfb, value))
+    elif isinstance(value, text_type):
+        data = value.encode('utf-8')
+        _pack_cbor_header(3, len(data), write)
+        write(data)
+    elif isinstance(value, bytes):
+        _pack_cbor_header(2, len(value), write)
+        write(value)
+    elif isinstance(value, (list, tuple)):
+        _pack_cbor_header(4, len(value), write)
+        for item in value:
+            _pack_cbor(item, default, write, convert_key)
+    elif isinstance(value, dict):
+        _pack_cbor_header(5, len(value), write)
+        for key, item in value.items():
+            if convert_key is not None and not isinstance(key, text_type):
+                key = convert_key(key)
+            _pack_cbor(key, default, write)
+            _pack_cbor(item, default, write, convert_key)
+    else:
+        _pack_cbor(default(value), default, write, convert_key)
+
+
+def unpack_cbor(data):
+    """
+    Decode a value encoded as CBOR. Indefinite length items aren't supported,
+    and tags other than bignums are ignored (the tagged value is returned).
+    """
+    reader = Reader(data)
+    return reader.finish(_unpack_cbor(reader))
+
+
+_CBOR_SIZES = {24: '>B', 25: '>H', 26: '>I', 27: '>Q'}
+_CBOR_SIMPLE = {20: False, 21: True, 22: None, 23: None}
+_CBOR_FLOATS = {25: '>e', 26: '>f', 27: '>d'}
+
+
+def _unpack_cbor(reader):
+    initial = reader.byte()
+    major, info = initial >> 5, initial & 0x1f
+    if major == 7:
+        if info in _CBOR_SIMPLE:
+            return _CBOR_SIMPLE[info]
+        if info in _CBOR_FLOATS:
+            return reader.unpack(_CBOR_FLOATS[info])
+        raise ValueError('Unsupported CBOR simple value %d.' % info)
+    if info < 24:
+        size = info
+    elif info in _CBOR_SIZES:
+        size = reader.unpack(_CBOR_SIZES[info])
+    else:
+        raise ValueError('Unsupported CBOR length 0x%02x.' % initial)
+    if major == 0:
+        return size
+    if major == 1:
+        return -1 - size
+    if major == 2:
+        return reader.read(size)
+    if major == 3:
+        return reader.read(size).decode('utf-8')
+    if major == 4:
+        return [_unpack_cbor(reader) for i in range(size)]
+    if major == 5:
+        value = {}
+        for i in range(size):
+            key = _unpack_cbor(reader)
+            value[key] = _unpack_cbor(reader)
+        return value
+    value = _unpack_cbor(reader)
+    if size in (2, 3) and isinstance(value, bytes):
+        number = 0
+        for byte in bytearray(value):
+            number = (number << 8) | byte
+        return number if size == 2 else -1 - number
+    return value
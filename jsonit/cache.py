@@ -0,0 +1,236 @@
+"""
+Server-side caching of JSON responses.
+
+Only the encoded ``details`` (and ``extra_context``) of a response are cached.
+The user's messages are still retrieved for every request and spliced into
+the cached content, so a cache hit never needs anything to be re-encoded.
+
+Use the :func:`~jsonit.decorators.cache_json_response` decorator for function
+views, or set the :attr:`~jsonit.views.JSONResponseMixin.json_cache` attribute
+of a class-based view to a :class:`JSONResponseCache` instance::
+
+    class Dashboard(JSONResponseMixin, View):
+        json_cache = JSONResponseCache(timeout=60)
+
+Entries are cached separately for each authenticated user by default (all
+anonymous users share them). Pass ``vary_on_user=False`` for views whose
+details are the same for every user, and a ``key_func`` for details which
+depend on anything else about the request, such as the session.
+"""
+import hashlib
+import uuid
+
+from django.core.cache import caches
+from django.utils import translation
+
+from jsonit.compat import is_authenticated
+from jsonit.compression import compress, compression_enabled
+from jsonit.encoder import RawJSON
+from jsonit.http import JSONResponse, get_requested_fields
+
+
+class RequestCache(object):
+    """
+    The cache and key options shared by the caches which store something for
+    each request's URL (see :class:`JSONResponseCache` and
+    :class:`~jsonit.delta.DeltaStore`).
+    """
+    #: Namespaces the keys of each kind of cache.
+    key_namespace = 'cache'
+    #: Query parameters which are never part of the cache key.
+    ignored_params = ()
+
+    def __init__(self, timeout=None, key_prefix='', cache_alias='default',
+                 vary_on_user=True, vary_on_language=True,
+                 vary_on_params=True, key_func=None):
+        """
+        :param timeout: The number of seconds to cache entries for. Defaults
+            to the cache's default timeout.
+        :param key_prefix: A prefix for the cache keys, useful to cache the
+            same URL differently or to clear entries by changing it.
+        :param cache_alias: The cache (from the ``CACHES`` setting) to use.
+        :param vary_on_user: Cache entries separately for each
+            authenticated user.
+        :param vary_on_language: Cache entries separately for each active
+            language.
+        :param vary_on_params: Cache entries separately for different query
+            parameters. Either ``True`` for all parameters, or a list of the
+            names of parameters to vary on.
+        :param key_func: An optional function which is passed the request and
+            returns a string to add to the cache key.
+        """
+        self.timeout = timeout
+        self.key_prefix = key_prefix
+        self.cache_alias = cache_alias
+        self.vary_on_user = vary_on_user
+        self.vary_on_language = vary_on_language
+        self.vary_on_params = vary_on_params
+        self.key_func = key_func
+
+    @property
+    def cache(self):
+        return caches[self.cache_alias]
+
+    def get_key(self, request):
+        """
+        Return the cache key for this request.
+        """
+        parts = [request.path]
+        if self.vary_on_params:
+            if self.vary_on_params is True:
+                params = sorted(item for item in request.GET.lists()
+                                if item[0] not in self.ignored_params)
+            else:
+                params = [(name, request.GET.getlist(name))
+                          for name in self.vary_on_params]
+            parts.append(repr(params))
+        if self.vary_on_user:
+            user = getattr(request, 'user', None)
+            parts.append(str(user.pk if user is not None and
+                             is_authenticated(user) else ''))
+        if self.vary_on_language:
+            parts.append(translation.get_language() or '')
+        if self.key_func:
+            parts.append(self.key_func(request))
+        fields = get_requested_fields(request)
+        if fields:
+            parts.append(','.join(fields))
+        key = hashlib.md5('\n'.join(parts).encode('utf-8')).hexdigest()
+        return 'jsonit.%s.%s.%s' % (self.key_namespace, self.key_prefix, key)
+
+    def get_timeout_kwargs(self):
+        if self.timeout is None:
+            return {}
+        return {'timeout': self.timeout}
+
+
+class JSONResponseCache(RequestCache):
+    """
+    Cache the JSON responses of AJAX ``GET`` (and ``HEAD``) requests.
+    """
+
+    def __init__(self, timeout=None, key_prefix='', cache_alias='default',
+                 vary_on_user=True, vary_on_language=True,
+                 vary_on_params=True, key_func=None, compress=None):
+        """
+        See :class:`RequestCache` for the cache and key options.
+
+        :param compress: Whether to compress cached responses. Defaults to the
+            ``JSONIT_COMPRESS`` setting. The compressed content of responses
+            without any messages is also cached, so it is only compressed once
+            for each content coding.
+        """
+        super(JSONResponseCache, self).__init__(
+            timeout=timeout, key_prefix=key_prefix, cache_alias=cache_alias,
+            vary_on_user=vary_on_user, vary_on_language=vary_on_language,
+            vary_on_params=vary_on_params, key_func=key_func)
+        self.compress = compress
+
+    def is_cacheable(self, request):
+        """
+        Return whether the response to this request may be cached.
+        """
+        return request.method in ('GET', 'HEAD') and request.is_ajax()
+
+    def get_response(self, request):
+        """
+        Return a JSON response built from the cached entry for this request,
+        or ``None`` if it isn't cached.
+        """
+        key = self.get_key(request)
+        entry = self.cache.get(key)
+        if entry is None:
+            return None
+        extra_context = entry['extra_context']
+        if extra_context is not None:
+            extra_context = RawJSON(extra_context, validate=False)
+        details = RawJSON(entry['details'], validate=False)
+        response = JSONResponse(request, details=details,
+                                success=entry['success'],
+                                redirect=entry['redirect'],
+                                extra_context=extra_context, compress=False)
+        response.render()
+        compress = self.compress
+        if compress is None:
+            compress = compression_enabled()
+        if compress:
+            if response.messages:
+                response.compress_content()
+            else:
+                version = entry['version']
+                if response.format is not None:
+                    version = '%s.%s' % (version, response.format.name)
+                self.compress_response(response, '%s.%s' % (key, version))
+        return response
+
+    def compress_response(self, response, key):
+        """
+        Compress a response built from a cache entry, using the cached
+        compressed content if it is available.
+        """
+        encoding = response.get_content_encoding()
+        if encoding is None:
+            return
+        key = '%s.%s' % (key, encoding)
+        content = self.cache.get(key)
+        if content is None:
+            content = compress(response.content, encoding)
+            self.cache.set(key, content, **self.get_timeout_kwargs())
+        response.set_compressed_content(encoding, content)
+
+    def set_response(self, request, response):
+        """
+        Cache the encoded details of a response once it is rendered, as long
+        as it is a (non-streaming) JSON response for a successful request.
+
+        The details are cached just as the response encoded them, so they
+        are only encoded once. Responses limited to a selection of fields
+        aren't cached, nor are responses rendered before they were passed
+        here, unless the view was called by :meth:`serve` (which has their
+        details kept).
+        """
+        if not isinstance(response, JSONResponse) or response.field_paths:
+            return
+        if not response.is_rendered:
+            response.keep_encoded = True
+        response.add_post_render_callback(
+            lambda response: self.store(request, response))
+
+    def store(self, request, response):
+        """
+        Cache the encoded details of a rendered response.
+        """
+        if (response.status_code != 200 or response.exception is not None or
+                response.encoded_details is None):
+            return
+        entry = {
+            'details': response.encoded_details,
+            'success': response.success,
+            'redirect': response.redirect,
+            'extra_context': response.encoded_extra_context,
+            # Identifies the compressed content cached for this entry.
+            'version': uuid.uuid4().hex,
+        }
+        self.cache.set(self.get_key(request), entry,
+                       **self.get_timeout_kwargs())
+
+    def call_view(self, request, view, *args, **kwargs):
+        """
+        Call the view, having its JSON response keep the encoded details to
+        cache.
+        """
+        request.jsonit_keep_encoded = True
+        return view(request, *args, **kwargs)
+
+    def serve(self, request, view, *args, **kwargs):
+        """
+        Return the cached response for the request, otherwise call the view
+        and cache its response.
+        """
+        if not self.is_cacheable(request):
+            return view(request, *args, **kwargs)
+        response = self.get_response(request)
+        if response is None:
+            response = self.call_view(request, view, *args, **kwargs)
+            self.set_response(request, response)
+        return response
@@ -0,0 +1,28 @@
+"""
+Compatibility between the supported versions of Python and Django.
+"""
+import sys
+
+PY2 = sys.version_info[0] == 2
+
+if PY2:
+    text_type = unicode     # noqa
+    string_types = (basestring,)     # noqa
+    integer_types = (int, long)     # noqa
+    from django.utils.translation import ugettext
+else:
+    text_type = str
+    string_types = (str,)
+    integer_types = (int,)
+    from django.utils.translation import gettext as ugettext
+
+
+def is_authenticated(user):
+    """
+    Return whether a user is authenticated (``is_authenticated`` is a method
+    before Django 1.10).
+    """
+    authenticated = user.is_authenticated
+    if callable(authenticated):
+        return authenticated()
+    return authenticated
@@ -0,0 +1,121 @@
+"""
+Compression of JSON response content.
+
+Compression is turned on for all JSON responses with the ``JSONIT_COMPRESS``
+setting, or for individual responses with their ``compress`` argument. The
+content coding is negotiated from the request's ``Accept-Encoding`` header:
+``gzip`` and ``deflate`` are always available, and ``br`` and ``zstd`` are
+preferred if the `brotli <https://pypi.python.org/pypi/Brotli>`_ or
+`zstandard <https://pypi.python.org/pypi/zstandard>`_ libraries can be
+imported.
+
+Content smaller than the ``JSONIT_COMPRESS_MIN_SIZE`` setting (in bytes,
+defaults to ``1024``) is never compressed, since the compression overhead
+outweighs any gain.
+"""
+import gzip
+import io
+import zlib
+
+from django.conf import settings
+
+DEFAULT_MIN_SIZE = 1024
+
+
+def compress_gzip(data):
+    out = io.BytesIO()
+    # No modification time, so the same content always compresses the same.
+    with gzip.GzipFile(mode='wb', compresslevel=6, fileobj=out,
+                       mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+def compress_deflate(data):
+    return zlib.compress(data, 6)
+
+
+# Content codings in order of preference.
+CODECS = []
+
+try:
+    import brotli
+except ImportError:
+    pass
+else:
+    CODECS.append(('br', lambda data: brotli.compress(data, quality=5)))
+
+try:
+    import zstandard
+except ImportError:
+    pass
+else:
+    CODECS.append(('zstd', zstandard.ZstdCompressor().compress))
+
+CODECS.extend([
+    ('gzip', compress_gzip),
+    ('deflate', compress_deflate),
+])
+
+_compressors = dict(CODECS)
+
+
+def compression_enabled():
+    """
+    Return whether JSON responses are compressed by default (the
+    ``JSONIT_COMPRESS`` setting).
+    """
+    return getattr(settings, 'JSONIT_COMPRESS', False)
+
+
+def get_min_size():
+    """
+    Return the minimum size of content to compress (the
+    ``JSONIT_COMPRESS_MIN_SIZE`` setting).
+    """
+    return getattr(settings, 'JSONIT_COMPRESS_MIN_SIZE', DEFAULT_MIN_SIZE)
+
+
+def parse_accept_encoding(header):
+    """
+    Return a dictionary of the content codings in an ``Accept-Encoding``
+    header, mapped to their quality values.
+    """
+    accepted = {}
+    for coding in header.split(','):
+        coding, _, params = coding.partition(';')
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        params = params.strip()
+        if params.startswith('q='):
+            try:
+                quality = float(params[2:])
+            except ValueError:
+                quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def get_encoding(request):
+    """
+    Return the preferred content coding which is acceptable to the client
+    making the request, or ``None`` if it doesn't accept any compression.
+    """
+    header = request.META.get('HTTP_ACCEPT_ENCODING')
+    if not header:
+        return None
+    accepted = parse_accept_encoding(header)
+    default = accepted.get('*', 0)
+    for coding, compressor in CODECS:
+        if accepted.get(coding, default) > 0:
+            return coding
+    return None
+
+
+def compress(data, encoding):
+    """
+    Compress ``data`` (bytes) with the named content coding.
+    """
+    return _compressors[encoding](data)
@@ -1,6 +1,14 @@
 from functools import wraps
+try:
+    from asyncio import iscoroutinefunction
+except ImportError:     # Python 2
+    def iscoroutinefunction(func):
+        return False
 
+from jsonit.cache import JSONResponseCache
 from jsonit.http import JSONResponse
+from jsonit.request import (InvalidJSONBody, error_response, get_json_body,
+                            is_json_request)
 
 
 def catch_ajax_exceptions(func):
@@ -9,15 +17,88 @@ def catch_ajax_exceptions(func):
     
     These exceptions will be returned using a :class:`JSONResponse` rather than
     letting the exception propogate.
+
+    Coroutine function views are also supported.
     """
-    
+    if iscoroutinefunction(func):
+        from jsonit.aio import catch_ajax_exceptions_async
+        return catch_ajax_exceptions_async(func)
+
     @wraps(func)
     def dec(request, *args, **kwargs):
         try:
             return func(request, *args, **kwargs)
-        except Exception, e:
+        except Exception as e:
             if request.is_ajax():
                 return JSONResponse(request, exception=e)
             raise
 
     return dec
+
+
+def cache_json_response(**options):
+    """
+    Cache the JSON responses of a view for AJAX ``GET`` requests.
+
+    Only the encoded ``details`` of the response are cached, the user's
+    messages are still retrieved for every request. The keyword arguments are
+    passed to :class:`~jsonit.cache.JSONResponseCache`, for example::
+
+        @cache_json_response(timeout=60)
+        def dashboard(request):
+            return JSONResponse(request, details=expensive_details())
+
+    Coroutine function views are also supported.
+    """
+    cache = JSONResponseCache(**options)
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            from jsonit.aio import cache_json_response_async
+            return cache_json_response_async(cache, func)
+
+        @wraps(func)
+        def dec(request, *args, **kwargs):
+            return cache.serve(request, func, *args, **kwargs)
+
+        return dec
+
+    return decorator
+
+
+def parse_json_body(max_size=None):
+    """
+    Decode the JSON body of requests with a JSON ``Content-Type`` before
+    calling the view, which gets the decoded body from
+    :func:`~jsonit.request.get_json_body` without decoding it again::
+
+        @parse_json_body(max_size=65536)
+        def update_settings(request):
+            settings = get_json_body(request)
+            ...
+
+    A body larger than ``max_size`` bytes (defaulting to the
+    ``JSONIT_MAX_BODY_SIZE`` setting) or which isn't valid JSON results in a
+    JSON exception response, with a 413 or 400 status code. So does an
+    :class:`~jsonit.request.InvalidJSONBody` exception raised by the view.
+
+    Coroutine function views are also supported.
+    """
+
+    def decorator(func):
+        if iscoroutinefunction(func):
+            from jsonit.aio import parse_json_body_async
+            return parse_json_body_async(max_size, func)
+
+        @wraps(func)
+        def dec(request, *args, **kwargs):
+            try:
+                if is_json_request(request):
+                    get_json_body(request, max_size)
+                return func(request, *args, **kwargs)
+            except InvalidJSONBody as e:
+                return error_response(request, e)
+
+        return dec
+
+    return decorator
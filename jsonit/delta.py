@@ -0,0 +1,244 @@
+"""
+Delta responses, which send clients a JSON Patch (:rfc:`6902`) of the changes
+to the ``details`` since the version they already have instead of the full
+``details``.
+
+Responses using a :class:`DeltaStore` (see the ``delta`` argument of
+:class:`~jsonit.http.JSONResponse`, or the
+:attr:`~jsonit.views.JSONResponseMixin.json_delta` attribute of class-based
+views) add two keys to the JSON dictionary:
+
+``version``
+
+    The version of the full ``details``, which the client keeps along with
+    them.
+
+``delta``
+
+    ``true`` if ``details`` is a list of JSON Patch operations to apply to
+    the client's copy of the ``details``, or ``false`` if it contains the
+    full ``details``.
+
+The client sends the version of the ``details`` it has in a ``delta_base``
+query parameter or an ``X-Delta-Base`` header (quoted like an ``ETag`` or
+not), anything other than a version being ignored. The recent versions of
+each URL's ``details`` are kept in a Django cache so they can be compared
+against, :attr:`DeltaStore.max_versions` of them at most. The full
+``details`` are sent when no base version was sent, when it is no longer in
+the cache, or when the patch wouldn't be any smaller.
+
+For example::
+
+    class Inbox(JSONResponseMixin, View):
+        json_delta = DeltaStore(max_versions=3, timeout=600)
+
+A client polling with ``?delta_base=<version>`` receives::
+
+    {
+        "success": true,
+        "delta": true,
+        "version": "0cc175b9c0f1b6a831c399e269772661",
+        "details": [{"op": "add", "path": "/unread/-", "value": 42}],
+        "messages": []
+    }
+"""
+import hashlib
+import json
+import re
+
+from jsonit.cache import RequestCache
+from jsonit.compat import text_type
+from jsonit.encoder import RawJSON, encode
+
+# The query parameter and header which clients use to send their version.
+DELTA_PARAM = 'delta_base'
+DELTA_HEADER = 'X-Delta-Base'
+
+# The format of versions (see DeltaStore.get_version).
+VERSION_PATTERN = re.compile(r'^[0-9a-f]{32}$')
+
+
+def get_base_version(request, pattern=VERSION_PATTERN):
+    """
+    Return the version of the ``details`` which the client already has, or
+    ``None``.
+
+    :param pattern: The compiled regular expression which versions match.
+        Anything else sent by the client (which could make an invalid cache
+        key) is ignored.
+    """
+    version = (request.GET.get(DELTA_PARAM) or
+               request.META.get('HTTP_X_DELTA_BASE'))
+    if not version:
+        return None
+    version = version.strip()
+    if version.startswith('W/'):
+        version = version[2:]
+    version = version.strip('"')
+    if not pattern.match(version):
+        return None
+    return version
+
+
+def escape_pointer(key):
+    """
+    Escape a dictionary key for use in a JSON Pointer (:rfc:`6901`).
+    """
+    return key.replace('~', '~0').replace('/', '~1')
+
+
+def unescape_pointer(token):
+    return token.replace('~1', '/').replace('~0', '~')
+
+
+def make_patch(old, new, path=''):
+    """
+    Return a list of JSON Patch operations which turn the decoded JSON value
+    ``old`` into ``new``.
+
+    Dictionaries are compared key by key and lists item by item (with any
+    items beyond the shorter list added or removed), so unchanged parts of
+    the value are never included in the patch.
+    """
+    if isinstance(old, dict) and isinstance(new, dict):
+        patch = []
+        for key in old:
+            if key not in new:
+                patch.append({'op': 'remove',
+                              'path': '%s/%s' % (path, escape_pointer(key))})
+        for key, value in new.items():
+            item_path = '%s/%s' % (path, escape_pointer(key))
+            if key in old:
+                patch.extend(make_patch(old[key], value, item_path))
+            else:
+                patch.append({'op': 'add', 'path': item_path,
+                              'value': value})
+        return patch
+    if isinstance(old, list) and isinstance(new, list):
+        patch = []
+        common = min(len(old), len(new))
+        for i in range(common):
+            patch.extend(make_patch(old[i], new[i], '%s/%d' % (path, i)))
+        for value in new[common:]:
+            patch.append({'op': 'add', 'path': '%s/-' % path, 'value': value})
+        # Remove from the end, so the earlier indexes stay valid.
+        for i in reversed(range(common, len(old))):
+            patch.append({'op': 'remove', 'path': '%s/%d' % (path, i)})
+        return patch
+    # JSON tells true and 1 apart, although Python doesn't.
+    if type(old) is type(new) and old == new:
+        return []
+    return [{'op': 'replace', 'path': path, 'value': new}]
+
+
+def apply_patch(value, patch):
+    """
+    Return the result of applying a list of JSON Patch operations to a
+    decoded JSON value, which is modified in place.
+
+    Only the ``add``, ``remove`` and ``replace`` operations (those returned
+    by :func:`make_patch`) are supported.
+    """
+    for operation in patch:
+        op = operation['op']
+        if op not in ('add', 'remove', 'replace'):
+            raise ValueError('Unsupported JSON Patch operation: %s' % op)
+        path = operation['path']
+        if not path:
+            if op == 'remove':
+                value = None
+            else:
+                value = operation['value']
+            continue
+        tokens = [unescape_pointer(token) for token in path.split('/')[1:]]
+        target = value
+        for token in tokens[:-1]:
+            target = target[int(token) if isinstance(target, list) else token]
+        token = tokens[-1]
+        if isinstance(target, list):
+            if op == 'add':
+                if token == '-':
+                    target.append(operation['value'])
+                else:
+                    target.insert(int(token), operation['value'])
+                continue
+            token = int(token)
+        if op == 'remove':
+            del target[token]
+        else:
+            target[token] = operation['value']
+    return value
+
+
+class DeltaStore(RequestCache):
+    """
+    Keep the recent versions of each URL's encoded ``details`` in a Django
+    cache (for each authenticated user), to build delta responses from.
+    """
+    key_namespace = 'delta'
+    ignored_params = (DELTA_PARAM,)
+    #: The format of the versions returned by :meth:`get_version`.
+    version_pattern = VERSION_PATTERN
+
+    def __init__(self, max_versions=5, **kwargs):
+        """
+        :param max_versions: The number of versions to keep for each URL, the
+            oldest being evicted first.
+
+        The other arguments are the cache and key options of
+        :class:`~jsonit.cache.RequestCache`.
+        """
+        super(DeltaStore, self).__init__(**kwargs)
+        self.max_versions = max_versions
+
+    def get_version(self, encoded):
+        """
+        Return the version string of the encoded ``details``.
+        """
+        if isinstance(encoded, text_type):
+            encoded = encoded.encode('utf-8')
+        return hashlib.md5(encoded).hexdigest()
+
+    def get_details(self, request, encoded):
+        """
+        Store the encoded ``details`` of a response as a new version, and
+        return a tuple of the version, whether the response is a delta, and
+        the (encoded) ``details`` to send.
+        """
+        key = self.get_key(request)
+        version = self.get_version(encoded)
+        base = get_base_version(request, self.version_pattern)
+        delta, details = False, encoded
+        if base == version:
+            delta, details = True, '[]'
+        elif base is not None:
+            base_encoded = self.cache.get('%s.%s' % (key, base))
+            if base_encoded is not None:
+                patch = encode(make_patch(json.loads(base_encoded),
+                                          json.loads(encoded)))
+                if len(patch) < len(encoded):
+                    delta, details = True, patch
+        self.add_version(key, version, encoded)
+        return version, delta, RawJSON(details, validate=False)
+
+    def add_version(self, key, version, encoded):
+        """
+        Add a version to those kept for a cache key, evicting the oldest
+        versions beyond :attr:`max_versions`.
+        """
+        versions = self.cache.get(key) or []
+        if versions and versions[-1] == version:
+            return
+        timeout_kwargs = self.get_timeout_kwargs()
+        if version in versions:
+            versions.remove(version)
+        else:
+            self.cache.set('%s.%s' % (key, version), encoded,
+                           **timeout_kwargs)
+        versions.append(version)
+        expired = versions[:-self.max_versions]
+        if expired:
+            self.cache.delete_many(['%s.%s' % (key, expired_version)
+                                    for expired_version in expired])
+            del versions[:-self.max_versions]
+        self.cache.set(key, versions, **timeout_kwargs)
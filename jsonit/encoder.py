@@ -1,23 +1,254 @@
 import datetime
+import decimal
+import copy
+import itertools
 import json
+import re
+import threading
+import uuid
+try:
+    from collections.abc import Iterator
+except ImportError:     # Python 2
+    from collections import Iterator
 
 from django.conf import settings
 from django.contrib.messages.storage.base import Message
+from django.core.signals import setting_changed
+from django.db.models import Model
+from django.db.models.fields.files import FieldFile
+from django.db.models.query import QuerySet
 from django.utils.functional import Promise
-from django.utils import six
+
+from jsonit.backends import get_backend_class
+from jsonit.compat import integer_types, text_type
+
+
+def call_value(func):
+    return func()
+
+
+def get_base_converter(cls):
+    """
+    Return a function converting instances of a subclass of a JSON type to
+    the base type the standard library encodes them as, or ``None`` if
+    ``cls`` isn't a subclass of one.
+    """
+    # Only backends other than the standard library's (which never pass
+    # these to the type hooks) use this, so overridden conversion methods
+    # are bypassed like the standard library does.
+    if issubclass(cls, text_type):
+        return text_type.__str__
+    if issubclass(cls, integer_types):
+        return int.__int__
+    if issubclass(cls, float):
+        return float.__float__
+    if issubclass(cls, (list, tuple)):
+        return list
+    if issubclass(cls, dict):
+        return lambda o: dict(o.items())
+    return None
 
 
 def encode_message(message):
     return {'class': message.tags, 'message': message.message}
 
 
+# Field extraction plans for model classes, see get_model_plan().
+_model_plans = {}
+
+
+def get_model_plan(model):
+    """
+    Return the field extraction plan for a model class: a tuple of
+    ``(name, attname)`` pairs for each of the fields named by its
+    ``jsonit_fields`` attribute.
+
+    Plans are compiled once for each model class. Raises ``TypeError`` for
+    models without ``jsonit_fields``, which can't be encoded.
+    """
+    try:
+        return _model_plans[model]
+    except KeyError:
+        pass
+    names = getattr(model, 'jsonit_fields', None)
+    if names is None:
+        raise TypeError(
+            '%s instances are not JSON serializable: list the fields to '
+            'encode in its jsonit_fields attribute.' % model.__name__)
+    fields = [model._meta.get_field(name) for name in names]
+    plan = _model_plans[model] = tuple(
+        (field.name, field.attname) for field in fields)
+    return plan
+
+
+def encode_model(instance):
+    """
+    Convert a model instance to a dictionary of the values of the fields
+    named by its ``jsonit_fields`` attribute, such as::
+
+        class Book(models.Model):
+            jsonit_fields = ('id', 'title', 'author')
+
+    Models are never encoded without it, so that fields such as a user's
+    password hash are only sent if they are explicitly listed.
+
+    Foreign keys are represented by their primary key value. Deferred fields
+    are left out rather than being loaded with an extra query each.
+    """
+    values = instance.__dict__
+    return dict((name, values[attname])
+                for name, attname in get_model_plan(instance.__class__)
+                if attname in values)
+
+
+class RawJSON(object):
+    """
+    An already encoded JSON fragment.
+
+    Can be used anywhere in an encoded object (such as the
+    :attr:`~jsonit.http.JSONResponse.details` of a response, or any value
+    nested within them), and is spliced into the encoded output verbatim by
+    both :func:`encode` and :func:`iterencode`.
+    """
+
+    def __init__(self, encoded, validate=None):
+        """
+        :param encoded: The encoded JSON, as a string or UTF-8 bytes.
+        :param validate: Whether to check that ``encoded`` is valid JSON,
+            raising a ``ValueError`` if it isn't. Defaults to the
+            ``JSONIT_VALIDATE_RAW_JSON`` setting, which defaults to the
+            ``DEBUG`` setting.
+        """
+        if isinstance(encoded, bytes):
+            encoded = encoded.decode('utf-8')
+        if validate is None:
+            validate = get_validate_raw_json()
+        if validate:
+            try:
+                json.loads(encoded)
+            except ValueError as e:
+                raise ValueError('Invalid raw JSON %r: %s' % (encoded[:80], e))
+        self.encoded = encoded
+
+    def __repr__(self):
+        return '<RawJSON %r>' % self.encoded
+
+
+class Lazy(object):
+    """
+    A lazily computed value, replaced by the value its function returns when
+    it is encoded (or when a part of it is selected, see
+    :func:`jsonit.http.select_fields`)::
+
+        details = {'count': count, 'stats': Lazy(compute_stats)}
+
+    Only these are called, other callables can't be encoded.
+    """
+
+    def __init__(self, func):
+        self.func = func
+
+    def __call__(self):
+        return self.func()
+
+    def __repr__(self):
+        return '<Lazy %r>' % self.func
+
+
+# Matches the (encoded) placeholders which stand in for raw JSON fragments.
+RAW_PATTERN = re.compile(r'"\\u0000jsonit-raw-([0-9a-f]+)-(\d+)\\u0000"')
+RAW_BYTES_PATTERN = re.compile(RAW_PATTERN.pattern.encode('ascii'))
+
+# The RawValues of the current call to encode(), for each thread.
+_raw_state = threading.local()
+_NOT_ENCODING = object()
+
+
+class RawValues(object):
+    """
+    Collects the raw JSON fragments found while encoding an object, each
+    replaced by a placeholder string, and splices them into the output.
+    """
+
+    def __init__(self):
+        self.values = {}
+        self.count = 0
+        # Placeholders from other calls (or in the data) are never replaced.
+        self.key = '%x' % id(self)
+
+    def add(self, raw):
+        """
+        Return the placeholder to encode instead of a :class:`RawJSON`.
+        """
+        self.count += 1
+        self.values[str(self.count)] = raw.encoded
+        return '\x00jsonit-raw-%s-%d\x00' % (self.key, self.count)
+
+    def splice(self, encoded):
+        """
+        Replace the placeholders in the encoded output (a string or UTF-8
+        bytes) with their fragments.
+        """
+        if not self.values:
+            return encoded
+        if isinstance(encoded, bytes):
+            encoded = RAW_BYTES_PATTERN.sub(self.replace_bytes, encoded)
+        else:
+            encoded = RAW_PATTERN.sub(self.replace, encoded)
+        self.values.clear()
+        return encoded
+
+    def replace(self, match):
+        if match.group(1) != self.key:
+            return match.group(0)
+        return self.values.get(match.group(2), match.group(0))
+
+    def replace_bytes(self, match):
+        if match.group(1).decode('ascii') != self.key:
+            return match.group(0)
+        value = self.values.get(match.group(2).decode('ascii'))
+        if value is None:
+            return match.group(0)
+        return value.encode('utf-8')
+
+
+class LazyList(list):
+    """
+    A list which lazily iterates over the wrapped iterable when it is encoded
+    by :meth:`StreamingJsonitEncoder.iterencode`.
+    """
+
+    def __init__(self, iterable):
+        super(LazyList, self).__init__()
+        self.iterable = iterable
+
+    def __iter__(self):
+        return iter(self.iterable)
+
+    def __bool__(self):
+        # Never considered empty, finding out would consume the iterable.
+        return True
+    __nonzero__ = __bool__
+
+
 class JsonitEncoder(json.JSONEncoder):
     default_encoders = (
-        (Promise, six.text_type),
+        (Promise, text_type),
         (Message, encode_message),
         (datetime.datetime, lambda d: d.isoformat()),
         (datetime.date, lambda d: d.isoformat()),
+        (datetime.time, lambda t: t.isoformat()),
+        (decimal.Decimal, str),
+        (uuid.UUID, str),
+        (FieldFile, lambda f: f.name or None),
+        (Model, encode_model),
+        (Lazy, call_value),
     )
+    #: The number of rows fetched from the database at a time when encoding
+    #: querysets.
+    queryset_chunk_size = 2000
+    #: Collects raw JSON fragments during a call to :func:`iterencode`.
+    raw_values = None
 
     def __init__(self, *args, **kwargs):
         """
@@ -30,6 +261,7 @@ class JsonitEncoder(json.JSONEncoder):
             for objects of that class as the second.
         """
         self.encoders = self.default_encoders
+        self._dispatch = {}
         extra_encoders = kwargs.pop('extra_encoders', None)
         if extra_encoders:
             classes = [encoder_tuple[0] for encoder_tuple in extra_encoders]
@@ -39,21 +271,309 @@ class JsonitEncoder(json.JSONEncoder):
         super(JsonitEncoder, self).__init__(*args, **kwargs)
 
     def default(self, o):
-        for cls, func in self.encoders:
-            if isinstance(o, cls):
-                return func(o)
-        super(JsonitEncoder, self).default(o)
+        cls = o.__class__
+        try:
+            func = self._dispatch[cls]
+        except KeyError:
+            func = self._dispatch[cls] = self.resolve_encoder(cls)
+        if func is None:
+            if isinstance(o, RawJSON):
+                return self.encode_raw(o)
+            return super(JsonitEncoder, self).default(o)
+        return func(o)
 
+    def resolve_encoder(self, cls):
+        """
+        Return the conversion function for objects of the class ``cls`` (or
+        ``None`` if there is no suitable encoder).
+
+        Subclasses of the JSON types are converted to their base type, as the
+        standard library encodes them (see :func:`get_base_converter`).
+        Otherwise encoders are checked in order, so the first one matching
+        the class (or one of its bases) wins. Querysets and iterators (such
+        as generators) which have no specific encoder are encoded by
+        :meth:`encode_queryset` and :meth:`encode_iterator`. The result is
+        cached for each concrete class by :meth:`default`.
+        """
+        convert = get_base_converter(cls)
+        if convert is not None:
+            return convert
+        for encoder_cls, func in self.encoders:
+            if issubclass(cls, encoder_cls):
+                return func
+        if issubclass(cls, RawJSON):
+            # Handled by default(), since iterencode() uses copies of the
+            # encoder which share the cached functions.
+            return None
+        if issubclass(cls, QuerySet):
+            return self.encode_queryset
+        if issubclass(cls, Iterator):
+            return self.encode_iterator
+        return None
+
+    def encode_raw(self, o):
+        """
+        Replace a raw JSON fragment with a placeholder, which :func:`encode`
+        and :func:`iterencode` splice the fragment into.
+
+        If the encoder is used some other way, the fragment is decoded so it
+        can be encoded again.
+        """
+        raw = self.raw_values
+        if raw is None:
+            state = _raw_state.__dict__
+            if 'values' not in state:
+                return json.loads(o.encoded)
+            raw = state['values']
+            if raw is None:
+                raw = state['values'] = RawValues()
+        return raw.add(o)
+
+    def encode_queryset(self, o):
+        """
+        Encode a queryset as a JSON array of its rows.
 
-def encode(object, encoders=None):
+        Unless the queryset has already been evaluated (or needs to prefetch
+        related objects), rows are fetched from the database in chunks of
+        :attr:`queryset_chunk_size` without caching them on the queryset.
+        """
+        if o._result_cache is not None or o._prefetch_related_lookups:
+            return self.encode_iterator(iter(o))
+        try:
+            rows = o.iterator(chunk_size=self.queryset_chunk_size)
+        except TypeError:     # Django < 2.0
+            rows = o.iterator()
+        return self.encode_iterator(rows)
+
+    def encode_iterator(self, o):
+        """
+        Convert an iterator to a list so that it is encoded as a JSON array.
+        """
+        return list(o)
+
+
+class StreamingJsonitEncoder(JsonitEncoder):
+    """
+    An encoder for use with :meth:`iterencode` which encodes iterators (such
+    as generators) as JSON arrays lazily, rather than reading them into a list
+    first.
+    """
+
+    def encode_iterator(self, o):
+        # The first item is read up front since the encoder needs to know
+        # whether the list is empty before encoding any items.
+        for first in o:
+            return LazyList(itertools.chain((first,), o))
+        return []
+
+
+# Configured backends and streaming encoders, keyed by the normalized extra
+# encoders and indent.
+_encoder_cache = {}
+_ENCODER_CACHE_SIZE = 128
+# Settings read once per process (until changed).
+_settings_cache = {}
+
+
+def get_indent():
+    """
+    Return the indent used for encoding (``2`` if the project's ``DEBUG``
+    setting is ``True``, otherwise ``None``).
+    """
+    try:
+        return _settings_cache['indent']
+    except KeyError:
+        indent = _settings_cache['indent'] = settings.DEBUG and 2 or None
+        return indent
+
+
+def get_validate_raw_json():
+    """
+    Return whether :class:`RawJSON` fragments are validated by default (the
+    ``JSONIT_VALIDATE_RAW_JSON`` setting, defaulting to ``DEBUG``).
+    """
+    try:
+        return _settings_cache['validate_raw_json']
+    except KeyError:
+        validate = _settings_cache['validate_raw_json'] = getattr(
+            settings, 'JSONIT_VALIDATE_RAW_JSON', settings.DEBUG)
+        return validate
+
+
+def normalize_encoders(encoders):
+    """
+    Return a hashable tuple of two-element encoder tuples from either a
+    sequence of tuples or a dictionary of encoders (or ``None`` if there are
+    no encoders).
+    """
+    if not encoders:
+        return None
+    if isinstance(encoders, dict):
+        encoders = encoders.items()
+    return tuple(tuple(encoder_tuple) for encoder_tuple in encoders)
+
+
+def get_backend_name():
+    """
+    Return the name of the JSON backend set by the ``JSONIT_BACKEND``
+    setting (defaults to ``'json'``, the standard library module).
+    """
+    try:
+        return _settings_cache['backend']
+    except KeyError:
+        name = _settings_cache['backend'] = getattr(
+            settings, 'JSONIT_BACKEND', 'json')
+        return name
+
+
+def get_backend(encoders=None, compact=False):
+    """
+    Return the configured JSON backend (see :mod:`jsonit.backends`).
+
+    Backends are reused between calls with the same ``encoders`` argument so
+    the merged encoder list and the per-type dispatch cache are only built
+    once.
+
+    :param encoders: An optional dictionary (or list of two-element tuples) of
+        extra encoders to help convert objects.
+    :param compact: Never indent the output, even when ``DEBUG`` is on.
+    """
+    encoders = normalize_encoders(encoders)
+    key = (encoders, None if compact else get_indent())
+    try:
+        return _encoder_cache[key]
+    except KeyError:
+        pass
+    encoder = JsonitEncoder(indent=key[1], extra_encoders=encoders)
+    backend = get_backend_class(get_backend_name())(encoder)
+    return _cache_encoder(key, backend)
+
+
+def get_encoder(encoders=None):
+    """
+    Return a configured :class:`JsonitEncoder`, reused between calls with the
+    same ``encoders`` argument.
+
+    :param encoders: An optional dictionary (or list of two-element tuples) of
+        extra encoders to help convert objects.
+    """
+    return get_backend(encoders).encoder
+
+
+def get_streaming_encoder(encoders=None):
+    """
+    Return a configured :class:`StreamingJsonitEncoder`, reused between calls
+    with the same ``encoders`` argument.
+
+    :param encoders: An optional dictionary (or list of two-element tuples) of
+        extra encoders to help convert objects.
+    """
+    encoders = normalize_encoders(encoders)
+    key = (encoders, get_indent(), 'streaming')
+    try:
+        return _encoder_cache[key]
+    except KeyError:
+        pass
+    encoder = StreamingJsonitEncoder(indent=key[1], extra_encoders=encoders)
+    return _cache_encoder(key, encoder)
+
+
+def _cache_encoder(key, encoder):
+    if len(_encoder_cache) >= _ENCODER_CACHE_SIZE:
+        # Most likely encoders are being built on the fly for each call.
+        _encoder_cache.clear()
+    _encoder_cache[key] = encoder
+    return encoder
+
+
+def clear_encoder_cache(**kwargs):
+    """
+    Clear any cached encoders, for example when the ``DEBUG`` or
+    ``JSONIT_BACKEND`` setting is changed.
+    """
+    setting = kwargs.get('setting')
+    if setting is None or setting == 'DEBUG' or setting.startswith('JSONIT_'):
+        _encoder_cache.clear()
+        _settings_cache.clear()
+
+setting_changed.connect(clear_encoder_cache)
+
+
+def encode(object, encoders=None, compact=False):
     """
     Encode an object into a JSON representation.
 
     :param object: The object to encode.
-    :param encoders: An optional dictionary of encoders to help convert
-        objects.
+    :param encoders: An optional dictionary (or list of two-element tuples) of
+        extra encoders to help convert objects.
+    :param compact: Never indent the output (so it fits on a single line),
+        even when ``DEBUG`` is on.
+    """
+    return _encode(get_backend(encoders, compact).encode, object)
 
-    All other parameters are passed to the standard JSON encode.
+
+def encode_bytes(object, encoders=None, compact=False):
+    """
+    Encode an object into a JSON representation as UTF-8 bytes.
+
+    Unlike encoding the string returned by :func:`encode`, the output is
+    built as bytes directly (see
+    :meth:`~jsonit.backends.BaseBackend.encode_bytes`), so a large output
+    isn't also held as a string. The standard library backend encodes large
+    lists and dictionaries in slices (see
+    :class:`~jsonit.backends.StdlibBackend`), which bounds the memory its C
+    encoder uses while building them.
+
+    Takes the same arguments as :func:`encode`.
+    """
+    return _encode(get_backend(encoders, compact).encode_bytes, object)
+
+
+def _encode(encode_func, object):
+    state = _raw_state.__dict__
+    # An encoder hook might encode something itself.
+    outer = state.pop('values', _NOT_ENCODING)
+    # The RawValues are only created once a fragment is found.
+    state['values'] = None
+    try:
+        encoded = encode_func(object)
+    finally:
+        raw = state.pop('values')
+        if outer is not _NOT_ENCODING:
+            state['values'] = outer
+    if raw is not None:
+        encoded = raw.splice(encoded)
+    return encoded
+
+
+def decode(data):
+    """
+    Decode a JSON document (a string, or UTF-8 bytes) with the configured
+    backend, raising ``ValueError`` if it isn't valid.
+    """
+    return get_backend().decode(data)
+
+
+def iterencode(object, encoders=None):
+    """
+    Encode an object into a JSON representation, yielding each string chunk
+    as it is available.
+
+    Any iterators (such as generators) contained in the object are consumed
+    lazily while encoding.
+
+    :param object: The object to encode.
+    :param encoders: An optional dictionary (or list of two-element tuples) of
+        extra encoders to help convert objects.
     """
-    indent = settings.DEBUG and 2 or None
-    return JsonitEncoder(indent=indent, extra_encoders=encoders).encode(object)
+    # A copy of the encoder (sharing its type dispatch cache) collects the
+    # raw JSON fragments for this call, since it may be interleaved with
+    # others.
+    encoder = copy.copy(get_streaming_encoder(encoders))
+    raw = encoder.raw_values = RawValues()
+    for chunk in encoder.iterencode(object):
+        if raw.values:
+            # Placeholders are always yielded whole, as soon as they are
+            # added.
+            chunk = raw.splice(chunk)
+        yield chunk
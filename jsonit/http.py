@@ -50,21 +50,161 @@ An example exception:
 
 If the project's ``DEBUG`` setting is ``False``, exception will just be set to
 ``True``.
+
+Responses can also carry an ``ETag`` so that clients which poll for the same
+content receive a ``304 Not Modified`` response when it hasn't changed (see the
+``etag`` argument of :class:`JSONResponse`).
+
+Clients which only need part of a response's ``details`` can select the
+fields they use with a ``fields`` query parameter (or ``X-Fields`` header),
+such as ``?fields=user.name,count``, for responses which allow it (see the
+``fields`` argument of :class:`JSONResponse`).
 """
+import codecs
+import hashlib
+try:
+    from collections.abc import Mapping
+except ImportError:     # Python 2
+    from collections import Mapping
+
 from django import http
+from django.conf import settings
 from django.contrib import messages
-from django.utils.translation import ugettext as _
+from django.contrib.messages.storage.base import Message
+from django.contrib.messages.storage.cookie import CookieStorage
+from django.contrib.messages.storage.fallback import FallbackStorage
+from django.contrib.messages.storage.session import SessionStorage
+from django.contrib.sessions.backends.base import SessionBase
+from django.forms.formsets import DELETION_FIELD_NAME, BaseFormSet
+from django.template.response import ContentNotRenderedError
+from django.utils.cache import patch_vary_headers
+
+from jsonit import compression, metrics
+from jsonit.binary import binary_enabled, get_format
+from jsonit.compat import ugettext as _
+from jsonit.encoder import Lazy, RawJSON, encode, encode_bytes, iterencode
+
+# The query parameter and header which clients use to select fields.
+FIELDS_PARAM = 'fields'
+FIELDS_HEADER = 'X-Fields'
+
+
+def get_requested_fields(request):
+    """
+    Return the list of dotted paths selected by the request's ``fields``
+    query parameter (or ``X-Fields`` header), or ``None``.
+    """
+    value = (request.GET.get(FIELDS_PARAM) or
+             request.META.get('HTTP_X_FIELDS'))
+    if not value:
+        return None
+    return [path.strip() for path in value.split(',') if path.strip()]
 
-from jsonit.encoder import encode
 
+def parse_fields(paths):
+    """
+    Parse a list of dotted paths into a tree of the selected keys, where
+    ``None`` selects the whole value. For example, ``['a.b', 'a.c', 'd']``
+    gives ``{'a': {'b': None, 'c': None}, 'd': None}``.
+    """
+    tree = {}
+    for path in paths:
+        node = tree
+        keys = path.split('.')
+        for key in keys[:-1]:
+            if key in node and node[key] is None:
+                # The whole value is already selected.
+                break
+            node = node.setdefault(key, {})
+        else:
+            node[keys[-1]] = None
+    return tree
 
-class JSONResponse(http.HttpResponse):
+
+def select_fields(value, tree):
     """
-    Return a JSON encoded HTTP response.
+    Return the parts of ``value`` selected by a tree from
+    :func:`parse_fields`.
+
+    Dictionaries are narrowed down to the selected keys and the selection is
+    applied to each item of lists. :class:`~jsonit.encoder.Lazy` values are
+    only computed (to get the value to select from) when a part of them is
+    selected, otherwise they are left for the encoder.
+    """
+    if tree is None:
+        return value
+    if isinstance(value, Lazy):
+        value = value()
+    if isinstance(value, Mapping):
+        return dict((key, select_fields(value[key], subtree))
+                    for key, subtree in tree.items() if key in value)
+    if isinstance(value, (list, tuple)):
+        return [select_fields(item, tree) for item in value]
+    return value
+
+
+def has_messages(request, load=True):
     """
+    Return whether the request's message storage has any messages, without
+    loading (or later saving) the stored messages if it can be avoided.
+
+    Messages added during this request are always seen. Otherwise the cookie
+    and session storages are checked for their cookie or session key.
+
+    :param load: If ``False``, return ``None`` rather than loading the
+        session when it is needed to tell.
+    """
+    storage = getattr(request, '_messages', None)
+    if storage is None:
+        return False
+    return storage_has_messages(storage, load)
+
+
+def storage_has_messages(storage, load=True):
+    if storage._queued_messages:
+        return True
+    if hasattr(storage, '_loaded_data'):
+        return bool(storage._loaded_data)
+    if isinstance(storage, FallbackStorage):
+        found = [storage_has_messages(sub_storage, load)
+                 for sub_storage in storage.storages]
+        if True in found:
+            return True
+        return None if None in found else False
+    if isinstance(storage, CookieStorage):
+        return storage.cookie_name in storage.request.COOKIES
+    if isinstance(storage, SessionStorage):
+        session = storage.request.session
+        if isinstance(session, SessionBase) and not hasattr(
+                session, '_session_cache'):
+            if session.session_key is None:
+                # A new session, which can't contain anything.
+                return False
+            if not load:
+                return None
+        return storage.session_key in session
+    # An unknown storage, so its messages will need to be loaded.
+    return True if load else None
+
+
+class BaseJSONResponse(object):
+    """
+    Builds the JSON dictionary for the JSON response classes, which mix this
+    class with an ``HttpResponse`` class.
+    """
+    #: Whether building the response consumes the user's messages.
+    consume_messages = True
+    #: The content type of the (JSON encoded) content.
+    json_content_type = 'application/json'
+    #: Extra encoders for the content, as a dictionary (or list of
+    #: two-element tuples) mapping classes to conversion functions (see
+    #: :class:`~jsonit.encoder.JsonitEncoder`). Also used by binary formats.
+    encoders = None
 
     def __init__(self, request, details=None, success=True, exception=None,
-                 redirect=None, extra_context=None):
+                 redirect=None, extra_context=None, etag=None,
+                 compress=None, fields=None, delta=None, binary=None,
+                 schema=None):
         """
         :param request: The current ``HTTPRequest``. Required so that any
             ``django.contrib.messages`` can be retrieved.
@@ -77,6 +217,40 @@ class JSONResponse(http.HttpResponse):
             arises. See the :class:`~.JSONExceptionMiddleware` to handle AJAX
             exceptions automatically.
         :param redirect: The URL to which the JavaScript should redirect.
+        :param etag: Set to ``True`` to add a strong ``ETag`` header, computed
+            from the encoded content, to the response. Alternately, set this to
+            a function which will be passed the request and should cheaply
+            return a version string for the content (or ``None``), which is
+            used to compute the ``ETag`` before anything is encoded. In either
+            case, ``GET`` and ``HEAD`` requests with a matching
+            ``If-None-Match`` header receive an empty ``304 Not Modified``
+            response. When using a version function, the JSON is never built
+            (so messages are not consumed) for these responses.
+        :param compress: Whether to compress the content, using a content
+            coding negotiated from the request's ``Accept-Encoding`` header
+            (see :mod:`jsonit.compression`). Defaults to the
+            ``JSONIT_COMPRESS`` setting. Streaming responses are never
+            compressed.
+        :param fields: A list of dotted paths into :attr:`details` (or into
+            :attr:`extra_context`, for paths starting with
+            ``extra_context``) to limit the response to, such as
+            ``['user.name', 'extra_context.title']``. Set to ``True`` to use
+            the paths the client selected in a comma separated ``fields``
+            query parameter or ``X-Fields`` header, if any. Defaults to the
+            ``JSONIT_SPARSE_FIELDS`` setting (``False``). Values of
+            :attr:`details` can be :class:`~jsonit.encoder.Lazy`, to only
+            compute them if they are selected.
+        :param delta: A :class:`~jsonit.delta.DeltaStore` used to send the
+            client a JSON Patch of the changes to the ``details`` since the
+            version it has, rather than the full ``details`` (see
+            :mod:`jsonit.delta`). Not supported by streaming responses.
+        :param binary: Whether to encode the content as MessagePack or CBOR
+            for clients whose ``Accept`` header prefers them (see
+            :mod:`jsonit.binary`). Defaults to the ``JSONIT_BINARY`` setting.
+            Streaming responses are always JSON.
+        :param schema: A :class:`~jsonit.schema.Schema` declaring the shape of
+            :attr:`details`, which are then encoded by its compiled serializer
+            (unless they don't match it, or only some fields were selected).
         :returns: An HTTPResponse containing a JSON encoded dictionary with a
             content type of ``application/json``.
         """
@@ -87,12 +261,116 @@ class JSONResponse(http.HttpResponse):
         if redirect is not None:
             redirect = request.build_absolute_uri(redirect)
         self.redirect = redirect
-        assert isinstance(self.details, dict)
-        content = self.build_json(exception)
-        super(JSONResponse, self).__init__(content=content,
-                                           content_type='application/json')
+        self.exception = exception
+        self.messages = []
+        self.prefetched_messages = None
+        self.metrics = metrics.start(self)
+        # Set by jsonit.cache for the requests whose response it caches.
+        self.keep_encoded = (getattr(request, 'jsonit_keep_encoded', False)
+                             and not self.streaming)
+        self.encoded_details = None
+        self.encoded_extra_context = None
+        assert isinstance(self.details, (dict, RawJSON))
+        self.compress = compress
+        if fields is None:
+            fields = getattr(settings, 'JSONIT_SPARSE_FIELDS', False)
+        self.fields = fields
+        if fields is True:
+            fields = get_requested_fields(request)
+        self.field_paths = fields or None
+        if delta is not None and self.streaming:
+            raise ValueError('Streaming responses can not be delta responses.')
+        self.delta = delta
+        self.schema = schema
+        if binary is None:
+            binary = binary_enabled()
+        binary = binary and not self.streaming
+        self.format = get_format(request, self.encoders) if binary else None
+        self.etag = None
+        if exception is not None or request.method not in ('GET', 'HEAD'):
+            etag = None
+        elif etag is True and self.streaming:
+            raise ValueError('An ETag can not be computed from the content of '
+                             'a streaming response, use a version function.')
+        elif callable(etag):
+            version = etag(request)
+            if version is not None:
+                if self.field_paths:
+                    version = '%s\n%s' % (version, ','.join(self.field_paths))
+                if self.format is not None:
+                    version = '%s\n%s' % (version, self.format.name)
+                self.etag = self.compute_etag(version)
+        self.content_etag = etag is True
+        content_type = self.json_content_type
+        if self.format is not None:
+            content_type = self.format.content_type
+        super(BaseJSONResponse, self).__init__(content_type=content_type)
+        if binary:
+            patch_vary_headers(self, ('Accept',))
+        if self.fields is True:
+            patch_vary_headers(self, (FIELDS_HEADER,))
+        if delta is not None:
+            patch_vary_headers(self, ('X-Delta-Base',))
+        if self.etag is not None:
+            self['ETag'] = self.etag
+            if self.etag_matches():
+                self.not_modified()
+                return
+        self.prepare_content()
+
+    def prepare_content(self):
+        """
+        Prepare the response content. Must be implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def measure(self, phase, func, *args):
+        """
+        Call ``func``, timing it as ``phase`` of building the response if
+        metrics are being collected (see :mod:`jsonit.metrics`).
+        """
+        if self.metrics is None:
+            return func(*args)
+        return self.metrics.measure(phase, func, *args)
 
     def build_json(self, exception=None):
+        """
+        Build the JSON dictionary and return its encoded content. Must be
+        implemented by subclasses.
+        """
+        raise NotImplementedError
+
+    def compute_etag(self, value):
+        """
+        Return a strong ``ETag`` for a version string or the encoded content.
+        """
+        if not isinstance(value, bytes):
+            value = value.encode('utf-8')
+        return '"%s"' % hashlib.md5(value).hexdigest()
+
+    def etag_matches(self):
+        """
+        Return whether the request's ``If-None-Match`` header matches
+        :attr:`etag`.
+        """
+        header = self.request.META.get('HTTP_IF_NONE_MATCH')
+        if not header:
+            return False
+        etags = [etag.strip() for etag in header.split(',')]
+        # If-None-Match uses the weak comparison function.
+        return ('*' in etags or self.etag in etags or
+                'W/%s' % self.etag in etags)
+
+    def not_modified(self):
+        """
+        Turn this into an empty ``304 Not Modified`` response.
+        """
+        self.status_code = 304
+        if not self.streaming:
+            self.content = b''
+        del self['Content-Type']
+
+    def build_content(self, exception=None):
         """Build the JSON dictionary."""
         content = {
             'success': self.success,
@@ -108,25 +386,113 @@ class JSONResponse(http.HttpResponse):
                 exception = '%s: %s' % (_('Internal error'), exception)
             content['exception'] = exception
         else:
-            content['messages'] = self.get_messages()
+            if self.prefetched_messages is not None:
+                self.messages = self.prefetched_messages
+            else:
+                self.messages = self.measure('get_messages',
+                                             self.get_messages)
+            content['messages'] = self.messages
             redirect = self.get_redirect()
             if redirect:
                 content['redirect'] = self.redirect
-        if self.extra_context:
-            content['extra_context'] = self.extra_context
-        try:
-            return encode(content)
-        except Exception as e:
-            if exception is not None:
-                raise
-            return self.build_json(e)
+        extra_context = self.extra_context
+        fields = self.get_fields()
+        if fields is not None:
+            if exception is None:
+                content['details'] = select_fields(self.details,
+                                                   fields.get('details', {}))
+            extra_context = select_fields(extra_context,
+                                          fields.get('extra_context', {}))
+        if extra_context:
+            content['extra_context'] = extra_context
+        if (self.schema is not None and exception is None and
+                fields is None and self.format is None and
+                isinstance(content['details'], dict)):
+            encoded = self.schema.encode(content['details'],
+                                         encoders=self.encoders)
+            if encoded is not None:
+                content['details'] = RawJSON(encoded, validate=False)
+        self.encoded_details = self.encoded_extra_context = None
+        if self.keep_encoded and exception is None and fields is None:
+            self.keep_encoded_content(content)
+        if self.delta is not None and exception is None:
+            self.add_delta(content)
+        if self.metrics is not None:
+            self.metrics.count(content)
+        return content
+
+    def keep_encoded_content(self, content):
+        """
+        Encode the ``details`` and ``extra_context`` of the JSON dictionary
+        on their own, keeping them in :attr:`encoded_details` and
+        :attr:`encoded_extra_context` (for :mod:`jsonit.cache`) and splicing
+        them into the content.
+        """
+        details = content['details']
+        if not isinstance(details, RawJSON):
+            details = RawJSON(encode(details, self.encoders), validate=False)
+            content['details'] = details
+        self.encoded_details = details.encoded
+        extra_context = content.get('extra_context')
+        if extra_context:
+            if not isinstance(extra_context, RawJSON):
+                extra_context = RawJSON(encode(extra_context, self.encoders),
+                                        validate=False)
+                content['extra_context'] = extra_context
+            self.encoded_extra_context = extra_context.encoded
+
+    def add_delta(self, content):
+        """
+        Replace the ``details`` of the JSON dictionary with a patch from the
+        client's version when possible, adding the ``version`` and ``delta``
+        keys (see :mod:`jsonit.delta`).
+        """
+        details = content['details']
+        if isinstance(details, RawJSON):
+            encoded = details.encoded
+        else:
+            encoded = encode(details, self.encoders)
+        version, delta, details = self.delta.get_details(self.request,
+                                                         encoded)
+        content['details'] = details
+        content['version'] = version
+        content['delta'] = delta
+
+    def get_fields(self):
+        """
+        Return the tree of fields selected for the response (see
+        :func:`parse_fields`), with ``details`` and ``extra_context`` keys, or
+        ``None`` to include everything.
+        """
+        if not self.field_paths:
+            return None
+        paths = []
+        for path in self.field_paths:
+            if path != 'extra_context' and not path.startswith(
+                    'extra_context.'):
+                path = 'details.%s' % path
+            paths.append(path)
+        return parse_fields(paths)
+
+    def prefetch_messages(self):
+        """
+        Retrieve the messages ahead of building the JSON dictionary, for
+        example in a separate thread when rendering the response
+        asynchronously (see :func:`jsonit.aio.render_response`).
+        """
+        self.prefetched_messages = self.measure('get_messages',
+                                                self.get_messages)
 
     def get_messages(self):
         """
         Consume and return a list of the user's messages, unless this is a
-        redirection (in which case, return an empty list).
+        redirection or :attr:`consume_messages` is ``False`` (in which case,
+        return an empty list).
         """
-        if self.success and self.redirect:
+        if not self.consume_messages or (self.success and self.redirect):
+            return []
+        if not has_messages(self.request):
+            # Leave the storage untouched, so it isn't saved either.
             return []
         return list(messages.get_messages(self.request))
 
@@ -140,18 +506,345 @@ class JSONResponse(http.HttpResponse):
         return self.redirect
 
 
+class JSONResponse(BaseJSONResponse, http.HttpResponse):
+    """
+    Return a JSON encoded HTTP response.
+
+    The content isn't built until it is first needed (Django's request
+    handler renders the response right after the view returns it, or the
+    content can be explicitly built with :meth:`render`). Until then,
+    :attr:`success`, :attr:`details`, :attr:`redirect` and
+    :attr:`extra_context` can still be changed, for example by the view or by
+    a middleware's ``process_template_response`` method.
+
+    Like Django's ``SimpleTemplateResponse``, functions can be run once the
+    response is rendered (see :meth:`add_post_render_callback`), and only
+    the rendered response can be pickled (for example by the cache
+    middleware).
+    """
+    #: Attributes used to build the content, which aren't pickled.
+    rendering_attrs = ['request', 'details', 'extra_context', 'exception',
+                       'messages', 'prefetched_messages', 'metrics', 'delta',
+                       'schema', 'format']
+
+    def __init__(self, *args, **kwargs):
+        self.post_render_callbacks = []
+        super(JSONResponse, self).__init__(*args, **kwargs)
+
+    def __getstate__(self):
+        if not self.is_rendered:
+            raise ContentNotRenderedError('The response content must be '
+                                          'rendered before it can be '
+                                          'pickled.')
+        state = self.__dict__.copy()
+        for attr in self.rendering_attrs:
+            state.pop(attr, None)
+        state['post_render_callbacks'] = []
+        return state
+
+    def prepare_content(self):
+        self.is_rendered = False
+
+    def add_post_render_callback(self, callback):
+        """
+        Add a function to be called with the response once it is rendered
+        (right away if it already is). As with Django's template responses,
+        a callback may return a response to use instead.
+        """
+        if self.is_rendered:
+            callback(self)
+        else:
+            self.post_render_callbacks.append(callback)
+
+    def render(self):
+        """
+        Build the content (unless it has already been built), returning the
+        response, or the response returned by a post-render callback.
+        """
+        return self.render_content() or self
+
+    def render_content(self):
+        """
+        Build the content (unless it has already been built) and run the
+        post-render callbacks, returning the response returned by the last
+        callback which returned one.
+        """
+        if self.is_rendered:
+            return None
+        self.content = self.measure('build_json', self.build_json,
+                                    self.exception)
+        if self.metrics is not None:
+            self.metrics.finish(len(self.content))
+        if self.content_etag:
+            self.etag = self.compute_etag(self.content)
+            self['ETag'] = self.etag
+        if self.content_etag and self.etag_matches():
+            self.not_modified()
+        else:
+            compress = self.compress
+            if compress is None:
+                compress = compression.compression_enabled()
+            if compress:
+                self.compress_content()
+        response = None
+        callbacks = self.post_render_callbacks
+        self.post_render_callbacks = []
+        for callback in callbacks:
+            response = callback(response or self) or response
+        return response
+
+    @property
+    def content(self):
+        self.render_content()
+        return http.HttpResponse.content.fget(self)
+
+    @content.setter
+    def content(self, value):
+        http.HttpResponse.content.fset(self, value)
+        self.is_rendered = True
+
+    def __iter__(self):
+        self.render_content()
+        return super(JSONResponse, self).__iter__()
+
+    def getvalue(self):
+        self.render_content()
+        return super(JSONResponse, self).getvalue()
+
+    def write(self, content):
+        self.render_content()
+        super(JSONResponse, self).write(content)
+
+    def get_content_encoding(self):
+        """
+        Return the content coding to compress the content with, or ``None``
+        if it shouldn't be compressed (because it is too small or the client
+        doesn't accept any compression).
+        """
+        if len(self.content) < compression.get_min_size():
+            return None
+        patch_vary_headers(self, ('Accept-Encoding',))
+        return compression.get_encoding(self.request)
+
+    def compress_content(self):
+        """
+        Compress the content, if the client accepts it.
+        """
+        encoding = self.get_content_encoding()
+        if encoding is not None:
+            self.set_compressed_content(
+                encoding, compression.compress(self.content, encoding))
+
+    def set_compressed_content(self, encoding, content):
+        """
+        Replace the content with its compressed form.
+        """
+        self.content = content
+        self['Content-Encoding'] = encoding
+        self['Content-Length'] = str(len(content))
+        if self.etag is not None:
+            # The compressed content is only semantically equivalent.
+            self['ETag'] = 'W/%s' % self.etag
+
+    def build_json(self, exception=None):
+        """Build and encode the JSON dictionary."""
+        try:
+            content = self.build_content(exception)
+            return self.measure('encode', self.encode_content, content)
+        except Exception as e:
+            if exception is not None:
+                raise
+            return self.build_json(e)
+
+    def encode_content(self, content):
+        """
+        Encode the JSON dictionary. Any values which are already encoded
+        (see :class:`~jsonit.encoder.RawJSON`) are spliced in verbatim.
+
+        The content is encoded in the negotiated binary format instead, if
+        there is one.
+
+        UTF-8 content is encoded straight to bytes (see
+        :func:`~jsonit.encoder.encode_bytes`), which the response keeps
+        without copying them.
+        """
+        if self.format is not None:
+            return self.format.encode(content)
+        if codecs.lookup(self.charset).name != 'utf-8':
+            # Django encodes the string in the response's charset.
+            return encode(content, self.encoders)
+        return encode_bytes(content, self.encoders)
+
+
+class StreamingJSONResponse(BaseJSONResponse, http.StreamingHttpResponse):
+    """
+    Return a JSON encoded HTTP response which is streamed to the client as it
+    is encoded, rather than being encoded into memory all at once.
+
+    Any iterators (such as generators) in :attr:`details` are consumed lazily
+    and encoded as JSON arrays, so large sets of results can be returned
+    without ever holding them all in memory::
+
+        def export(request):
+            rows = (row.as_dict() for row in Row.objects.iterator())
+            return StreamingJSONResponse(request, details={'rows': rows})
+
+    Since the response headers have already been sent, an exception raised
+    while encoding can not be converted into an exception JSON response.
+    """
+    #: The approximate number of characters to send to the client at once.
+    chunk_size = 16384
+
+    def prepare_content(self):
+        self.streaming_content = self.measure('build_json', self.build_json,
+                                              self.exception)
+
+    def build_json(self, exception=None):
+        """
+        Build the JSON dictionary, returning an iterator of its encoded
+        content.
+        """
+        return self.stream_json(self.build_content(exception))
+
+    def stream_json(self, content):
+        """
+        Encode the JSON dictionary, yielding chunks of :attr:`chunk_size`.
+        """
+        encoded = iterencode(content, self.encoders)
+        if self.metrics is not None:
+            encoded = self.metrics.measure_iter('encode', encoded)
+        chunks = []
+        size = total = 0
+        for chunk in encoded:
+            chunks.append(chunk)
+            size += len(chunk)
+            if size >= self.chunk_size:
+                data = ''.join(chunks).encode(self.charset)
+                total += len(data)
+                yield data
+                chunks = []
+                size = 0
+        if chunks:
+            data = ''.join(chunks).encode(self.charset)
+            total += len(data)
+            yield data
+        if self.metrics is not None:
+            self.metrics.finish(total)
+
+
+class NDJSONResponse(BaseJSONResponse, http.StreamingHttpResponse):
+    """
+    Stream newline delimited JSON (one JSON value per line), reporting the
+    progress of a long running operation as it happens.
+
+    The ``records`` argument is an iterable (usually a generator doing the
+    work) of records, each sent to the client as soon as it is produced, on
+    a line of its own wrapped as ``{"record": ...}``. Any
+    ``django.contrib.messages`` ``Message`` produced is sent as a
+    ``{"message": {"class": ..., "message": ...}}`` line instead::
+
+        def import_rows(request):
+            def run():
+                for i, row in enumerate(rows):
+                    save(row)
+                    yield {'imported': i + 1}
+                yield Message(messages.INFO, 'Import complete.')
+                return {'total': len(rows)}
+            return NDJSONResponse(request, run())
+
+    The last line is the usual JSON response dictionary (with ``success``,
+    ``details``, ``messages`` and so on), built once the records run out, so
+    it includes any messages added while producing them. If the generator
+    returns a value, it replaces :attr:`details` (generators can only return
+    values on Python 3, on Python 2 pass the ``details`` argument instead).
+    If an exception is raised while producing or encoding a record, the last
+    line is an exception response.
+    """
+    json_content_type = 'application/x-ndjson'
+
+    def __init__(self, request, records, *args, **kwargs):
+        """
+        :param records: An iterable of the records to stream.
+
+        The other arguments are those of :class:`BaseJSONResponse`.
+        """
+        self.records = records
+        super(NDJSONResponse, self).__init__(request, *args, **kwargs)
+        # Ask proxies (nginx, at least) to pass each line straight on.
+        self['X-Accel-Buffering'] = 'no'
+
+    def prepare_content(self):
+        self.streaming_content = self.stream_records()
+
+    def stream_records(self):
+        """
+        Yield the encoded line of each record, then the JSON dictionary.
+        """
+        exception = self.exception
+        total = 0
+        if exception is None:
+            records = iter(self.records)
+            while True:
+                try:
+                    record = next(records)
+                    line = self.measure('encode', self.encode_line,
+                                        self.build_record(record))
+                except StopIteration as e:
+                    details = getattr(e, 'value', None)
+                    if details is not None:
+                        self.details = details
+                    break
+                except Exception as e:
+                    exception = e
+                    break
+                total += len(line)
+                yield line
+        line = self.measure('build_json', self.build_json, exception)
+        total += len(line)
+        yield line
+        if self.metrics is not None:
+            self.metrics.finish(total)
+
+    def build_record(self, record):
+        """
+        Return the value to encode for a record.
+        """
+        if isinstance(record, Message):
+            return {'message': record}
+        return {'record': record}
+
+    def build_json(self, exception=None):
+        """Build and encode the JSON dictionary line."""
+        content = self.build_content(exception)
+        try:
+            return self.measure('encode', self.encode_line, content)
+        except Exception as e:
+            if exception is not None:
+                raise
+            return self.build_json(e)
+
+    def encode_line(self, value):
+        encoded = encode(value, self.encoders, compact=True)
+        if '\n' in encoded:
+            # From an indented RawJSON fragment. JSON strings can't contain
+            # newlines, so they are only whitespace.
+            encoded = encoded.replace('\n', ' ')
+        return (encoded + '\n').encode(self.charset)
+
+
 class JSONFormResponse(JSONResponse):
     """
     Return a JSON response, handling form errors.
 
-    Accepts a ``forms`` keyword argument which should be a list of forms to
-    be validated.
+    Accepts a ``forms`` keyword argument which should be a list of forms (or
+    formsets) to be validated.
 
     If any of the forms contain errors, a ``form_errors`` key
     will be added to the ``details`` dictionary, containing the HTML ids of
     fields and a list of messages for each.
 
-    The ``__all__`` key is used for any form-wide error messages.
+    The ``__all__`` key is used for any form-wide error messages (including
+    the non-form errors of formsets).
 
     An example failure::
 
@@ -168,24 +861,59 @@ class JSONFormResponse(JSONResponse):
                 {'class': '', 'message': 'some message'},
             ]
         }
+
+    With :attr:`indexed_errors`, the errors of each formset are instead
+    grouped under the formset's prefix, with the errors of its forms keyed by
+    their index and field name::
+
+        'form_errors': {
+            'form': {
+                '__all__': ['Please submit 5 or fewer forms.'],
+                'forms': {
+                    '3': {'name': ['This field is required.']},
+                },
+            },
+        }
+
+    Both layouts cost about the same to build, most of the time being spent
+    by Django validating the forms and rendering their error messages.
     """
+    #: Group formset errors by prefix and form index (see above) rather than
+    #: by field id.
+    indexed_errors = False
+    rendering_attrs = JSONResponse.rendering_attrs + ['forms']
 
     def __init__(self, *args, **kwargs):
         """
-        In addition to the standard :class:`JSONResponse` arguments, one
-        additional keyword argument is available.
+        In addition to the standard :class:`JSONResponse` arguments, these
+        additional keyword arguments are available.
 
-        :param forms: A list of forms to validate against.
+        :param forms: A list of forms (or formsets) to validate against.
+        :param indexed_errors: Override the :attr:`indexed_errors` layout of
+            formset errors.
         """
         self.forms = kwargs.pop('forms')
+        indexed_errors = kwargs.pop('indexed_errors', None)
+        if indexed_errors is not None:
+            self.indexed_errors = indexed_errors
         super(JSONFormResponse, self).__init__(*args, **kwargs)
 
-    def build_json(self, *args, **kwargs):
+    def build_content(self, *args, **kwargs):
         """
         Check for form errors before building the JSON dictionary.
         """
-        self.get_form_errors()
-        return super(JSONFormResponse, self).build_json(*args, **kwargs)
+        self.measure('get_form_errors', self.get_form_errors)
+        return super(JSONFormResponse, self).build_content(*args, **kwargs)
+
+    def get_fields(self):
+        """
+        Always include any form errors in a selection of fields.
+        """
+        fields = super(JSONFormResponse, self).get_fields()
+        details = fields and fields.setdefault('details', {})
+        if details is not None:
+            details['form_errors'] = None
+        return fields
 
     def get_form_errors(self):
         """
@@ -194,14 +922,90 @@ class JSONFormResponse(JSONResponse):
 
         If any of the forms do not validate, :attr:`success` will be set to
         ``False``.
+
+        Forms which have already been validated without any errors (for
+        example, by the view calling ``is_valid()``) are skipped.
         """
         forms = self.forms or ()
         for form in forms:
-            for field, errors in form.errors.items():
+            if isinstance(form, BaseFormSet):
+                self.add_formset_errors(form)
+            else:
+                self.add_form_errors(form)
+
+    def get_error_dict(self):
+        return self.details.setdefault('form_errors', {})
+
+    def add_form_errors(self, form):
+        """
+        Add the errors of a form, keyed by field id.
+        """
+        for field, errors in form.errors.items():
+            self.success = False
+            if field != '__all__':
+                field = get_field_id(form, field)
+            if field:
+                error_list = self.get_error_dict().setdefault(field, [])
+                error_list.extend(errors)
+
+    def add_formset_errors(self, formset):
+        """
+        Add the non-form errors of a formset and the errors of its forms.
+
+        Forms marked for deletion are ignored, as they are when the formset
+        is validated.
+        """
+        if not formset.is_bound or not formset.total_error_count():
+            return
+        non_form_errors = formset.non_form_errors()
+        forms = [(i, form) for i, form in enumerate(formset.forms)
+                 if not (formset.can_delete and
+                         form.cleaned_data.get(DELETION_FIELD_NAME))]
+        if not self.indexed_errors:
+            if non_form_errors:
                 self.success = False
-                if field != '__all__':
-                    field = form[field].auto_id
-                if field:
-                    form_errors = self.details.setdefault('form_errors', {})
-                    error_list = form_errors.setdefault(field, [])
-                    error_list.extend(errors)
+                self.get_error_dict().setdefault('__all__', []).extend(
+                    non_form_errors)
+            for i, form in forms:
+                self.add_form_errors(form)
+            return
+        indexed = {}
+        if non_form_errors:
+            indexed['__all__'] = list(non_form_errors)
+        form_errors = {}
+        for i, form in forms:
+            errors = form.errors
+            if errors:
+                form_errors[str(i)] = dict((field, list(field_errors))
+                                           for field, field_errors
+                                           in errors.items())
+        if form_errors:
+            indexed['forms'] = form_errors
+        if indexed:
+            self.success = False
+            self.get_error_dict()[formset.prefix] = indexed
+
+
+# Field ids keyed by form class, prefix and auto_id format, see get_field_id().
+_field_ids = {}
+_FIELD_IDS_CACHE_SIZE = 1024
+
+
+def get_field_id(form, name):
+    """
+    Return the HTML id of a form's field (the ``auto_id`` of its bound
+    field).
+
+    Ids only depend on the form's class, prefix and ``auto_id`` format, so
+    they are cached rather than building a bound field for every error.
+    """
+    key = (form.__class__, form.prefix, form.auto_id)
+    try:
+        return _field_ids[key][name]
+    except KeyError:
+        pass
+    if key not in _field_ids and len(_field_ids) >= _FIELD_IDS_CACHE_SIZE:
+        # Most likely prefixes are being generated on the fly.
+        _field_ids.clear()
+    field_id = _field_ids.setdefault(key, {})[name] = form[name].auto_id
+    return field_id
@@ -0,0 +1,333 @@
+"""
+Instrumentation of JSON responses.
+
+When metrics are collected, each rendered JSON response reports a
+:class:`ResponseMetrics` with the time spent in each phase of building it
+(``build_json``, ``get_messages``, ``get_form_errors`` and ``encode``, in
+seconds), the size of the encoded content in bytes, the number of objects in
+the JSON dictionary and the name of the view which returned it.
+
+There are two ways to receive these metrics:
+
+* Set the ``JSONIT_METRICS_COLLECTOR`` setting to the dotted path of a
+  collector class (a subclass of :class:`BaseCollector`). A single instance is
+  created for the process. :class:`AggregatingCollector` is provided, which
+  keeps histograms of the metrics for each view in memory::
+
+    JSONIT_METRICS_COLLECTOR = 'jsonit.metrics.AggregatingCollector'
+
+  and later::
+
+    from jsonit.metrics import get_collector
+    print(get_collector().report())
+
+* Connect to the :data:`response_measured` signal, which is sent with the
+  response class as the sender and a ``metrics`` argument.
+
+When there is no collector and nothing is connected to the signal, responses
+don't measure anything.
+"""
+import bisect
+import math
+import random
+import threading
+import timeit
+
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.dispatch import Signal
+from django.utils.module_loading import import_string
+
+try:
+    from collections.abc import Mapping
+except ImportError:     # Python 2
+    from collections import Mapping
+
+#: Sent when a JSON response has been rendered, with the response class as
+#: the sender and a ``metrics`` argument (a :class:`ResponseMetrics`).
+response_measured = Signal()
+
+#: The phases of building a response, in the order they are reported.
+PHASES = ('build_json', 'get_messages', 'get_form_errors', 'encode')
+
+timer = timeit.default_timer
+
+# The configured collector instance, loaded on first use.
+_UNSET = object()
+_collector = _UNSET
+
+
+def get_collector():
+    """
+    Return the collector instance configured by the
+    ``JSONIT_METRICS_COLLECTOR`` setting, or ``None``.
+    """
+    global _collector
+    if _collector is _UNSET:
+        path = getattr(settings, 'JSONIT_METRICS_COLLECTOR', None)
+        _collector = import_string(path)() if path else None
+    return _collector
+
+
+def clear_collector(**kwargs):
+    """
+    Forget the collector instance when the ``JSONIT_METRICS_COLLECTOR``
+    setting is changed.
+    """
+    global _collector
+    setting = kwargs.get('setting')
+    if setting is None or setting == 'JSONIT_METRICS_COLLECTOR':
+        _collector = _UNSET
+
+setting_changed.connect(clear_collector)
+
+
+def start(response):
+    """
+    Return a new :class:`ResponseMetrics` for the response, or ``None`` if
+    metrics aren't being collected.
+    """
+    collector = _collector
+    if collector is _UNSET:
+        collector = get_collector()
+    # Checking the receivers list directly avoids the signal's lock.
+    if collector is None and not response_measured.receivers:
+        return None
+    return ResponseMetrics(response, collector)
+
+
+def get_view_name(request):
+    """
+    Return the name of the view handling the request (its URL pattern name,
+    or dotted path), falling back to the request path.
+    """
+    match = getattr(request, 'resolver_match', None)
+    if match is not None:
+        return match.view_name
+    return request.path
+
+
+def count_objects(value):
+    """
+    Count the values in a JSON dictionary, including the containers.
+
+    Querysets, iterators and :class:`~jsonit.encoder.RawJSON` values are
+    counted as a single object since they aren't expanded until encoding.
+    """
+    count = 0
+    pending = [value]
+    while pending:
+        value = pending.pop()
+        count += 1
+        if isinstance(value, Mapping):
+            pending.extend(value.values())
+        elif isinstance(value, (list, tuple)):
+            pending.extend(value)
+    return count
+
+
+class ResponseMetrics(object):
+    """
+    The metrics measured while rendering a single JSON response.
+    """
+
+    def __init__(self, response, collector=None):
+        self.response = response
+        self.collector = collector
+        #: The name of the view (see :func:`get_view_name`).
+        self.view_name = get_view_name(response.request)
+        #: The seconds spent in each phase which has been measured.
+        self.durations = {}
+        #: The size of the encoded content, in bytes (before compression).
+        self.size = None
+        #: The number of objects in the JSON dictionary (see
+        #: :func:`count_objects`).
+        self.objects = None
+
+    def measure(self, phase, func, *args, **kwargs):
+        """
+        Call ``func``, adding the time it takes to the duration of ``phase``.
+        """
+        start = timer()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            self.add_duration(phase, timer() - start)
+
+    def measure_iter(self, phase, iterator):
+        """
+        Yield from ``iterator``, adding the time spent producing each item
+        (but not the time spent by the consumer) to the duration of ``phase``.
+        """
+        iterator = iter(iterator)
+        while True:
+            start = timer()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                self.add_duration(phase, timer() - start)
+                return
+            self.add_duration(phase, timer() - start)
+            yield item
+
+    def add_duration(self, phase, seconds):
+        self.durations[phase] = self.durations.get(phase, 0) + seconds
+
+    def count(self, content):
+        self.objects = count_objects(content)
+
+    def finish(self, size):
+        """
+        Record the size of the encoded content and report the metrics.
+        """
+        self.size = size
+        if self.collector is not None:
+            self.collector.record(self)
+        response_measured.send(sender=type(self.response), metrics=self)
+
+
+class BaseCollector(object):
+    """
+    Receives the metrics of every rendered JSON response.
+
+    Subclasses must implement :meth:`record`, which may be called from
+    several threads at once.
+    """
+
+    def record(self, metrics):
+        """
+        Record the :class:`ResponseMetrics` of a response.
+        """
+        raise NotImplementedError
+
+
+class Histogram(object):
+    """
+    The distribution of a series of values.
+
+    Values are counted in power-of-two buckets. Percentiles are calculated
+    from a uniform random sample of at most :attr:`max_samples` values.
+    """
+    max_samples = 1000
+
+    def __init__(self):
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+        self.buckets = {}
+        self.samples = []
+
+    def add(self, value):
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+        bucket = 2 ** math.frexp(value)[1] if value > 0 else 0
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        if len(self.samples) < self.max_samples:
+            bisect.insort(self.samples, value)
+        else:
+            # Reservoir sampling, keeping each value with equal probability.
+            i = random.randrange(self.count)
+            if i < self.max_samples:
+                del self.samples[i]
+                bisect.insort(self.samples, value)
+
+    @property
+    def mean(self):
+        if not self.count:
+            return None
+        return self.total / float(self.count)
+
+    def percentile(self, percent):
+        """
+        Return the value below which ``percent`` percent of the (sampled)
+        values fall, or ``None`` if there are no values.
+        """
+        if not self.samples:
+            return None
+        index = (len(self.samples) - 1) * percent / 100.0
+        lower = int(index)
+        upper = min(lower + 1, len(self.samples) - 1)
+        fraction = index - lower
+        return (self.samples[lower] * (1 - fraction) +
+                self.samples[upper] * fraction)
+
+    def summary(self):
+        """
+        Return a dictionary of the count, mean, minimum, maximum and the 50th,
+        90th and 99th percentiles of the values.
+        """
+        return {
+            'count': self.count,
+            'mean': self.mean,
+            'min': self.min,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p90': self.percentile(90),
+            'p99': self.percentile(99),
+        }
+
+
+class AggregatingCollector(BaseCollector):
+    """
+    Keep histograms of each view's response metrics in memory: a histogram
+    for the duration of each phase (in milliseconds), the ``size`` (in bytes)
+    and the number of ``objects``.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def record(self, metrics):
+        with self.lock:
+            histograms = self.views.setdefault(metrics.view_name, {})
+            values = [(phase, seconds * 1000)
+                      for phase, seconds in metrics.durations.items()]
+            values.append(('size', metrics.size))
+            if metrics.objects is not None:
+                values.append(('objects', metrics.objects))
+            for name, value in values:
+                if name not in histograms:
+                    histograms[name] = Histogram()
+                histograms[name].add(value)
+
+    def reset(self):
+        with self.lock:
+            self.views = {}
+
+    def stats(self):
+        """
+        Return a dictionary mapping each view name to a dictionary of the
+        summaries (see :meth:`Histogram.summary`) of its metrics.
+        """
+        with self.lock:
+            return dict(
+                (view, dict((name, histogram.summary())
+                            for name, histogram in histograms.items()))
+                for view, histograms in self.views.items())
+
+    def report(self):
+        """
+        Return a plain text report of the metrics of each view.
+        """
+        order = PHASES + ('size', 'objects')
+        columns = ('count', 'mean', 'p50', 'p90', 'p99', 'max')
+        lines = []
+        for view, summaries in sorted(self.stats().items()):
+            lines.append(view)
+            lines.append('  %-16s' % '' + ''.join('%12s' % column
+                                                  for column in columns))
+            for name in order:
+                if name not in summaries:
+                    continue
+                summary = summaries[name]
+                line = '  %-16s%12d' % (name, summary['count'])
+                line += ''.join('%12.3f' % summary[column]
+                                for column in columns[1:])
+                lines.append(line)
+        return '\n'.join(lines)
@@ -1,17 +1,99 @@
+import logging
+import sys
+try:
+    from asyncio import iscoroutinefunction
+except ImportError:     # Python 2
+    def iscoroutinefunction(func):
+        return False
+try:
+    from asgiref.sync import markcoroutinefunction
+except ImportError:     # asgiref < 3.6
+    try:
+        from asyncio.coroutines import _is_coroutine
+    except ImportError:     # Python 2
+        _is_coroutine = None
+
+    def markcoroutinefunction(func):
+        func._is_coroutine = _is_coroutine
+        return func
+
+from django.conf import settings
+from django.core.signals import got_request_exception
+
+from jsonit.compat import ugettext as _
 from jsonit.http import JSONResponse
 
+logger = logging.getLogger('django.request')
+
+
+class HiddenException(Exception):
+    """
+    Stands in for an exception whose message shouldn't be shown.
+    """
+
+    def __init__(self):
+        super(HiddenException, self).__init__()
+        self.message = _('Internal error')
+
 
 class JSONExceptionMiddleware(object):
     """
     Django middleware which catches any exception for AJAX requests.
-    
+
     These exceptions will be returned using a JSONResponse rather than letting
     the exception propogate.
+
+    The middleware can be used both in the ``MIDDLEWARE`` setting (under WSGI
+    or ASGI, where it runs in the same mode as the rest of the request so no
+    thread switch is needed) and in the older ``MIDDLEWARE_CLASSES`` setting.
     """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response=None):
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        # When the middleware chain is asynchronous this returns the
+        # coroutine of the next handler, which the caller awaits.
+        return self.get_response(request)
 
     def process_exception(self, request, exception):
         """
-        Intercept exceptions for AJAX requests. 
+        Intercept exceptions for AJAX requests, returning a ``500`` JSON
+        response.
+
+        The exception is reported as Django reports unhandled exceptions
+        (see :meth:`report_exception`). Its message is only included in the
+        response when ``DEBUG`` is on.
+
+        The error response never touches the user's messages, leaving them
+        to be shown by a later request.
+        """
+        if not request.is_ajax():
+            return None
+        self.report_exception(request, exception)
+        if not settings.DEBUG:
+            exception = HiddenException()
+        response = JSONResponse(request, exception=exception)
+        response.status_code = 500
+        # Django's handler would otherwise log the response again.
+        response._has_been_logged = True
+        return response
+
+    def report_exception(self, request, exception):
+        """
+        Send the ``got_request_exception`` signal and log the exception to
+        the ``django.request`` logger.
         """
-        if request.is_ajax():
-            return JSONResponse(exception=exception)
+        exc_info = sys.exc_info()
+        if exc_info[1] is not exception:
+            # The asynchronous handler calls this in a thread.
+            exc_info = (type(exception), exception,
+                        getattr(exception, '__traceback__', None))
+        got_request_exception.send(sender=self.__class__, request=request)
+        logger.error('Internal Server Error: %s', request.path,
+                     exc_info=exc_info,
+                     extra={'status_code': 500, 'request': request})
@@ -0,0 +1,269 @@
+"""
+Parsing of JSON request bodies.
+
+:func:`get_json_body` decodes the body of a request once (with the configured
+JSON backend, see :mod:`jsonit.backends`), keeping the result on the request
+for any later calls. Bodies larger than the ``JSONIT_MAX_BODY_SIZE`` setting
+(in bytes, defaulting to Django's ``DATA_UPLOAD_MAX_MEMORY_SIZE``) are
+refused before they are read. Since Django refuses to read bodies larger
+than ``DATA_UPLOAD_MAX_MEMORY_SIZE`` as ``request.body``, bodies between the
+two limits are read from the request's stream instead, so the setting can
+also raise the limit for JSON bodies.
+
+:func:`iter_json_array` decodes a body which is a JSON array one item at a
+time as it is read, so large uploads never need to be held in memory
+entirely.
+
+Both raise an :class:`InvalidJSONBody` (or :class:`JSONBodyTooLarge`)
+exception, which :class:`~jsonit.views.JSONRequestMixin` views and the
+:func:`~jsonit.decorators.parse_json_body` decorator turn into a JSON
+exception response.
+"""
+import codecs
+import json
+import re
+
+from django.conf import settings
+try:
+    from django.core.exceptions import RequestDataTooBig
+except ImportError:     # Django < 1.10 doesn't limit the body size
+    class RequestDataTooBig(Exception):
+        pass
+
+from jsonit.encoder import decode
+from jsonit.http import JSONResponse
+
+DEFAULT_MAX_SIZE = 2621440
+
+# Where the decoded body is kept on the request.
+BODY_ATTRIBUTE = '_jsonit_body'
+
+WHITESPACE = re.compile(r'[ \t\n\r]*')
+# Characters which may continue a number (which is valid JSON when cut short).
+NUMBER_TAIL = re.compile(r'[0-9eE.+-]*')
+
+
+class InvalidJSONBody(ValueError):
+    """
+    Raised when a request body isn't the JSON expected.
+    """
+    #: The status code of the error response.
+    status_code = 400
+
+    def __init__(self, message):
+        super(InvalidJSONBody, self).__init__(message)
+        # Used as the ``exception`` of the error response.
+        self.message = message
+
+
+class JSONBodyTooLarge(InvalidJSONBody):
+    """
+    Raised when a request body is larger than the maximum size.
+    """
+    status_code = 413
+
+
+def get_max_size(max_size=None):
+    """
+    Return ``max_size``, defaulting to the ``JSONIT_MAX_BODY_SIZE`` setting.
+    ``None`` means there's no limit.
+    """
+    if max_size is not None:
+        return max_size
+    return getattr(settings, 'JSONIT_MAX_BODY_SIZE',
+                   getattr(settings, 'DATA_UPLOAD_MAX_MEMORY_SIZE',
+                           DEFAULT_MAX_SIZE))
+
+
+def is_json_request(request):
+    """
+    Return whether the request's ``Content-Type`` is JSON.
+    """
+    content_type = request.META.get('CONTENT_TYPE', '')
+    content_type = content_type.split(';')[0].strip().lower()
+    return (content_type == 'application/json' or
+            content_type.endswith('+json'))
+
+
+def check_size(size, max_size):
+    if max_size is not None and size > max_size:
+        raise JSONBodyTooLarge('The request body may be at most %d bytes.' %
+                               max_size)
+
+
+def check_content_length(request, max_size):
+    """
+    Refuse a request whose ``Content-Length`` is larger than ``max_size``,
+    before its body is read.
+    """
+    try:
+        length = int(request.META.get('CONTENT_LENGTH') or 0)
+    except ValueError:
+        length = 0
+    check_size(length, max_size)
+
+
+def error_response(request, exception):
+    """
+    Return the JSON exception response for an :class:`InvalidJSONBody`
+    exception, with its status code.
+    """
+    response = JSONResponse(request, exception=exception)
+    response.status_code = exception.status_code
+    return response
+
+
+def get_json_body(request, max_size=None):
+    """
+    Return the decoded JSON body of the request.
+
+    The body is only decoded on the first call for each request, later calls
+    return the same value.
+
+    :param max_size: The maximum size of the body in bytes, defaulting to the
+        ``JSONIT_MAX_BODY_SIZE`` setting.
+    """
+    try:
+        return getattr(request, BODY_ATTRIBUTE)
+    except AttributeError:
+        pass
+    max_size = get_max_size(max_size)
+    check_content_length(request, max_size)
+    body = read_body(request)
+    check_size(len(body), max_size)
+    if not body:
+        raise InvalidJSONBody('The request body is empty.')
+    try:
+        value = decode(body)
+    except ValueError:
+        raise InvalidJSONBody('The request body is not valid JSON.')
+    setattr(request, BODY_ATTRIBUTE, value)
+    return value
+
+
+def read_body(request):
+    """
+    Return the body of the request, even if it is larger than Django's
+    ``DATA_UPLOAD_MAX_MEMORY_SIZE`` (once it is known to be within the
+    maximum size of JSON bodies).
+    """
+    try:
+        return request.body
+    except RequestDataTooBig:
+        # Django checks the Content-Length before reading anything.
+        body = request.read()
+        # Keep it as request.body, as Django does.
+        request._body = body
+        return body
+
+
+def iter_json_array(request, max_size=None, chunk_size=65536):
+    """
+    Yield each item of a request body which is a JSON array, decoding them
+    as the body is read.
+
+    Unless the body has already been read (for example by
+    :func:`get_json_body`), it is read from the request's stream in chunks of
+    ``chunk_size`` bytes, so it can't be accessed as ``request.body``
+    afterwards.
+
+    :param max_size: The maximum size of the body in bytes, defaulting to the
+        ``JSONIT_MAX_BODY_SIZE`` setting.
+    """
+    max_size = get_max_size(max_size)
+    check_content_length(request, max_size)
+    if hasattr(request, '_body'):
+        chunks = iter([request._body])
+    else:
+        chunks = iter(lambda: request.read(chunk_size), b'')
+    return ArrayParser(chunks, max_size).items()
+
+
+class ArrayParser(object):
+    """
+    Decodes the items of a JSON array from chunks of bytes.
+    """
+    # Drop the parsed text once this many characters have been parsed.
+    trim_size = 65536
+
+    def __init__(self, chunks, max_size=None):
+        self.chunks = chunks
+        self.max_size = max_size
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.json_decoder = json.JSONDecoder()
+        self.buffer = ''
+        self.pos = 0
+        self.size = 0
+        self.eof = False
+
+    def fill(self):
+        """
+        Add the next chunk to the buffer.
+        """
+        chunk = next(self.chunks, b'')
+        self.size += len(chunk)
+        check_size(self.size, self.max_size)
+        if not chunk:
+            self.eof = True
+        try:
+            text = self.text_decoder.decode(chunk, final=self.eof)
+        except UnicodeDecodeError:
+            raise InvalidJSONBody('The request body is not valid UTF-8.')
+        if self.pos > self.trim_size:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+        self.buffer += text
+
+    def next_char(self):
+        """
+        Return the next character which isn't whitespace (without consuming
+        it), or ``None`` at the end of the body.
+        """
+        while True:
+            self.pos = WHITESPACE.match(self.buffer, self.pos).end()
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            if self.eof:
+                return None
+            self.fill()
+
+    def error(self, message='The request body is not a valid JSON array.'):
+        return InvalidJSONBody(message)
+
+    def decode_item(self):
+        while True:
+            try:
+                value, end = self.json_decoder.raw_decode(self.buffer,
+                                                          self.pos)
+            except ValueError:
+                if self.eof:
+                    raise self.error()
+                self.fill()
+                continue
+            if (not self.eof and NUMBER_TAIL.match(self.buffer, end).end() ==
+                    len(self.buffer)):
+                # A number might continue in the next chunk.
+                self.fill()
+                continue
+            self.pos = end
+            return value
+
+    def items(self):
+        if self.next_char() != '[':
+            raise self.error()
+        self.pos += 1
+        if self.next_char() == ']':
+            self.pos += 1
+        else:
+            while True:
+                if self.next_char() is None:
+                    raise self.error()
+                yield self.decode_item()
+                char = self.next_char()
+                self.pos += 1
+                if char == ']':
+                    break
+                if char != ',':
+                    raise self.error()
+        if self.next_char() is not None:
+            raise self.error()
@@ -0,0 +1,315 @@
+"""
+Serializers compiled from a declared shape of the ``details``, for views
+which always return the same shape.
+
+A shape is declared as a spec, which is one of:
+
+* A type: ``str``, ``int``, ``float``, ``bool``, ``datetime.datetime``,
+  ``datetime.date``, ``datetime.time``, ``decimal.Decimal`` or
+  ``uuid.UUID``. Strings also accept lazy translations, and floats also
+  accept integers.
+* A dictionary mapping each key to the spec of its value. The value must
+  have exactly these keys.
+* A list containing the spec of every item, such as ``[int]``.
+* :func:`optional`, wrapping the spec of a value which may also be ``None``.
+* ``object``, for a value encoded with the generic encoder.
+* Another :class:`Schema`.
+
+For example::
+
+    class Inbox(JSONResponseMixin, View):
+        json_schema = Schema({
+            'unread': int,
+            'threads': [{'id': int, 'subject': str,
+                         'updated': datetime.datetime,
+                         'labels': optional([str])}],
+        })
+
+The spec is compiled into a serializer when the :class:`Schema` is created,
+so the type of each value is checked directly rather than looked up, and
+there's no need to check for circular references. The encoded output is the
+same as the generic encoder's (see :class:`~jsonit.encoder.JsonitEncoder`),
+although keys are in the order of the spec, and the ``details`` are never
+indented, even when ``DEBUG`` indents the rest of the response.
+
+The extra encoders of a response are respected: values of types which an
+extra encoder converts (and values matching ``object``) are encoded by the
+generic encoder with the response's encoders, in a serializer compiled for
+those encoders the first time they are used.
+
+When the ``details`` don't match the spec, they are encoded by the generic
+encoder instead. If the ``JSONIT_VALIDATE_SCHEMAS`` setting (which defaults
+to ``DEBUG``) is ``True``, a :class:`SchemaMismatch` is raised instead, and
+the compiled output is also checked against the generic encoder's.
+"""
+import datetime
+import decimal
+import json
+import math
+import uuid
+from json.encoder import encode_basestring_ascii
+
+from django.conf import settings
+from django.utils.functional import Promise
+
+from jsonit.compat import integer_types, text_type
+from jsonit.encoder import encode, normalize_encoders
+
+
+class SchemaMismatch(ValueError):
+    """
+    Raised when a value doesn't match the spec of a :class:`Schema`.
+    """
+
+    def __init__(self, path, message='does not match the schema'):
+        super(SchemaMismatch, self).__init__('%s %s' % (path, message))
+        #: The path of the value, such as ``details.threads[].id``.
+        self.path = path
+
+
+class optional(object):
+    """
+    The spec of a value which may be ``None``.
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+
+
+def validate_schemas():
+    """
+    Return whether schemas are validated (the ``JSONIT_VALIDATE_SCHEMAS``
+    setting, defaulting to ``DEBUG``).
+    """
+    return getattr(settings, 'JSONIT_VALIDATE_SCHEMAS', settings.DEBUG)
+
+
+def compile_str(path):
+    def encode_str(value):
+        if not isinstance(value, text_type):
+            if not isinstance(value, Promise):
+                raise SchemaMismatch(path)
+            value = text_type(value)
+        return encode_basestring_ascii(value)
+    return encode_str
+
+
+def compile_int(path):
+    def encode_int(value):
+        if type(value) not in integer_types:
+            raise SchemaMismatch(path)
+        return int.__repr__(value)
+    return encode_int
+
+
+def compile_float(path):
+    def encode_float(value):
+        if type(value) is float:
+            if math.isinf(value) or math.isnan(value):
+                raise SchemaMismatch(path)
+            return float.__repr__(value)
+        if type(value) in integer_types:
+            return int.__repr__(value)
+        raise SchemaMismatch(path)
+    return encode_float
+
+
+def compile_bool(path):
+    def encode_bool(value):
+        if value is True:
+            return 'true'
+        if value is False:
+            return 'false'
+        raise SchemaMismatch(path)
+    return encode_bool
+
+
+def compile_isoformat(cls, exclude=None):
+    def compile_type(path):
+        def encode_value(value):
+            if not isinstance(value, cls) or (
+                    exclude is not None and isinstance(value, exclude)):
+                raise SchemaMismatch(path)
+            return '"%s"' % value.isoformat()
+        return encode_value
+    return compile_type
+
+
+def compile_str_value(cls):
+    def compile_type(path):
+        def encode_value(value):
+            if not isinstance(value, cls):
+                raise SchemaMismatch(path)
+            return '"%s"' % value
+        return encode_value
+    return compile_type
+
+
+def compile_generic(path, encoders=None):
+    def encode_generic(value):
+        return encode(value, encoders, compact=True)
+    return encode_generic
+
+
+# Compile the spec of each type.
+COMPILERS = {
+    text_type: compile_str,
+    str: compile_str,
+    int: compile_int,
+    float: compile_float,
+    bool: compile_bool,
+    datetime.datetime: compile_isoformat(datetime.datetime),
+    # Datetimes are dates too.
+    datetime.date: compile_isoformat(datetime.date, datetime.datetime),
+    datetime.time: compile_isoformat(datetime.time),
+    decimal.Decimal: compile_str_value(decimal.Decimal),
+    uuid.UUID: compile_str_value(uuid.UUID),
+    object: compile_generic,
+}
+
+# The classes of the values accepted by the spec of a type which the generic
+# encoder passes to the extra encoders, if not the type itself (the JSON types
+# are encoded natively).
+ENCODED_CLASSES = {
+    text_type: (Promise,),
+    str: (Promise,),
+    int: (),
+    float: (),
+    bool: (),
+}
+
+
+def is_encoded(spec, encoders):
+    """
+    Return whether any of the extra ``encoders`` converts values matching the
+    spec of a type.
+    """
+    classes = ENCODED_CLASSES.get(spec, (spec,))
+    return any(issubclass(cls, encoder_cls) or issubclass(encoder_cls, cls)
+               for cls in classes for encoder_cls, func in encoders)
+
+
+def compile_spec(spec, path='details', encoders=None):
+    """
+    Return a function which encodes a value matching ``spec`` (see
+    :mod:`jsonit.schema`), raising :class:`SchemaMismatch` for a value which
+    doesn't.
+
+    :param encoders: The normalized extra encoders (see
+        :func:`~jsonit.encoder.normalize_encoders`) to respect.
+    """
+    if isinstance(spec, Schema):
+        return spec.get_serializer(encoders)
+    if isinstance(spec, dict):
+        return compile_dict(spec, path, encoders)
+    if isinstance(spec, list):
+        if len(spec) != 1:
+            raise TypeError('The list spec at %s must contain the spec of '
+                            'its items.' % path)
+        return compile_list(spec[0], path, encoders)
+    if isinstance(spec, optional):
+        return compile_optional(spec.spec, path, encoders)
+    try:
+        compiler = COMPILERS[spec]
+    except (KeyError, TypeError):
+        raise TypeError('Unsupported spec at %s: %r' % (path, spec))
+    if compiler is compile_generic or (encoders and
+                                       is_encoded(spec, encoders)):
+        return compile_generic(path, encoders)
+    return compiler(path)
+
+
+def compile_dict(spec, path, encoders=None):
+    fields = [(key, encode_basestring_ascii(key) + ': ',
+               compile_spec(value_spec, '%s.%s' % (path, key), encoders))
+              for key, value_spec in spec.items()]
+    size = len(fields)
+
+    def encode_dict(value):
+        if not isinstance(value, dict) or len(value) != size:
+            raise SchemaMismatch(path)
+        try:
+            items = [prefix + encode_value(value[key])
+                     for key, prefix, encode_value in fields]
+        except KeyError:
+            raise SchemaMismatch(path)
+        return '{%s}' % ', '.join(items)
+    return encode_dict
+
+
+def compile_list(item_spec, path, encoders=None):
+    encode_item = compile_spec(item_spec, '%s[]' % path, encoders)
+
+    def encode_list(value):
+        if not isinstance(value, (list, tuple)):
+            raise SchemaMismatch(path)
+        return '[%s]' % ', '.join([encode_item(item) for item in value])
+    return encode_list
+
+
+def compile_optional(spec, path, encoders=None):
+    encode_value = compile_spec(spec, path, encoders)
+
+    def encode_optional(value):
+        if value is None:
+            return 'null'
+        return encode_value(value)
+    return encode_optional
+
+
+class Schema(object):
+    """
+    A serializer compiled from a spec of the ``details`` (see
+    :mod:`jsonit.schema`).
+    """
+
+    def __init__(self, spec):
+        self.spec = spec
+        #: The compiled function, which raises :class:`SchemaMismatch` for
+        #: values which don't match.
+        self.serializer = compile_spec(spec)
+        # The serializers compiled for extra encoders.
+        self.serializers = {}
+
+    def __repr__(self):
+        return '<Schema %r>' % (self.spec,)
+
+    def get_serializer(self, encoders=None):
+        """
+        Return the serializer compiled for the extra ``encoders`` (a
+        dictionary or list of two-element tuples, see
+        :func:`~jsonit.encoder.get_encoder`).
+        """
+        encoders = normalize_encoders(encoders)
+        if encoders is None:
+            return self.serializer
+        try:
+            return self.serializers[encoders]
+        except KeyError:
+            serializer = compile_spec(self.spec, encoders=encoders)
+            self.serializers[encoders] = serializer
+            return serializer
+
+    def encode(self, value, validate=None, encoders=None):
+        """
+        Return the encoded ``value``, or ``None`` if it doesn't match the
+        spec.
+
+        :param validate: Whether to raise :class:`SchemaMismatch` for a value
+            which doesn't match, and to check the output against the generic
+            encoder's. Defaults to the ``JSONIT_VALIDATE_SCHEMAS`` setting.
+        :param encoders: The extra encoders of the response.
+        """
+        if validate is None:
+            validate = validate_schemas()
+        try:
+            encoded = self.get_serializer(encoders)(value)
+        except SchemaMismatch:
+            if validate:
+                raise
+            return None
+        if validate and (json.loads(encoded) !=
+                         json.loads(encode(value, encoders))):
+            raise SchemaMismatch('details', 'was not encoded like the '
+                                 'generic encoder would')
+        return encoded
@@ -21,3 +21,5 @@ DATABASES = {
 INSTALLED_APPS = [
     'jsonit'
 ]
+
+DEFAULT_AUTO_FIELD = 'django.db.models.AutoField'
@@ -1,17 +1,70 @@
+import collections
 import datetime
 import json
-from unittest import TestCase
+import decimal
+import gzip
+import io
+import os
+import pickle
+import shutil
+import sys
+import tempfile
+import threading
+import uuid
+import warnings
+from unittest import TestCase, skipIf
+try:
+    import dataclasses
+except ImportError:     # Python < 3.7
+    dataclasses = None
+try:
+    from unittest import mock
+except ImportError:     # Python 2
+    import mock
 
+from django import forms
+from django.forms.formsets import formset_factory
+from django.conf.urls import url
 from django.contrib import messages
 from django.contrib.messages.constants import DEFAULT_TAGS
 from django.contrib.messages.storage import base as messages_base
+from django.contrib.messages.storage.base import Message
 from django.contrib.messages.storage.session import SessionStorage
-from django.http import HttpRequest
+from django.core.cache import cache
+from django.core.exceptions import ImproperlyConfigured
+from django.core.signals import got_request_exception
+from django.db import models
+from django.http import HttpRequest, HttpResponse, HttpResponseRedirect
+from django.test import (RequestFactory, SimpleTestCase,
+                         TestCase as DatabaseTestCase)
+from django.template.response import ContentNotRenderedError
+from django.test.utils import override_settings
 from django.utils.functional import lazy
-from django.utils import six
+from django.views.decorators.cache import cache_page
+from django.views.generic import FormView, TemplateView, View
 
-from jsonit.http import JSONResponse
-from jsonit.encoder import encode
+from jsonit.backends import available_backends
+from jsonit.batch import BatchView
+from jsonit.binary import (CBORFormat, MessagePackFormat, get_format,
+                           pack_cbor, pack_msgpack, unpack_cbor,
+                           unpack_msgpack)
+from jsonit.compat import text_type
+from jsonit.cache import JSONResponseCache
+from jsonit.decorators import cache_json_response, parse_json_body
+from jsonit.delta import DeltaStore, apply_patch, make_patch
+from jsonit.metrics import AggregatingCollector, Histogram, response_measured
+from jsonit.middleware import JSONExceptionMiddleware
+from jsonit.http import (JSONFormResponse, JSONResponse, NDJSONResponse,
+    has_messages, StreamingJSONResponse)
+from jsonit.encoder import (JsonitEncoder, Lazy, RawJSON, encode,
+                            encode_bytes, get_encoder, iterencode)
+from jsonit.request import (ArrayParser, InvalidJSONBody, JSONBodyTooLarge,
+                            get_json_body, iter_json_array)
+from jsonit.schema import Schema, SchemaMismatch, optional
+from jsonit.utils import (ajax_aware_render, clear_template_cache,
+                          resolve_template_name)
+from jsonit.views import (AJAXFormMixin, AJAXTemplateResponseMixin,
+                          JSONResponseMixin)
 
 
 class BaseTest(TestCase):
@@ -48,6 +101,140 @@ class JSONResponseTest(BaseTest):
             {"messages": [], "details": {"test": 1}, "success": True}
         )
 
+    def test_charset(self):
+        details = {'snowman': u'\u2603'}
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                response = JSONResponse(self.request, details=details)
+                response.charset = 'utf-16'
+                content = json.loads(response.content.decode('utf-16'))
+                self.assertEqual(content['details'], details)
+
+
+class ETagTest(BaseTest):
+
+    def setUp(self):
+        super(ETagTest, self).setUp()
+        self.request.method = 'GET'
+
+    def get_response(self, details):
+        return JSONResponse(self.request, details=details, etag=True).render()
+
+    def test_content_etag(self):
+        response = self.get_response({'test': 1})
+        self.assertEqual(response.status_code, 200)
+        etag = response['ETag']
+        self.assertTrue(etag.startswith('"'))
+        self.request.META['HTTP_IF_NONE_MATCH'] = etag
+        response = self.get_response({'test': 1})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+        self.assertEqual(response['ETag'], etag)
+        response = self.get_response({'test': 2})
+        self.assertEqual(response.status_code, 200)
+
+    def test_version_etag(self):
+        version = lambda request: '42'
+        response = JSONResponse(self.request, etag=version)
+        self.request.META['HTTP_IF_NONE_MATCH'] = 'W/%s' % response['ETag']
+
+        class NotBuilt(JSONResponse):
+            def build_json(self, exception=None):
+                raise AssertionError('build_json should not be called')
+
+        response = NotBuilt(self.request, etag=version)
+        self.assertEqual(response.status_code, 304)
+        response = StreamingJSONResponse(self.request, etag=version)
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(list(response.streaming_content), [])
+
+    def test_post(self):
+        self.request.method = 'POST'
+        self.request.META['HTTP_IF_NONE_MATCH'] = '*'
+        response = JSONResponse(self.request, etag=True)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('ETag'))
+
+    def test_ajax_redirect(self):
+
+        class RedirectView(JSONResponseMixin, View):
+            ajax_redirect = True
+            json_etag = True
+            json_compress = True
+
+            def get(self, request):
+                return self.get_json_response(
+                    HttpResponseRedirect('/next/'),
+                    details={'rows': list(range(1000))})
+
+        request = RequestFactory().get(
+            '/', HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            HTTP_ACCEPT_ENCODING='gzip')
+        response = RedirectView.as_view()(request).render()
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.has_header('Location'))
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertTrue(response.has_header('ETag'))
+        content = json.loads(gzip.GzipFile(
+            fileobj=io.BytesIO(response.content)).read().decode('utf-8'))
+        self.assertEqual(content['redirect'], 'http://testserver/next/')
+        response = RedirectView.as_view(ajax_redirect=False,
+                                        json_compress=False)(request)
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertFalse('redirect' in content)
+
+
+class StreamingJSONResponseTest(BaseTest):
+
+    def get_content(self, response):
+        return json.loads(b''.join(response.streaming_content).decode('utf-8'))
+
+    def test_success(self):
+        response = StreamingJSONResponse(self.request, details={'test': 1})
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        self.assertDictEqual(
+            self.get_content(response),
+            {"messages": [], "details": {"test": 1}, "success": True}
+        )
+
+    def test_lazy_iterators(self):
+        consumed = []
+
+        def rows():
+            for i in range(3):
+                consumed.append(i)
+                yield {'row': i, 'date': datetime.date(1980, 1, i + 1)}
+
+        response = StreamingJSONResponse(
+            self.request, details={'rows': rows(), 'empty': iter([])})
+        self.assertEqual(consumed, [])
+        self.assertDictEqual(self.get_content(response)['details'], {
+            'rows': [
+                {'row': 0, 'date': '1980-01-01'},
+                {'row': 1, 'date': '1980-01-02'},
+                {'row': 2, 'date': '1980-01-03'},
+            ],
+            'empty': [],
+        })
+        self.assertEqual(consumed, [0, 1, 2])
+
+    def test_chunks(self):
+        response = StreamingJSONResponse(
+            self.request, details={'rows': (str(i) * 10 for i in range(100))})
+        response.chunk_size = 100
+        chunks = list(response.streaming_content)
+        self.assertTrue(len(chunks) > 5)
+        content = json.loads(b''.join(chunks).decode('utf-8'))
+        self.assertEqual(len(content['details']['rows']), 100)
+
+    def test_buffered_iterators(self):
+        response = JSONResponse(self.request,
+                                details={'rows': (i for i in range(3))})
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8'))['details'],
+            {'rows': [0, 1, 2]})
+
 
 class MessageTest(BaseTest):
 
@@ -73,13 +260,785 @@ class MessageTest(BaseTest):
             }
         )
 
+    def test_raw_details(self):
+        response = JSONResponse(self.request, details=RawJSON('{"raw": [1]}'),
+                                extra_context=RawJSON('"extra"'))
+        self.assertDictEqual(
+            json.loads(response.content.decode('utf-8')),
+            {"messages": [], "details": {"raw": [1]}, "success": True,
+             "extra_context": "extra"}
+        )
+
+
+class NDJSONResponseTest(MessageTest):
+
+    def get_lines(self, response):
+        chunks = list(response.streaming_content)
+        return chunks, [json.loads(chunk.decode('utf-8')) for chunk in chunks]
+
+    def test_records(self):
+        def run():
+            for i in range(3):
+                yield {'done': i, 'date': datetime.date(1980, 1, i + 1)}
+            yield Message(messages.INFO, 'Almost there')
+            messages.success(self.request, 'Imported')
+
+        response = NDJSONResponse(self.request, run(), details={'total': 3})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        chunks, lines = self.get_lines(response)
+        # A chunk (flushed by the server) for each line.
+        self.assertEqual(len(chunks), 5)
+        self.assertTrue(all(chunk.endswith(b'\n') and
+                            chunk.count(b'\n') == 1 for chunk in chunks))
+        self.assertEqual(lines[0], {'record': {'done': 0,
+                                               'date': '1980-01-01'}})
+        self.assertEqual(lines[3], {'message': {'class': 'info',
+                                                'message': 'Almost there'}})
+        self.assertEqual(lines[4], {
+            'success': True,
+            'details': {'total': 3},
+            'messages': [{'class': 'success', 'message': 'Imported'}],
+        })
+
+    def test_lazy(self):
+        consumed = []
+
+        def run():
+            for i in range(3):
+                consumed.append(i)
+                yield i
+
+        content = NDJSONResponse(self.request, run()).streaming_content
+        self.assertEqual(consumed, [])
+        next(content)
+        self.assertEqual(consumed, [0])
+
+    def test_exception(self):
+        def run():
+            yield 1
+            raise ValueError('Broken')
+
+        chunks, lines = self.get_lines(NDJSONResponse(self.request, run()))
+        self.assertEqual(lines[0], {'record': 1})
+        self.assertFalse(lines[1]['success'])
+        self.assertTrue('Broken' in lines[1]['exception'])
+
+    def test_compact(self):
+        records = [{'a': [1, 2]}, RawJSON('{\n  "b": 1\n}')]
+        with override_settings(DEBUG=True):
+            chunks, lines = self.get_lines(
+                NDJSONResponse(self.request, records))
+        self.assertEqual(len(chunks), 3)
+        self.assertEqual(lines[1], {'record': {'b': 1}})
+
+    def test_mixin(self):
+        class ImportView(JSONResponseMixin, View):
+            def get(self, request):
+                return self.get_ndjson_response(None, iter([1, 2]),
+                                                details={'a': 1})
+
+        self.request.method = 'GET'
+        response = ImportView.as_view()(self.request)
+        chunks, lines = self.get_lines(response)
+        self.assertEqual(lines[-1]['details'], {'a': 1})
+        del self.request.META['HTTP_X_REQUESTED_WITH']
+        self.assertIsNone(ImportView.as_view()(self.request))
+
+
+class LazyJSONResponseTest(MessageTest):
+
+    def test_deferred(self):
+        response = JSONResponse(self.request, details={'test': 1})
+        self.assertFalse(response.is_rendered)
+        response.details['other'] = 2
+        response.success = False
+        messages.info(self.request, 'Hello')
+        self.assertEqual(response.details, {'test': 1, 'other': 2})
+        self.assertFalse(response.is_rendered)
+        self.assertDictEqual(
+            json.loads(response.content.decode('utf-8')),
+            {
+                "messages": [{"message": "Hello", "class": "info"}],
+                "details": {"test": 1, "other": 2},
+                "success": False,
+            }
+        )
+        self.assertTrue(response.is_rendered)
+
+    def test_rendered_once(self):
+        response = JSONFormResponse(self.request, forms=[])
+        with mock.patch.object(response, 'build_json',
+                               return_value='{}') as build_json:
+            self.assertEqual(b''.join(response), b'{}')
+            self.assertEqual(response.content, b'{}')
+            response.render()
+        self.assertEqual(build_json.call_count, 1)
+
+    def test_handler_renders(self):
+        # Django's request handler renders responses with a render method.
+        response = JSONResponse(self.request)
+        self.assertIs(response.render(), response)
+        self.assertTrue(response.is_rendered)
+
+    def test_post_render_callback(self):
+        response = JSONResponse(self.request, details={'test': 1})
+        rendered = []
+        response.add_post_render_callback(rendered.append)
+        self.assertEqual(rendered, [])
+        response.render()
+        self.assertEqual(rendered, [response])
+        response.add_post_render_callback(rendered.append)
+        self.assertEqual(rendered, [response, response])
+
+    def test_pickle(self):
+        response = JSONResponse(self.request, details={'test': 1})
+        self.assertRaises(ContentNotRenderedError, pickle.dumps, response)
+        response.render()
+        unpickled = pickle.loads(pickle.dumps(response))
+        self.assertEqual(unpickled.content, response.content)
+        self.assertFalse(hasattr(unpickled, 'request'))
+
+    def test_cache_page(self):
+        calls = []
+
+        @cache_page(60)
+        def view(request):
+            calls.append(request)
+            return JSONResponse(request, details={'calls': len(calls)})
+
+        cache.clear()
+        factory = RequestFactory()
+        for i in range(2):
+            response = view(factory.get('/cached/')).render()
+            self.assertEqual(
+                json.loads(response.content.decode('utf-8'))['details'],
+                {'calls': 1})
+        self.assertEqual(len(calls), 1)
+
+
+class SparseFieldsTest(MessageTest):
+
+    def setUp(self):
+        super(SparseFieldsTest, self).setUp()
+        self.request.method = 'GET'
+        self.details = {
+            'user': {'name': 'Chris', 'email': 'chris@example.com'},
+            'items': [{'id': 1, 'title': 'One'}, {'id': 2, 'title': 'Two'}],
+            'count': 2,
+        }
+
+    def get_content(self, response):
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_fields(self):
+        response = JSONResponse(
+            self.request, details=self.details,
+            extra_context={'title': 'Page', 'other': 1},
+            fields=['user.name', 'items.id', 'missing.key',
+                    'extra_context.title'])
+        content = self.get_content(response)
+        self.assertEqual(content['details'], {
+            'user': {'name': 'Chris'}, 'items': [{'id': 1}, {'id': 2}]})
+        self.assertEqual(content['extra_context'], {'title': 'Page'})
+
+    def test_requested(self):
+        self.request.GET = self.request.GET.copy()
+        self.request.GET['fields'] = 'count'
+        response = JSONResponse(self.request, details=self.details,
+                                fields=True)
+        self.assertEqual(self.get_content(response)['details'], {'count': 2})
+        self.assertEqual(response['Vary'], 'X-Fields')
+        del self.request.GET['fields']
+        self.request.META['HTTP_X_FIELDS'] = 'user.email, count'
+        response = JSONResponse(self.request, details=self.details,
+                                fields=True)
+        self.assertEqual(self.get_content(response)['details'], {
+            'user': {'email': 'chris@example.com'}, 'count': 2})
+
+    def test_not_requested(self):
+        response = JSONResponse(self.request, details=self.details,
+                                fields=True)
+        self.assertEqual(self.get_content(response)['details'], self.details)
+        with override_settings(JSONIT_SPARSE_FIELDS=True):
+            self.request.META['HTTP_X_FIELDS'] = 'count'
+            response = JSONResponse(self.request, details=self.details)
+        self.assertEqual(self.get_content(response)['details'], {'count': 2})
+
+    def test_lazy_values(self):
+        calls = []
+
+        def expensive():
+            calls.append('expensive')
+            return {'total': 10, 'other': 20}
+
+        details = {'count': 2, 'stats': Lazy(expensive)}
+        response = JSONResponse(self.request, details=details,
+                                fields=['count'])
+        self.assertEqual(self.get_content(response)['details'], {'count': 2})
+        self.assertEqual(calls, [])
+        response = JSONResponse(self.request, details=details,
+                                fields=['stats.total'])
+        self.assertEqual(self.get_content(response)['details'],
+                         {'stats': {'total': 10}})
+        response = JSONResponse(self.request, details=details)
+        self.assertEqual(self.get_content(response)['details']['stats'],
+                         {'total': 10, 'other': 20})
+        self.assertEqual(calls, ['expensive', 'expensive'])
+
+    def test_form_errors(self):
+        response = JSONFormResponse(self.request, details={'a': 1, 'b': 2},
+                                    forms=[NameForm(data={})], fields=['a'])
+        self.assertEqual(sorted(self.get_content(response)['details']),
+                         ['a', 'form_errors'])
+
+    def test_etag(self):
+        version = lambda request: '1'
+        full = JSONResponse(self.request, etag=version)
+        sparse = JSONResponse(self.request, etag=version, fields=['count'])
+        self.assertNotEqual(full['ETag'], sparse['ETag'])
+
+    def test_not_cached(self):
+        cache.clear()
+        response_cache = JSONResponseCache()
+        self.request.META['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+        self.request.META['HTTP_X_FIELDS'] = 'count'
+        response = JSONResponse(self.request, details=self.details,
+                                fields=True)
+        response_cache.set_response(self.request, response)
+        self.assertIsNone(response_cache.get_response(self.request))
+
+
+class HasMessagesTest(BaseTest):
+
+    def test_no_storage(self):
+        self.assertFalse(has_messages(self.request))
+
+    def test_session(self):
+        self.request.session = {}
+        storage = self.request._messages = SessionStorage(self.request)
+        JSONResponse(self.request).render()
+        self.assertFalse(storage.used)
+        messages.info(self.request, 'Hello')
+        self.assertTrue(has_messages(self.request))
+
+    def test_session_not_loaded(self):
+        from django.contrib.sessions.backends.signed_cookies import (
+            SessionStore)
+        self.request.session = SessionStore()
+        self.request._messages = SessionStorage(self.request)
+        self.assertFalse(has_messages(self.request))
+        self.assertFalse(hasattr(self.request.session, '_session_cache'))
+        self.request.session = SessionStore(session_key='stored-session')
+        self.assertIsNone(has_messages(self.request, load=False))
+        self.assertFalse(has_messages(self.request))
+
+    def test_cookie(self):
+        from django.contrib.messages.storage.cookie import CookieStorage
+        self.request._messages = CookieStorage(self.request)
+        self.assertFalse(has_messages(self.request))
+        self.request.COOKIES['messages'] = 'stored'
+        self.assertTrue(has_messages(self.request))
+
+    def test_fallback(self):
+        from django.contrib.messages.storage.fallback import FallbackStorage
+        self.request.session = {}
+        self.request._messages = FallbackStorage(self.request)
+        self.assertFalse(has_messages(self.request))
+        self.request.session['_messages'] = 'stored'
+        self.assertTrue(has_messages(self.request))
+
+
+class CacheTest(MessageTest):
+
+    def setUp(self):
+        super(CacheTest, self).setUp()
+        self.request.method = 'GET'
+        self.request.path = '/test/'
+        self.calls = []
+        cache.clear()
+
+    def view(self, request):
+        self.calls.append(request)
+        return JSONResponse(request, details={'calls': len(self.calls)},
+                            extra_context={'date': datetime.date(1980, 1, 1)})
+
+    def get_content(self, response):
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_decorator(self):
+        view = cache_json_response(timeout=60)(self.view)
+        self.assertEqual(self.get_content(view(self.request))['details'],
+                         {'calls': 1})
+        messages.info(self.request, 'Hello')
+        content = self.get_content(view(self.request))
+        self.assertEqual(len(self.calls), 1)
+        self.assertDictEqual(content, {
+            'success': True,
+            'details': {'calls': 1},
+            'messages': [{'message': 'Hello', 'class': 'info'}],
+            'extra_context': {'date': '1980-01-01'},
+        })
+
+    def test_vary_on_params(self):
+        view = cache_json_response(vary_on_params=['page'])(self.view)
+        self.request.GET = self.request.GET.copy()
+        view(self.request).render()
+        self.request.GET['other'] = '1'
+        view(self.request).render()
+        self.assertEqual(len(self.calls), 1)
+        self.request.GET['page'] = '2'
+        view(self.request).render()
+        self.assertEqual(len(self.calls), 2)
+
+    def test_vary_on_user(self):
+        view = cache_json_response()(self.view)
+        users = [mock.Mock(pk=1, is_authenticated=True),
+                 mock.Mock(pk=2, is_authenticated=True),
+                 mock.Mock(pk=None, is_authenticated=False),
+                 mock.Mock(pk=None, is_authenticated=False)]
+        for user in users:
+            self.request.user = user
+            view(self.request).render()
+        # Anonymous users share the cached details.
+        self.assertEqual(len(self.calls), 3)
+        self.request.user = users[0]
+        content = self.get_content(view(self.request))
+        self.assertEqual(content['details'], {'calls': 1})
+        view = cache_json_response(vary_on_user=False,
+                                   key_prefix='shared')(self.view)
+        for user in users:
+            self.request.user = user
+            view(self.request).render()
+        self.assertEqual(len(self.calls), 4)
+
+    def test_not_cached(self):
+        view = cache_json_response()(self.view)
+        self.request.method = 'POST'
+        view(self.request).render()
+        view(self.request).render()
+        self.assertEqual(len(self.calls), 2)
+        self.request.method = 'GET'
+        del self.request.META['HTTP_X_REQUESTED_WITH']
+        view(self.request).render()
+        self.assertEqual(len(self.calls), 3)
+
+    def test_mixin(self):
+        test = self
+
+        class CachedView(JSONResponseMixin, View):
+            json_cache = JSONResponseCache(key_prefix='mixin')
+
+            def get(self, request):
+                return test.view(request)
+
+        view = CachedView.as_view()
+        view(self.request).render()
+        self.assertEqual(self.get_content(view(self.request))['details'],
+                         {'calls': 1})
+        self.assertEqual(len(self.calls), 1)
+
+    def test_cached_as_rendered(self):
+        @cache_json_response(key_prefix='rendered')
+        def view(request):
+            self.calls.append(request)
+            details = {'items': (i for i in range(3))}
+            return JSONResponse(request, details=details)
+
+        response = view(self.request)
+        response.details['late'] = True
+        first = self.get_content(response.render())
+        self.assertEqual(first['details'], {'items': [0, 1, 2], 'late': True})
+        self.assertEqual(self.get_content(view(self.request).render()),
+                         first)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_form_response(self):
+        @cache_json_response(key_prefix='form')
+        def view(request):
+            self.calls.append(request)
+            return JSONFormResponse(request, forms=[NameForm(data={})])
+
+        first = self.get_content(view(self.request).render())
+        self.assertFalse(first['success'])
+        self.assertEqual(list(first['details']['form_errors']), ['id_name'])
+        self.assertEqual(self.get_content(view(self.request).render()),
+                         first)
+        self.assertEqual(len(self.calls), 1)
+
+    def test_compressed(self):
+        view = cache_json_response(compress=True)(self.view)
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        with override_settings(JSONIT_COMPRESS_MIN_SIZE=0):
+            view(self.request).render()
+            response = view(self.request)
+            self.assertEqual(response['Content-Encoding'], 'gzip')
+            compressed = response.content
+            with mock.patch('jsonit.cache.compress') as compress:
+                response = view(self.request)
+            self.assertFalse(compress.called)
+            self.assertEqual(response.content, compressed)
+            messages.info(self.request, 'Hello')
+            response = view(self.request)
+        content = json.loads(gzip.GzipFile(
+            fileobj=io.BytesIO(response.content)).read().decode('utf-8'))
+        self.assertEqual(content['messages'],
+                         [{'message': 'Hello', 'class': 'info'}])
+
+
+class DeltaTest(MessageTest):
+
+    def setUp(self):
+        super(DeltaTest, self).setUp()
+        self.request.method = 'GET'
+        self.request.path = '/delta/'
+        self.store = DeltaStore(max_versions=2)
+        cache.clear()
+
+    def get_content(self, details, base=None):
+        self.request.GET = self.request.GET.copy()
+        if base is not None:
+            self.request.GET['delta_base'] = base
+        response = JSONResponse(self.request, details=details,
+                                delta=self.store)
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_make_patch(self):
+        old = {'a': 1, 'b': [1, 2, 3], 'c/d': {'e': True}, 'f': 'x'}
+        new = {'a': 1, 'b': [1, 5], 'c/d': {'e': 1}, 'g': None}
+        patch = make_patch(old, new)
+        self.assertEqual(sorted(op['path'] for op in patch),
+                         ['/b/1', '/b/2', '/c~1d/e', '/f', '/g'])
+        self.assertEqual(apply_patch(json.loads(json.dumps(old)), patch), new)
+        self.assertEqual(make_patch(new, new), [])
+        self.assertEqual(apply_patch([1], make_patch([1], [1, 2, 3])),
+                         [1, 2, 3])
+
+    def test_full(self):
+        content = self.get_content({'items': [1, 2]})
+        self.assertFalse(content['delta'])
+        self.assertEqual(content['details'], {'items': [1, 2]})
+        self.assertEqual(len(content['version']), 32)
+
+    def test_delta(self):
+        details = {'items': list(range(20)), 'title': 'Inbox'}
+        version = self.get_content(details)['version']
+        details['items'].append(20)
+        content = self.get_content(details, base='"%s"' % version)
+        self.assertTrue(content['delta'])
+        self.assertEqual(content['details'], [
+            {'op': 'add', 'path': '/items/-', 'value': 20}])
+        old = {'items': list(range(20)), 'title': 'Inbox'}
+        self.assertEqual(apply_patch(old, content['details']), details)
+        # The client is up to date.
+        content = self.get_content(details, base=content['version'])
+        self.assertTrue(content['delta'])
+        self.assertEqual(content['details'], [])
+
+    def test_unknown_base(self):
+        content = self.get_content({'a': 1}, base='unknown')
+        self.assertFalse(content['delta'])
+        self.assertEqual(content['details'], {'a': 1})
+        content = self.get_content({'a': 1}, base='0' * 32)
+        self.assertFalse(content['delta'])
+
+    def test_invalid_base(self):
+        # Never used in a cache key (which these would be invalid in).
+        for base in ('a b', 'a\x00', 'a' * 300, 'A' * 32):
+            with warnings.catch_warnings():
+                warnings.simplefilter('error')
+                content = self.get_content({'a': 1}, base=base)
+            self.assertFalse(content['delta'])
+
+    def test_larger_patch(self):
+        version = self.get_content({'a': 1})['version']
+        content = self.get_content({'a': 2}, base=version)
+        self.assertFalse(content['delta'])
+
+    def test_eviction(self):
+        details = {'items': list(range(20))}
+        versions = []
+        for i in range(3):
+            details['items'][0] = i
+            versions.append(self.get_content(details)['version'])
+        self.assertFalse(self.get_content(details, base=versions[0])['delta'])
+        self.assertTrue(self.get_content(details, base=versions[1])['delta'])
+
+    def test_header(self):
+        details = {'items': list(range(20))}
+        version = self.get_content(details)['version']
+        self.request.META['HTTP_X_DELTA_BASE'] = 'W/"%s"' % version
+        details['items'][0] = 'first'
+        self.assertTrue(self.get_content(details)['delta'])
+
+    def test_streaming(self):
+        self.assertRaises(ValueError, StreamingJSONResponse, self.request,
+                          delta=self.store)
+
+    def test_mixin(self):
+        store = self.store
+
+        class DeltaView(JSONResponseMixin, View):
+            json_delta = store
+
+            def get(self, request):
+                return self.get_json_response(None, details={'a': 1})
+
+        response = DeltaView.as_view()(self.request)
+        self.assertTrue('X-Delta-Base' in response['Vary'])
+        self.assertFalse(
+            json.loads(response.content.decode('utf-8'))['delta'])
+
+
+class BinaryTest(MessageTest):
+
+    values = [
+        None, True, False, 0, 1, 127, 128, 255, 256, 65535, 65536,
+        2 ** 32, 2 ** 64 - 1, -1, -32, -33, -128, -129, -2 ** 31 - 1,
+        -2 ** 63, 1.5, -0.25, '', 'text', u'\u00e9t\u00e9', 'x' * 31,
+        'x' * 32, 'x' * 256, 'x' * 70000, b'', b'\x00\xff', b'x' * 300,
+        [], list(range(16)), list(range(70000)), {}, {'a': [1, {'b': None}]},
+        dict(('key%d' % i, i) for i in range(16)), {1: 'one'},
+    ]
+
+    def test_msgpack_round_trip(self):
+        for value in self.values:
+            self.assertEqual(unpack_msgpack(pack_msgpack(value, None)), value)
+        self.assertEqual(pack_msgpack({'a': 1}, None), b'\x81\xa1a\x01')
+        self.assertRaises(OverflowError, pack_msgpack, 2 ** 64, None)
+
+    def test_cbor_round_trip(self):
+        for value in self.values + [2 ** 64, -2 ** 64 - 1, 10 ** 30]:
+            self.assertEqual(unpack_cbor(pack_cbor(value, None)), value)
+        # Examples from RFC 8949, appendix A.
+        self.assertEqual(pack_cbor([1, [2, 3]], None),
+                         b'\x82\x01\x82\x02\x03')
+        self.assertEqual(pack_cbor(1000000, None),
+                         b'\x1a\x00\x0f\x42\x40')
+        self.assertEqual(pack_cbor(-1000, None), b'\x39\x03\xe7')
+        self.assertEqual(unpack_cbor(b'\xf9\x3c\x00'), 1.0)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, unpack_msgpack, b'\xa5ab')
+        self.assertRaises(ValueError, unpack_msgpack, b'\x01\x02')
+        self.assertRaises(ValueError, unpack_cbor, b'\x9f')
+
+    def get_response(self, accept, response_class=JSONResponse, **kwargs):
+        self.request.META['HTTP_ACCEPT'] = accept
+        kwargs.setdefault('binary', True)
+        lazy_text = lazy(lambda: 'lazy', text_type)
+        self.request._messages = SessionStorage(self.request)
+        messages.info(self.request, lazy_text())
+        details = {
+            'date': datetime.date(2011, 9, 29),
+            'price': decimal.Decimal('9.99'),
+            'label': lazy_text(),
+            'counts': {1: 'one', None: [{2.5: True}]},
+        }
+        return response_class(self.request, details=details,
+                              extra_context=RawJSON('"extra"'), **kwargs)
+
+    def test_consistent(self, response_class=JSONResponse):
+        expected = json.loads(self.get_response(
+            'application/json', response_class).content.decode('utf-8'))
+        self.assertEqual(expected['details']['counts'],
+                         {'1': 'one', 'null': [{'2.5': True}]})
+        for accept in ('application/msgpack', 'application/cbor'):
+            response = self.get_response(accept, response_class)
+            self.assertEqual(response['Content-Type'], accept)
+            self.assertTrue('Accept' in response['Vary'])
+            self.assertEqual(response.format.decode(response.content),
+                             expected)
+
+    def test_extra_encoders(self):
+
+        class PlainDateResponse(JSONResponse):
+            encoders = [(datetime.date, lambda d: d.strftime('%d/%m/%Y'))]
+
+        self.test_consistent(PlainDateResponse)
+        response = self.get_response('application/cbor', PlainDateResponse)
+        self.assertEqual(
+            response.format.decode(response.content)['details']['date'],
+            '29/09/2011')
+
+    def test_invalid_keys(self):
+        for format_class in (MessagePackFormat, CBORFormat):
+            format = format_class(get_encoder())
+            self.assertRaises(TypeError, format.encode, {(1, 2): 'pair'})
+
+    def test_negotiation(self):
+        def negotiate(accept):
+            self.request.META['HTTP_ACCEPT'] = accept
+            format = get_format(self.request)
+            return format and format.name
+
+        self.assertIsNone(negotiate('*/*'))
+        self.assertIsNone(
+            negotiate('application/json, application/cbor;q=0.5'))
+        self.assertEqual(negotiate('application/x-msgpack'), 'msgpack')
+        self.assertEqual(negotiate('application/json; q=0.5, */*; q=0.1, '
+                                   'application/cbor'), 'cbor')
+        self.assertEqual(negotiate('application/cbor, application/msgpack'),
+                         'msgpack')
+
+    def test_not_enabled(self):
+        response = self.get_response('application/msgpack', binary=None)
+        self.assertEqual(response['Content-Type'], 'application/json')
+        with override_settings(JSONIT_BINARY=True):
+            response = self.get_response('application/msgpack', binary=None)
+        self.assertEqual(response['Content-Type'], 'application/msgpack')
+
+
+class CompressionTest(BaseTest):
+
+    def setUp(self):
+        super(CompressionTest, self).setUp()
+        self.details = {'rows': ['row %s' % i for i in range(200)]}
+
+    def decompress(self, response):
+        return json.loads(gzip.GzipFile(
+            fileobj=io.BytesIO(response.content)).read().decode('utf-8'))
+
+    def test_gzip(self):
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'deflate, gzip'
+        response = JSONResponse(self.request, details=self.details,
+                                compress=True).render()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+        self.assertEqual(int(response['Content-Length']),
+                         len(response.content))
+        self.assertEqual(self.decompress(response)['details'], self.details)
+
+    def test_setting(self):
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        response = JSONResponse(self.request, details=self.details).render()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        with override_settings(JSONIT_COMPRESS=True):
+            response = JSONResponse(self.request,
+                                    details=self.details).render()
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+
+    def test_not_accepted(self):
+        response = JSONResponse(self.request, details=self.details,
+                                compress=True).render()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip;q=0, identity'
+        response = JSONResponse(self.request, details=self.details,
+                                compress=True).render()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+    def test_min_size(self):
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        response = JSONResponse(self.request, compress=True).render()
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertFalse(response.has_header('Vary'))
+
+    def test_etag(self):
+        self.request.method = 'GET'
+        self.request.META['HTTP_ACCEPT_ENCODING'] = 'gzip'
+        response = JSONResponse(self.request, details=self.details,
+                                compress=True, etag=True).render()
+        self.assertTrue(response['ETag'].startswith('W/'))
+        self.request.META['HTTP_IF_NONE_MATCH'] = response['ETag']
+        response = JSONResponse(self.request, details=self.details,
+                                compress=True, etag=True).render()
+        self.assertEqual(response.status_code, 304)
+
+
+class AJAXTemplateView(AJAXTemplateResponseMixin, TemplateView):
+    template_name = 'page.html'
+
+
+class TemplateCacheTest(BaseTest):
+
+    def setUp(self):
+        super(TemplateCacheTest, self).setUp()
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.write('page.html', 'Page {{ is_ajax }}')
+        self.settings = override_settings(TEMPLATES=[{
+            'BACKEND': 'django.template.backends.django.DjangoTemplates',
+            'DIRS': [self.dir],
+            'OPTIONS': {
+                'loaders': ['django.template.loaders.filesystem.Loader'],
+            },
+        }])
+        self.settings.enable()
+        self.addCleanup(self.settings.disable)
+
+    def write(self, name, content):
+        with open(os.path.join(self.dir, name), 'w') as f:
+            f.write(content)
+
+    def test_resolved_once(self):
+        from django.template import loader
+        template_list = ['page.ajax.html', 'page.html']
+        with mock.patch('jsonit.utils.loader.get_template',
+                        wraps=loader.get_template) as get_template:
+            self.assertEqual(resolve_template_name(template_list, True),
+                             'page.html')
+            self.assertEqual(get_template.call_count, 2)
+            self.assertEqual(resolve_template_name(template_list, True),
+                             'page.html')
+            self.assertEqual(get_template.call_count, 2)
+        self.assertIsNone(resolve_template_name(['missing.html']))
+
+    def test_invalidated(self):
+        template_list = ['page.ajax.html', 'page.html']
+        self.assertEqual(resolve_template_name(template_list, True),
+                         'page.html')
+        self.write('page.ajax.html', 'AJAX page')
+        self.assertEqual(resolve_template_name(template_list, True),
+                         'page.html')
+        clear_template_cache()
+        self.assertEqual(resolve_template_name(template_list, True),
+                         'page.ajax.html')
+
+    def test_autoreload(self):
+        try:
+            from pathlib import Path
+            from django.utils.autoreload import file_changed
+        except ImportError:
+            self.skipTest('The file_changed signal requires Django 2.2+.')
+        resolve_template_name(['page.html'])
+        path = Path(self.dir, 'page.html')
+        file_changed.send(sender=None, file_path=path)
+        with mock.patch('jsonit.utils.loader.get_template') as get_template:
+            resolve_template_name(['page.html'])
+        self.assertTrue(get_template.called)
+
+    def test_view(self):
+        view = AJAXTemplateView()
+        view.request = self.request
+        self.assertEqual(view.get_template_names(), ['page.html'])
+        view.template_name = 'missing.html'
+        self.assertEqual(view.get_template_names(),
+                         ['missing.ajax.html', 'missing.html'])
+
+    def test_ajax_aware_render(self):
+        self.write('page.ajax.html', 'AJAX page {{ is_ajax }}')
+        response = ajax_aware_render(self.request, 'page.html')
+        self.assertEqual(response.content, b'AJAX page True')
+        del self.request.META['HTTP_X_REQUESTED_WITH']
+        response = ajax_aware_render(self.request, 'page.html')
+        self.assertEqual(response.content, b'Page ')
+
 
 class EncoderTest(TestCase):
 
     def test_lazy(self):
-        test_msg = lazy(lambda: 'Test!', six.text_type)
+        test_msg = lazy(lambda: 'Test!', text_type)
         self.assertEqual(encode(test_msg()), '"Test!"')
 
+    def test_lazy_value(self):
+        self.assertEqual(encode({'lazy': Lazy(lambda: [1, 2])}),
+                         '{"lazy": [1, 2]}')
+        # Other callables are never called.
+        calls = []
+        self.assertRaises(TypeError, encode, {'delete': calls.append})
+        self.assertRaises(TypeError, encode, {'class': EncoderTest})
+        self.assertEqual(calls, [])
+
     def test_datetime(self):
         self.assertEqual(encode(datetime.datetime(1980, 1, 1, 12, 0, 5)),
                          '"1980-01-01T12:00:05"')
@@ -93,3 +1052,1014 @@ class EncoderTest(TestCase):
         self.assertEqual(encode(datetime.datetime(1980, 1, 1),
                                 encoders=[(datetime.datetime, encode_dt)]),
                          u'"01 Jan 1980"')
+
+    def test_custom_encoder_base_class(self):
+        encode_date = lambda d: d.strftime('%d %b %Y')
+        self.assertEqual(encode(datetime.datetime(1980, 1, 1),
+                                encoders=[(datetime.date, encode_date)]),
+                         u'"01 Jan 1980"')
+
+    def test_subclass(self):
+        class CustomDate(datetime.date):
+            pass
+        encoder = JsonitEncoder()
+        self.assertEqual(encoder.encode([CustomDate(1980, 1, 1)] * 2),
+                         '["1980-01-01", "1980-01-01"]')
+        self.assertIn(CustomDate, encoder._dispatch)
+
+    def test_unknown_type(self):
+        self.assertRaises(TypeError, encode, object())
+
+    def test_dict_encoders(self):
+        encode_dt = lambda d: d.strftime('%d %b %Y')
+        self.assertEqual(encode(datetime.datetime(1980, 1, 1),
+                                encoders={datetime.datetime: encode_dt}),
+                         u'"01 Jan 1980"')
+
+
+class RawJSONTest(BaseTest):
+
+    value = {
+        'cached': RawJSON('{"a": [1, 2]}'),
+        'rows': [RawJSON('1'), {'row': RawJSON(b'"\\u00e9"')}],
+        'date': datetime.date(1980, 1, 1),
+    }
+    expected = {
+        'cached': {'a': [1, 2]},
+        'rows': [1, {'row': u'\u00e9'}],
+        'date': '1980-01-01',
+    }
+
+    def test_encode(self):
+        encoded = encode(self.value)
+        self.assertTrue('{"a": [1, 2]}' in encoded)
+        self.assertEqual(json.loads(encoded), self.expected)
+
+    def test_iterencode(self):
+        self.assertEqual(json.loads(''.join(iterencode(self.value))),
+                         self.expected)
+
+    def test_backends(self):
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                self.assertEqual(json.loads(encode(self.value)),
+                                 self.expected)
+
+    def test_responses(self):
+        response = JSONResponse(self.request, details=self.value)
+        self.assertEqual(
+            json.loads(response.content.decode('utf-8'))['details'],
+            self.expected)
+        response = StreamingJSONResponse(self.request, details=self.value)
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(json.loads(content)['details'], self.expected)
+
+    def test_placeholder_strings(self):
+        value = {'text': '\x00jsonit-raw-1-1\x00', 'raw': RawJSON('2')}
+        self.assertEqual(json.loads(encode(value)), {
+            'text': '\x00jsonit-raw-1-1\x00', 'raw': 2})
+
+    def test_nested_encode(self):
+        value = [RawJSON('1'), Lazy(lambda: encode([RawJSON('2')])),
+                 RawJSON('3')]
+        self.assertEqual(json.loads(encode(value)), [1, '[2]', 3])
+
+    def test_encoder(self):
+        # Used directly, the encoder decodes the fragment to encode it.
+        self.assertEqual(json.loads(json.dumps(self.value, cls=JsonitEncoder)),
+                         self.expected)
+
+    def test_validate(self):
+        self.assertRaises(ValueError, RawJSON, '{"a": ', validate=True)
+        self.assertEqual(RawJSON('{"a": ', validate=False).encoded, '{"a": ')
+        with override_settings(DEBUG=True):
+            self.assertRaises(ValueError, RawJSON, '[1')
+        with override_settings(JSONIT_VALIDATE_RAW_JSON=True):
+            self.assertRaises(ValueError, RawJSON, '[1')
+        RawJSON('[1')
+
+
+class SchemaTest(MessageTest):
+
+    spec = {
+        'count': int,
+        'ratio': float,
+        'enabled': bool,
+        'rows': [{
+            'name': str,
+            'created': datetime.datetime,
+            'day': datetime.date,
+            'price': decimal.Decimal,
+            'uuid': optional(uuid.UUID),
+        }],
+        'extra': object,
+    }
+
+    def get_details(self):
+        lazy_text = lazy(lambda: u'caf\u00e9', text_type)
+        return {
+            'count': 2,
+            'ratio': 1,
+            'enabled': True,
+            'rows': [{
+                'name': name,
+                'created': datetime.datetime(2011, 9, 29, 15, 20, 35),
+                'day': datetime.date(2011, 9, 29),
+                'price': decimal.Decimal('9.99'),
+                'uuid': None if i else uuid.UUID(int=1),
+            } for i, name in enumerate(['Chris', lazy_text()])],
+            'extra': {'any': [1, 'thing']},
+        }
+
+    def test_encode(self):
+        schema = Schema(self.spec)
+        details = self.get_details()
+        encoded = schema.encode(details, validate=True)
+        self.assertEqual(json.loads(encoded), json.loads(encode(details)))
+
+    def test_mismatch(self):
+        schema = Schema(self.spec)
+        for change in [{'count': True}, {'ratio': float('nan')},
+                       {'rows': [{}]}, {'extra2': 1}, {'enabled': 1}]:
+            details = self.get_details()
+            details.update(change)
+            self.assertIsNone(schema.encode(details, validate=False))
+        details = self.get_details()
+        details['rows'] = None
+        try:
+            schema.encode(details, validate=True)
+        except SchemaMismatch as e:
+            self.assertEqual(e.path, 'details.rows')
+        else:
+            self.fail('SchemaMismatch not raised.')
+        with override_settings(DEBUG=True):
+            self.assertRaises(SchemaMismatch, schema.encode, details)
+
+    def test_date_not_datetime(self):
+        schema = Schema({'day': datetime.date})
+        self.assertIsNone(schema.encode(
+            {'day': datetime.datetime(2011, 9, 29)}, validate=False))
+
+    def test_invalid_spec(self):
+        self.assertRaises(TypeError, Schema, {'a': list})
+        self.assertRaises(TypeError, Schema, {'a': [int, str]})
+
+    def test_response(self):
+        details = self.get_details()
+        schema = Schema(self.spec)
+        with mock.patch.object(schema, 'serializer',
+                               wraps=schema.serializer) as serializer:
+            response = JSONResponse(self.request, details=details,
+                                    schema=schema)
+            content = json.loads(response.content.decode('utf-8'))
+        self.assertTrue(serializer.called)
+        self.assertEqual(content['details'], json.loads(encode(details)))
+        # The generic encoder is used for details which don't match.
+        response = JSONResponse(self.request, details={'other': 1},
+                                schema=schema)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))
+                         ['details'], {'other': 1})
+
+    def test_mixin(self):
+        class SchemaView(JSONResponseMixin, View):
+            json_schema = {'a': int}
+
+            def get(self, request):
+                return self.get_json_response(None, details={'a': 1})
+
+        self.request.method = 'GET'
+        response = SchemaView.as_view()(self.request)
+        # The spec is compiled once, for the class.
+        self.assertTrue(isinstance(SchemaView.json_schema, Schema))
+        self.assertEqual(response.schema, SchemaView.json_schema)
+        response = SchemaView.as_view()(self.request)
+        self.assertIs(response.schema, SchemaView.json_schema)
+        self.assertEqual(json.loads(response.content.decode('utf-8'))
+                         ['details'], {'a': 1})
+
+
+    def test_extra_encoders(self):
+        encoders = [(datetime.date, lambda d: d.strftime('%d/%m/%Y')),
+                    (uuid.UUID, lambda u: u.hex)]
+        schema = Schema(self.spec)
+        details = self.get_details()
+        encoded = schema.encode(details, validate=True, encoders=encoders)
+        self.assertEqual(json.loads(encoded),
+                         json.loads(encode(details, encoders)))
+        self.assertEqual(json.loads(encoded)['rows'][0]['day'], '29/09/2011')
+        # Compiled once for each set of encoders.
+        self.assertIs(schema.get_serializer(encoders),
+                      schema.get_serializer(list(encoders)))
+
+        class DateResponse(JSONResponse):
+            encoders = [(datetime.date, lambda d: d.strftime('%d/%m/%Y'))]
+
+        response = DateResponse(self.request, details=details, schema=schema)
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertEqual(content['details']['rows'][0]['created'],
+                         '29/09/2011')
+
+    def test_not_indented(self):
+        schema = Schema(self.spec)
+        with override_settings(DEBUG=True):
+            encoded = schema.encode(self.get_details())
+        self.assertFalse('\n' in encoded)
+
+
+class EncoderCacheTest(TestCase):
+
+    def test_reused(self):
+        self.assertIs(get_encoder(), get_encoder())
+        encoders = [(datetime.date, str)]
+        self.assertIs(get_encoder(encoders), get_encoder(list(encoders)))
+        self.assertIsNot(get_encoder(), get_encoder(encoders))
+
+    def test_debug_changed(self):
+        self.assertEqual(encode([1]), '[1]')
+        with override_settings(DEBUG=True):
+            self.assertEqual(encode([1]), '[\n  1\n]')
+        self.assertEqual(encode([1]), '[1]')
+
+
+class ConformanceForm(forms.Form):
+    name = forms.CharField()
+    email = forms.EmailField()
+
+    def clean(self):
+        raise forms.ValidationError('Form-wide error')
+
+
+class BackendConformanceTest(MessageTest):
+    """
+    Every available backend must produce the same output as the standard
+    library backend.
+    """
+
+    def get_details(self):
+        test_msg = lazy(lambda: u'Test \u2603', text_type)
+        return {
+            'lazy': test_msg(),
+            'datetime': datetime.datetime(1980, 1, 1, 12, 0, 5, 10),
+            'date': datetime.date(1980, 1, 1),
+            'nested': {'list': [1, 2.5, None, True], 'tuple': (1, 'two')},
+            1: 'integer key',
+        }
+
+    def render(self, backend, response_class, **kwargs):
+        self.request.session = {}
+        self.request._messages = SessionStorage(self.request)
+        messages.info(self.request, 'Hello')
+        with override_settings(JSONIT_BACKEND=backend):
+            response = response_class(self.request,
+                                      details=self.get_details(), **kwargs)
+            return response.content.decode('utf-8')
+
+    def assertConforms(self, response_class, **kwargs):
+        expected = json.loads(self.render('json', response_class, **kwargs))
+        for backend in available_backends():
+            for debug in (False, True):
+                with override_settings(DEBUG=debug):
+                    content = self.render(backend, response_class, **kwargs)
+                self.assertEqual(json.loads(content), expected,
+                                 'Backend %r differs' % backend)
+
+    def test_json_response(self):
+        self.assertConforms(JSONResponse)
+
+    def test_json_form_response(self):
+        form = ConformanceForm(data={'email': 'invalid'})
+        self.assertConforms(JSONFormResponse, forms=[form])
+
+    def test_large_integer(self):
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                # The generator is consumed before orjson fails.
+                details = collections.OrderedDict([
+                    ('items', (i for i in range(3))), ('large', 2 ** 70)])
+                response = JSONResponse(self.request, details=details)
+                content = json.loads(response.content.decode('utf-8'))
+            self.assertEqual(content['details'],
+                             {'large': 2 ** 70, 'items': [0, 1, 2]},
+                             'Backend %r differs' % backend)
+
+    def test_nan(self):
+        # orjson encodes non-finite floats as null, rather than as the
+        # invalid JSON NaN of the standard library.
+        expected = {'json': 'NaN', 'simplejson': 'NaN', 'orjson': 'null'}
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                self.assertEqual(encode(float('nan')), expected[backend])
+
+    def test_extra_encoders(self):
+        encoders = [(datetime.date, lambda d: d.year)]
+        details = self.get_details()
+        expected = json.loads(encode(details, encoders=encoders))
+        self.assertEqual(expected['datetime'], 1980)
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                self.assertEqual(
+                    json.loads(encode(details, encoders=encoders)), expected)
+
+    def test_encode_bytes(self):
+        details = dict(self.get_details(), raw=RawJSON(u'["\u2603"]'))
+        for backend in available_backends():
+            for debug in (False, True):
+                with override_settings(JSONIT_BACKEND=backend, DEBUG=debug):
+                    encoded = encode_bytes(details)
+                    self.assertTrue(isinstance(encoded, bytes))
+                    self.assertEqual(encoded.decode('utf-8'),
+                                     encode(details))
+        with override_settings(JSONIT_BACKEND='json', DEBUG=True):
+            # Indented output is written in batches.
+            rows = [{'row': i} for i in range(1000)]
+            self.assertEqual(encode_bytes(rows).decode('utf-8'),
+                             encode(rows))
+        with override_settings(JSONIT_BACKEND='json', DEBUG=False):
+            # Large lists and dictionaries are encoded in slices.
+            details = {
+                'rows': [{'row': i} for i in range(250)],
+                'nested': {'keys': dict(('k%s' % i, i) for i in range(250)),
+                           1: 'integer key'},
+                'raw': RawJSON(u'["\u2603"]'),
+                'date': datetime.date(1980, 1, 1),
+            }
+            self.assertEqual(json.loads(encode_bytes(details).decode('utf-8')),
+                             json.loads(encode(details)))
+
+    def test_natively_encoded_types(self):
+        class Label(text_type):
+            pass
+
+        class Score(float):
+            pass
+
+        Point = collections.namedtuple('Point', 'x y')
+        encoders = [(uuid.UUID, lambda u: u.hex),
+                    (Label, lambda l: 'extra'),
+                    (Score, lambda s: 'extra')]
+        details = {
+            'uuid': uuid.UUID(int=1),
+            'label': Label('label'),
+            'score': Score(1.5),
+            'point': Point(1, 2),
+            'ordered': collections.OrderedDict([('b', 1), ('a', 2)]),
+        }
+        expected = json.loads(encode(details, encoders=encoders))
+        self.assertEqual(expected, {
+            'uuid': '0' * 31 + '1', 'label': 'label', 'score': 1.5,
+            'point': [1, 2], 'ordered': {'b': 1, 'a': 2}})
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                self.assertEqual(
+                    json.loads(encode(details, encoders=encoders)), expected,
+                    'Backend %r differs' % backend)
+
+    @skipIf(dataclasses is None, 'dataclasses require Python 3.7+')
+    def test_dataclass_encoder(self):
+        Point = dataclasses.make_dataclass('Point', ['x', 'y'])
+        encoders = [(Point, lambda p: [p.x, p.y])]
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                self.assertEqual(
+                    json.loads(encode({'p': Point(1, 2)}, encoders=encoders)),
+                    {'p': [1, 2]})
+
+    def test_auto(self):
+        with override_settings(JSONIT_BACKEND='auto'):
+            self.assertEqual(encode([1]).replace(' ', ''), '[1]')
+
+    def test_unknown(self):
+        with override_settings(JSONIT_BACKEND='jsonit.backends.Missing'):
+            self.assertRaises(ImproperlyConfigured, encode, [1])
+
+
+class NameForm(forms.Form):
+    name = forms.CharField()
+
+
+class FormsetTest(BaseTest):
+
+    def setUp(self):
+        super(FormsetTest, self).setUp()
+        NameFormSet = formset_factory(NameForm, max_num=2, validate_max=True)
+        self.formset = NameFormSet(data={
+            'form-TOTAL_FORMS': '3', 'form-INITIAL_FORMS': '0',
+            'form-0-name': 'a', 'form-1-name': '', 'form-2-name': 'c',
+        })
+        self.formset.forms[1].empty_permitted = False
+
+    def get_errors(self, **kwargs):
+        response = JSONFormResponse(self.request, forms=[self.formset],
+                                    **kwargs)
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertFalse(content['success'])
+        return content['details']['form_errors']
+
+    def test_flat(self):
+        errors = self.get_errors()
+        self.assertEqual(sorted(errors), ['__all__', 'id_form-1-name'])
+        self.assertEqual(len(errors['__all__']), 1)
+        self.assertEqual(errors['id_form-1-name'], ['This field is required.'])
+
+    def test_indexed(self):
+        errors = self.get_errors(indexed_errors=True)
+        self.assertEqual(list(errors), ['form'])
+        self.assertEqual(len(errors['form']['__all__']), 1)
+        self.assertEqual(errors['form']['forms'],
+                         {'1': {'name': ['This field is required.']}})
+
+    def test_known_valid(self):
+        form = NameForm(data={'name': 'a'})
+        self.assertTrue(form.is_valid())
+        response = JSONFormResponse(self.request, forms=[form])
+        with mock.patch.object(form, 'full_clean') as full_clean:
+            response.render()
+        self.assertFalse(full_clean.called)
+        self.assertTrue(response.success)
+
+    def test_deleted(self):
+        NameFormSet = formset_factory(NameForm, can_delete=True)
+        formset = NameFormSet(data={
+            'form-TOTAL_FORMS': '3', 'form-INITIAL_FORMS': '3',
+            'form-0-name': '', 'form-0-DELETE': 'on',
+            'form-1-name': 'b', 'form-2-name': '',
+        })
+        response = JSONFormResponse(self.request, forms=[formset],
+                                    indexed_errors=True).render()
+        # Indexes are those of the forms, including the deleted one.
+        self.assertEqual(response.details['form_errors']['form']['forms'],
+                         {'2': {'name': ['This field is required.']}})
+
+    def test_unbound(self):
+        NameFormSet = formset_factory(NameForm)
+        for indexed_errors in (False, True):
+            response = JSONFormResponse(self.request, forms=[NameFormSet()],
+                                        indexed_errors=indexed_errors)
+            response.render()
+            self.assertTrue(response.success)
+            self.assertFalse('form_errors' in response.details)
+
+    def test_field_ids_cached(self):
+        JSONFormResponse(self.request, forms=[NameForm(data={})]).render()
+        form = NameForm(data={})
+        with mock.patch.object(NameForm, '__getitem__') as getitem:
+            response = JSONFormResponse(self.request, forms=[form])
+            response.render()
+        self.assertFalse(getitem.called)
+        self.assertEqual(list(response.details['form_errors']), ['id_name'])
+
+
+class JSONFormView(AJAXFormMixin, FormView):
+    form_class = NameForm
+    template_name = 'form.html'
+    success_url = '/done/'
+
+
+class RequestBodyTest(TestCase):
+
+    def setUp(self):
+        self.factory = RequestFactory()
+
+    def post(self, body, content_type='application/json', **extra):
+        if not isinstance(body, bytes):
+            body = json.dumps(body).encode('utf-8')
+        return self.factory.post('/', body, content_type=content_type,
+                                 **extra)
+
+    def get_content(self, response):
+        return json.loads(response.content.decode('utf-8'))
+
+    def test_memoized(self):
+        request = self.post({'a': [1, 2]})
+        body = get_json_body(request)
+        self.assertEqual(body, {'a': [1, 2]})
+        self.assertTrue(get_json_body(request) is body)
+
+    def test_backends(self):
+        for backend in available_backends():
+            with override_settings(JSONIT_BACKEND=backend):
+                request = self.post(b'{"snowman": "\\u2603", "n": 1.5}')
+                self.assertEqual(get_json_body(request),
+                                 {'snowman': u'\u2603', 'n': 1.5})
+                request = self.post(b'{"a": ')
+                self.assertRaises(InvalidJSONBody, get_json_body, request)
+
+    def test_invalid(self):
+        self.assertRaises(InvalidJSONBody, get_json_body, self.post(b''))
+        self.assertRaises(InvalidJSONBody, get_json_body,
+                          self.post(b'{"a": }'))
+
+    def test_max_size(self):
+        request = self.post([0] * 100)
+        self.assertRaises(JSONBodyTooLarge, get_json_body, request, 10)
+        # The body wasn't read.
+        self.assertFalse(hasattr(request, '_body'))
+        request = self.post([0] * 100)
+        request.META['CONTENT_LENGTH'] = '5'
+        self.assertRaises(JSONBodyTooLarge, get_json_body, request, 10)
+        with override_settings(JSONIT_MAX_BODY_SIZE=10):
+            self.assertRaises(JSONBodyTooLarge, get_json_body,
+                              self.post([0] * 100))
+            self.assertEqual(get_json_body(self.post([0])), [0])
+
+    def test_max_size_above_django(self):
+        # Bodies over Django's limit are read from the stream instead.
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10,
+                               JSONIT_MAX_BODY_SIZE=1000):
+            request = self.post([0] * 100)
+            self.assertEqual(get_json_body(request), [0] * 100)
+            self.assertEqual(json.loads(request.body.decode('utf-8')),
+                             [0] * 100)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10,
+                               JSONIT_MAX_BODY_SIZE=None):
+            self.assertEqual(get_json_body(self.post([0] * 100)), [0] * 100)
+        with override_settings(DATA_UPLOAD_MAX_MEMORY_SIZE=10):
+            response = JSONFormView.as_view()(self.post({'name': 'Chris'}))
+        self.assertEqual(response.status_code, 413)
+
+    def parse(self, body, chunk_size):
+        chunks = [body[i:i + chunk_size]
+                  for i in range(0, len(body), chunk_size)]
+        parser = ArrayParser(iter(chunks))
+        # Drop the parsed text often.
+        parser.trim_size = 8
+        return list(parser.items())
+
+    def test_iter_json_array(self):
+        items = [123456789, -1.5e10, u'sn\u2603wman', {'a': [True, None]},
+                 [], {}, 'x' * 100]
+        body = json.dumps(items, ensure_ascii=False).encode('utf-8')
+        for chunk_size in (1, 2, 3, 7, len(body)):
+            self.assertEqual(self.parse(body, chunk_size), items)
+        self.assertEqual(self.parse(b' [ ] ', 1), [])
+        self.assertEqual(self.parse(b'[1 , 2]', 1), [1, 2])
+        request = self.post(items)
+        self.assertEqual(list(iter_json_array(request, chunk_size=4)), items)
+        # The body has already been read.
+        request = self.post(items)
+        get_json_body(request)
+        self.assertEqual(list(iter_json_array(request)), items)
+
+    def test_iter_json_array_invalid(self):
+        for body in (b'', b'{}', b'[1', b'[1,]', b'[1 2]', b'[1] 2', b'[,]',
+                     b'["\xff"]'):
+            for chunk_size in (1, 100):
+                self.assertRaises(InvalidJSONBody, self.parse, body,
+                                  chunk_size)
+
+    def test_iter_json_array_max_size(self):
+        request = self.post([0] * 100)
+        request.META['CONTENT_LENGTH'] = '5'
+        items = iter_json_array(request, max_size=20, chunk_size=4)
+        self.assertEqual(next(items), 0)
+        self.assertRaises(JSONBodyTooLarge, list, items)
+
+    def test_form(self):
+        view = JSONFormView.as_view()
+        # Not sent as an AJAX request.
+        content = self.get_content(view(self.post({'name': ''})))
+        self.assertFalse(content['success'])
+        self.assertEqual(content['details']['form_errors'],
+                         {'id_name': ['This field is required.']})
+        content = self.get_content(view(self.post({'name': 'Chris'})))
+        self.assertTrue(content['success'])
+        self.assertEqual(content['redirect'], 'http://testserver/done/')
+
+    def test_form_invalid_body(self):
+        view = JSONFormView.as_view()
+        response = view(self.post(b'{"name": '))
+        self.assertEqual(response.status_code, 400)
+        content = self.get_content(response)
+        self.assertFalse(content['success'])
+        self.assertEqual(content['exception'],
+                         'The request body is not valid JSON.')
+        response = view(self.post(['Chris']))
+        self.assertEqual(response.status_code, 400)
+        with override_settings(JSONIT_MAX_BODY_SIZE=10):
+            response = view(self.post({'name': 'Chris' * 10}))
+        self.assertEqual(response.status_code, 413)
+
+    def test_decorator(self):
+
+        @parse_json_body(max_size=100)
+        def view(request):
+            return JSONResponse(request, details=get_json_body(request))
+
+        content = self.get_content(view(self.post({'a': 1})))
+        self.assertEqual(content['details'], {'a': 1})
+        self.assertEqual(view(self.post(b'[')).status_code, 400)
+        self.assertEqual(view(self.post([0] * 100)).status_code, 413)
+
+        @parse_json_body()
+        def form_view(request):
+            return HttpResponse('ok')
+
+        # Other content types are left alone.
+        request = self.factory.post('/', {'a': 'b'})
+        self.assertEqual(form_view(request).content, b'ok')
+
+
+class Author(models.Model):
+    name = models.CharField(max_length=50)
+    jsonit_fields = ('id', 'name')
+
+    class Meta:
+        app_label = 'jsonit'
+
+
+class Book(models.Model):
+    title = models.CharField(max_length=50)
+    author = models.ForeignKey(Author, on_delete=models.CASCADE)
+    price = models.DecimalField(max_digits=5, decimal_places=2)
+    published = models.DateField()
+    jsonit_fields = ('id', 'title', 'author', 'price', 'published')
+
+    class Meta:
+        app_label = 'jsonit'
+
+
+class Secret(models.Model):
+    name = models.CharField(max_length=50)
+    password = models.CharField(max_length=50)
+
+    class Meta:
+        app_label = 'jsonit'
+
+
+class ModelEncoderTest(DatabaseTestCase):
+
+    def setUp(self):
+        self.author = Author.objects.create(name='Chris')
+        for i in range(3):
+            Book.objects.create(title='Book %s' % i, author=self.author,
+                                price=decimal.Decimal('9.95'),
+                                published=datetime.date(1980, 1, i + 1))
+
+    def test_instance(self):
+        self.assertEqual(json.loads(encode(self.author)),
+                         {'id': self.author.pk, 'name': 'Chris'})
+
+    def test_queryset(self):
+        with self.assertNumQueries(1):
+            books = json.loads(encode(Book.objects.order_by('pk')))
+        self.assertEqual(len(books), 3)
+        self.assertEqual(books[0], {
+            'id': books[0]['id'],
+            'title': 'Book 0',
+            'author': self.author.pk,
+            'price': '9.95',
+            'published': '1980-01-01',
+        })
+
+    def test_values(self):
+        qs = Book.objects.order_by('pk')
+        self.assertEqual(json.loads(encode(qs.values('title')))[2],
+                         {'title': 'Book 2'})
+        self.assertEqual(
+            json.loads(encode(qs.values_list('title', flat=True))),
+            ['Book 0', 'Book 1', 'Book 2'])
+
+    def test_deferred(self):
+        with self.assertNumQueries(1):
+            books = json.loads(encode(Book.objects.only('title')))
+        self.assertEqual(sorted(books[0]), ['id', 'title'])
+
+    def test_evaluated_queryset(self):
+        qs = Book.objects.all()
+        list(qs)
+        with self.assertNumQueries(0):
+            self.assertEqual(len(json.loads(encode(qs))), 3)
+
+    def test_streaming(self):
+        request = HttpRequest()
+        response = StreamingJSONResponse(
+            request, details={'books': Book.objects.values('title')})
+        content = b''.join(response.streaming_content).decode('utf-8')
+        self.assertEqual(len(json.loads(content)['details']['books']), 3)
+
+    def test_fields_required(self):
+        secret = Secret(name='Chris', password='hash')
+        self.assertRaises(TypeError, encode, secret)
+        self.assertEqual(json.loads(encode(Author(name='Chris'))),
+                         {'id': None, 'name': 'Chris'})
+
+    def test_extra_encoder_precedence(self):
+        encoders = [(Author, lambda author: author.name)]
+        self.assertEqual(encode(self.author, encoders=encoders), '"Chris"')
+
+
+def batch_details(request):
+    messages.info(request, 'From %s' % request.path)
+    return JSONResponse(request, details={'params': request.GET.dict()})
+batch_details.batch_allowed = True
+
+
+class BatchFormView(JSONResponseMixin, View):
+    batch_allowed = True
+
+    def post(self, request):
+        form = ConformanceForm(data=request.POST)
+        return JSONFormResponse(request, forms=[form])
+
+
+def batch_error(request):
+    raise ValueError('Broken')
+batch_error.batch_allowed = True
+
+
+def batch_unmarked(request):
+    return JSONResponse(request)
+
+
+batch_event = threading.Event()
+
+
+def batch_wait(request):
+    # Only finishes if batch_set is run at the same time.
+    return JSONResponse(request, details={'set': batch_event.wait(5)})
+batch_wait.batch_concurrent = True
+
+
+def batch_set(request):
+    batch_event.set()
+    request.session['changed'] = 2
+    request.session['added'] = 1
+    del request.session['deleted']
+    messages.info(request, 'Set')
+    return JSONResponse(request)
+batch_set.batch_concurrent = True
+
+
+urlpatterns = [
+    url(r'^batch/$', BatchView.as_view()),
+    url(r'^details/$', batch_details),
+    url(r'^form/$', BatchFormView.as_view()),
+    url(r'^error/$', batch_error),
+    url(r'^unmarked/$', batch_unmarked),
+    url(r'^wait/$', batch_wait),
+    url(r'^set/$', batch_set),
+]
+
+
+class BatchViewTest(MessageTest):
+
+    def setUp(self):
+        super(BatchViewTest, self).setUp()
+        self.request.urlconf = __name__
+        self.request.META.update(SERVER_NAME='testserver', SERVER_PORT='80')
+
+    def post(self, batch):
+        self.request.method = 'POST'
+        self.request._body = json.dumps(batch).encode('utf-8')
+        response = BatchView.as_view()(self.request)
+        return response.status_code, json.loads(
+            response.content.decode('utf-8'))
+
+    def test_batch(self):
+        status, content = self.post([
+            {'path': '/details/?a=1', 'params': {'b': 2}},
+            {'path': '/form/', 'method': 'post', 'params': {'name': 'x'}},
+            {'path': '/error/'},
+            {'path': '/missing/'},
+            {'path': '/unmarked/'},
+            {'path': '/batch/', 'method': 'POST'},
+        ])
+        self.assertEqual(status, 200)
+        self.assertEqual(content['messages'],
+                         [{'message': 'From /details/', 'class': 'info'}])
+        responses = content['details']['responses']
+        for response in responses:
+            self.assertTrue(response.pop('time') >= 0)
+        self.assertEqual(responses[0], {
+            'path': '/details/?a=1', 'method': 'GET', 'status': 200,
+            'content': {'success': True, 'messages': [],
+                        'details': {'params': {'a': '1', 'b': '2'}}},
+        })
+        self.assertEqual(responses[1]['status'], 200)
+        self.assertEqual(responses[1]['method'], 'POST')
+        self.assertFalse(responses[1]['content']['success'])
+        self.assertEqual(sorted(responses[1]['content']['details']
+                                ['form_errors']),
+                         ['__all__', 'id_email'])
+        self.assertEqual(responses[2]['status'], 500)
+        self.assertFalse(responses[2]['content']['success'])
+        self.assertTrue(responses[2]['content']['exception'])
+        self.assertEqual(responses[3]['status'], 404)
+        # Only views marked with batch_allowed (or batch_concurrent) run.
+        self.assertEqual(responses[4]['status'], 400)
+        self.assertEqual(responses[5]['status'], 400)
+
+    def test_concurrent(self):
+        batch_event.clear()
+        self.request.session.update({'kept': 1, 'changed': 1, 'deleted': 1})
+        status, content = self.post([{'path': '/wait/'}, {'path': '/set/'}])
+        responses = content['details']['responses']
+        self.assertEqual(responses[0]['content']['details'], {'set': True})
+        # The changes made to the copies of the session are applied.
+        self.assertEqual(self.request.session,
+                         {'kept': 1, 'changed': 2, 'added': 1})
+        self.assertEqual(content['messages'],
+                         [{'message': 'Set', 'class': 'info'}])
+
+    def test_exception_reported(self):
+        signals = []
+
+        def receiver(sender, request, **kwargs):
+            signals.append(request.path)
+
+        got_request_exception.connect(receiver)
+        try:
+            with mock.patch('jsonit.batch.logger') as logger:
+                status, content = self.post([{'path': '/error/'}])
+        finally:
+            got_request_exception.disconnect(receiver)
+        self.assertEqual(content['details']['responses'][0]['status'], 500)
+        self.assertEqual(signals, ['/error/'])
+        self.assertEqual(logger.error.call_count, 1)
+        self.assertTrue(logger.error.call_args[1]['exc_info'])
+
+    def test_invalid(self):
+        for batch in ({'path': '/details/'}, [{}], [{'path': '/'}] * 21,
+                      [{'path': 1}], [{'path': '/', 'method': ['GET']}],
+                      [{'path': '/', 'params': [1]}]):
+            status, content = self.post(batch)
+            self.assertEqual(status, 400)
+            self.assertFalse(content['success'])
+            self.assertTrue(content['details']['error'])
+
+
+def middleware_error(request):
+    messages.info(request, 'Kept')
+    raise ValueError('Broken')
+
+urlpatterns.append(url(r'^middleware/error/$', middleware_error))
+
+
+middleware = ['django.contrib.messages.middleware.MessageMiddleware',
+              'jsonit.middleware.JSONExceptionMiddleware']
+middleware_settings = override_settings(
+    ROOT_URLCONF=__name__, MIDDLEWARE=middleware,
+    MIDDLEWARE_CLASSES=middleware,   # Django < 1.10
+    MESSAGE_STORAGE='django.contrib.messages.storage.cookie.CookieStorage')
+
+
+class MiddlewareTestMixin(object):
+    """
+    Tests run through each of the request handlers, by subclasses which
+    implement :meth:`get`.
+    """
+
+    def setUp(self):
+        super(MiddlewareTestMixin, self).setUp()
+        # The test clients would re-raise the exceptions the middleware
+        # reports.
+        for name in ('got_request_exception', 'logger'):
+            patcher = mock.patch('jsonit.middleware.%s' % name)
+            setattr(self, name, patcher.start())
+            self.addCleanup(patcher.stop)
+
+    def get(self, path, ajax=True):
+        raise NotImplementedError
+
+    def test_ajax_exception(self):
+        response = self.get('/middleware/error/')
+        self.assertEqual(response.status_code, 500)
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertFalse(content['success'])
+        self.assertEqual(content['messages'], [])
+        self.assertFalse('Broken' in content['exception'])
+        self.assertEqual(self.got_request_exception.send.call_count, 1)
+        self.assertEqual(self.logger.error.call_count, 1)
+        exc_info = self.logger.error.call_args[1]['exc_info']
+        self.assertEqual(str(exc_info[1]), 'Broken')
+
+    def test_debug(self):
+        with override_settings(DEBUG=True):
+            response = self.get('/middleware/error/')
+        content = json.loads(response.content.decode('utf-8'))
+        self.assertTrue('Broken' in content['exception'])
+
+    def test_messages_kept(self):
+        response = self.get('/middleware/error/')
+        # The messages weren't consumed, so they are stored for later.
+        self.assertTrue(response.cookies['messages'].value)
+
+    def test_not_ajax(self):
+        self.assertRaises(ValueError, self.get, '/middleware/error/',
+                          ajax=False)
+
+
+@middleware_settings
+class WSGIMiddlewareTest(MiddlewareTestMixin, SimpleTestCase):
+
+    def get(self, path, ajax=True):
+        extra = {'HTTP_X_REQUESTED_WITH': 'XMLHttpRequest'} if ajax else {}
+        return self.client.get(path, **extra)
+
+    def test_old_style(self):
+        request = HttpRequest()
+        request.META['HTTP_X_REQUESTED_WITH'] = 'XMLHttpRequest'
+        response = JSONExceptionMiddleware().process_exception(
+            request, ValueError('Broken'))
+        self.assertFalse(json.loads(response.content.decode('utf-8'))
+                         ['success'])
+
+
+class MetricsTest(MessageTest):
+
+    def setUp(self):
+        super(MetricsTest, self).setUp()
+        self.request.path = '/metrics/'
+        self.measured = []
+        response_measured.connect(self.receiver)
+
+    def tearDown(self):
+        response_measured.disconnect(self.receiver)
+        super(MetricsTest, self).tearDown()
+
+    def receiver(self, sender, metrics, **kwargs):
+        self.measured.append(metrics)
+
+    def test_signal(self):
+        messages.info(self.request, 'Hello')
+        response = JSONFormResponse(self.request, details={'a': [1, 2]},
+                                    forms=[ConformanceForm(data={})])
+        response.render()
+        metrics, = self.measured
+        self.assertEqual(metrics.view_name, '/metrics/')
+        self.assertEqual(metrics.size, len(response.content))
+        # The envelope with the message (4), details (4) and the three form
+        # errors (7).
+        self.assertEqual(metrics.objects, 15)
+        self.assertEqual(sorted(metrics.durations), ['build_json', 'encode',
+                                                    'get_form_errors',
+                                                    'get_messages'])
+
+    def test_streaming(self):
+        response = StreamingJSONResponse(
+            self.request, details={'items': iter(range(10))})
+        self.assertEqual(self.measured, [])
+        content = b''.join(response.streaming_content)
+        metrics, = self.measured
+        self.assertEqual(metrics.size, len(content))
+        self.assertTrue('encode' in metrics.durations)
+
+    def test_not_collected(self):
+        response_measured.disconnect(self.receiver)
+        self.assertIsNone(JSONResponse(self.request).metrics)
+
+    def test_collector(self):
+        path = 'jsonit.metrics.AggregatingCollector'
+        with override_settings(JSONIT_METRICS_COLLECTOR=path):
+            from jsonit.metrics import get_collector
+            collector = get_collector()
+            self.assertTrue(isinstance(collector, AggregatingCollector))
+            for i in range(3):
+                JSONResponse(self.request, details={'i': i}).render()
+            stats = collector.stats()
+            self.assertEqual(stats['/metrics/']['size']['count'], 3)
+            self.assertEqual(stats['/metrics/']['objects']['max'], 5)
+            self.assertTrue('build_json' in collector.report())
+        self.assertIsNone(get_collector())
+
+    def test_histogram(self):
+        histogram = Histogram()
+        for value in range(1, 101):
+            histogram.add(value)
+        self.assertEqual(histogram.mean, 50.5)
+        self.assertEqual(histogram.percentile(50), 50.5)
+        self.assertEqual(histogram.percentile(100), 100)
+        self.assertEqual(histogram.buckets[128], 37)
+
+
+if sys.version_info >= (3, 5):
+    from jsonit.async_tests import (ASGIMiddlewareTest, AsyncDecoratorTest,
+                                    AsyncDatabaseView, AsyncDetailsView,
+                                    AsyncNameFormView, AsyncRenderTest,
+                                    AsyncViewClientTest,
+                                    NDJSONReturnTest, async_middleware_error)
+
+    urlpatterns.extend([
+        url(r'^middleware/async-error/$', async_middleware_error),
+        url(r'^async/details/$', AsyncDetailsView.as_view()),
+        url(r'^async/database/$', AsyncDatabaseView.as_view()),
+        url(r'^async/form/$', AsyncNameFormView.as_view()),
+    ])
+
+    class AsyncRenderTestCase(AsyncRenderTest, MessageTest):
+        pass
+
+    class AsyncDecoratorTestCase(AsyncDecoratorTest, MessageTest):
+        pass
+
+    class NDJSONReturnTestCase(NDJSONReturnTest, MessageTest):
+        pass
+
+    @middleware_settings
+    class AsyncViewClientTestCase(AsyncViewClientTest, SimpleTestCase):
+        databases = {'default'}
+
+    @middleware_settings
+    class ASGIMiddlewareTestCase(ASGIMiddlewareTest, MiddlewareTestMixin,
+                                 SimpleTestCase):
+        pass
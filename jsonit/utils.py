@@ -1,36 +1,118 @@
 import os
 
+from django.core.signals import setting_changed
 from django.http import HttpResponse
-from django.template import Context, RequestContext, loader
+from django.template import Context, TemplateDoesNotExist, loader
+try:
+    from django.utils.autoreload import file_changed
+except ImportError:     # Django < 2.2
+    file_changed = None
+
+from jsonit.compat import string_types
+
+DEFAULT_AJAX_TEMPLATE_FORMAT = '%(name)s.ajax%(ext)s'
+
+# The name of the template which was found for each template list, see
+# resolve_template_name().
+_template_names = {}
+_TEMPLATE_NAMES_CACHE_SIZE = 1024
+
+
+def get_ajax_template_names(template_list,
+                            template_format=DEFAULT_AJAX_TEMPLATE_FORMAT):
+    """
+    Return the template list with the alternate AJAX versions of each
+    template name prepended.
+
+    :param template_format: The format of the alternate names, which is
+        passed the ``name`` and extension (``ext``) of each template name.
+    """
+    ajax_template_list = []
+    for template_name in template_list:
+        name, ext = os.path.splitext(template_name)
+        ajax_template_list.append(template_format % {'name': name,
+                                                     'ext': ext})
+    return ajax_template_list + list(template_list)
+
+
+def resolve_template_name(template_list, ajax=False, using=None):
+    """
+    Return the first template name in the list which exists, or ``None`` if
+    none of them do.
+
+    The result is cached for each template list, so missing templates (such
+    as the AJAX alternatives which a project doesn't use) are only looked
+    for once. The cache is cleared when the ``TEMPLATES`` setting is changed
+    or when the development server's autoreloader sees a file change.
+
+    :param ajax: Whether the list is for an AJAX request.
+    :param using: The name of the template engine to use.
+    """
+    key = (tuple(template_list), ajax, using)
+    try:
+        return _template_names[key]
+    except KeyError:
+        pass
+    for name in template_list:
+        try:
+            loader.get_template(name, using=using)
+        except TemplateDoesNotExist:
+            continue
+        if len(_template_names) >= _TEMPLATE_NAMES_CACHE_SIZE:
+            # Most likely the template lists are being built on the fly.
+            _template_names.clear()
+        _template_names[key] = name
+        return name
+    return None
+
+
+def clear_template_cache(**kwargs):
+    """
+    Clear the cache of resolved template names.
+    """
+    setting = kwargs.get('setting')
+    if setting is None or setting in ('TEMPLATES', 'INSTALLED_APPS'):
+        _template_names.clear()
+
+setting_changed.connect(clear_template_cache)
+if file_changed is not None:
+    file_changed.connect(clear_template_cache)
 
 
 def ajax_aware_render(request, template_list, context=None, **kwargs):
     """
     Render a template, using a different one automatically for AJAX requests.
-    
+
     :param template_list: Either a template name or a list of template names.
     :param context: Optional extra context to pass to the template.
-    
+
     For AJAX requests, the template list is altered to look for alternate
     templates first and the ``is_ajax`` context variable is set to ``True``.
-    
+
     For example, if ``template_list`` was set to
     ``['custom/login.html', 'login.html']``, then an AJAX request will change
     this to::
-    
+
         ['custom/login.ajax.html', 'login.ajax.html',
          'custom/login.html', 'login.html']
+
+    The template which is found for each list is cached (see
+    :func:`resolve_template_name`).
     """
-    if not isinstance(context, Context):
-        context = RequestContext(request, context)
-    if isinstance(template_list, basestring):
+    if isinstance(context, Context):
+        context = context.flatten()
+    context = dict(context or {})
+    if isinstance(template_list, string_types):
         template_list = [template_list]
-    if request.is_ajax():
-        ajax_template_list = []
-        for name in template_list:
-            ajax_template_list.append('%s.ajax%s' % os.path.splitext(name))
-        template_list = ajax_template_list + list(template_list)
+    ajax = request.is_ajax()
+    if ajax:
+        template_list = get_ajax_template_names(template_list)
         context['is_ajax'] = True
         context['current_url'] = request.get_full_path()
-    template = loader.select_template(template_list)
-    return HttpResponse(template.render(context), **kwargs)
+    name = resolve_template_name(template_list, ajax)
+    if name is None:
+        # Raise the standard exception listing the templates tried.
+        template = loader.select_template(template_list)
+    else:
+        template = loader.get_template(name)
+    return HttpResponse(template.render(context, request), **kwargs)
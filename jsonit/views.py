@@ -1,6 +1,9 @@
-import os
-
-from jsonit.http import JSONFormResponse, JSONResponse
+from jsonit.http import JSONFormResponse, JSONResponse, NDJSONResponse
+from jsonit.request import (InvalidJSONBody, error_response, get_json_body,
+                            is_json_request, iter_json_array)
+from jsonit.schema import Schema
+from jsonit.utils import (DEFAULT_AJAX_TEMPLATE_FORMAT,
+                          get_ajax_template_names, resolve_template_name)
 
 
 class AJAXTemplateResponseMixin(object):
@@ -20,6 +23,10 @@ class AJAXTemplateResponseMixin(object):
         ['custom/login.ajax.html', 'login.ajax.html',
          'custom/login.html', 'login.html']
 
+    The list is then narrowed down to the first template which exists, which
+    is cached for each list (see :func:`jsonit.utils.resolve_template_name`)
+    so that missing alternate templates are only looked for once.
+
     For views which use :meth:`get_context_data`, two extra context variables
     are added for AJAX requests:
 
@@ -29,7 +36,7 @@ class AJAXTemplateResponseMixin(object):
     ``current_url``
         The current URL, useful for explicitly setting HTML form actions.
     """
-    ajax_template_format = '%(name)s.ajax%(ext)s'
+    ajax_template_format = DEFAULT_AJAX_TEMPLATE_FORMAT
 
     def get_template_names(self, *args, **kwargs):
         """
@@ -38,14 +45,16 @@ class AJAXTemplateResponseMixin(object):
         """
         template_list = super(AJAXTemplateResponseMixin, self)\
                                         .get_template_names(*args, **kwargs)
-        if self.request.is_ajax():
-            ajax_template_list = []
-            for template_name in template_list:
-                name, ext = os.path.splitext(template_name)
-                ajax_template_list.append(self.ajax_template_format %
-                                          {'name': name, 'ext': ext})
-            template_list = ajax_template_list + list(template_list)
-        return template_list
+        ajax = self.request.is_ajax()
+        if ajax:
+            template_list = get_ajax_template_names(template_list,
+                                                    self.ajax_template_format)
+        name = resolve_template_name(
+            template_list, ajax, getattr(self, 'template_engine', None))
+        if name is None:
+            # Let the response report the missing templates.
+            return list(template_list)
+        return [name]
 
     def get_context_data(self, *args, **kwargs):
         data = super(AJAXTemplateResponseMixin, self).get_context_data(*args,
@@ -67,9 +76,54 @@ class JSONResponseMixin(object):
     If the :attr:`ajax_redirect` attribute is set to ``True`` and the standard
     response was a redirect, the JSON response will include this redirection
     URL.
+
+    The :attr:`json_etag` attribute is passed to the JSON response as its
+    ``etag`` argument (see :class:`~jsonit.http.JSONResponse`). Override
+    :meth:`get_json_etag` to provide a version function instead.
+
+    Set the :attr:`json_cache` attribute to a
+    :class:`~jsonit.cache.JSONResponseCache` to cache the JSON responses of
+    AJAX ``GET`` requests, skipping the view entirely on a cache hit.
+
+    Set the :attr:`json_compress` attribute to ``True`` or ``False`` to
+    override the ``JSONIT_COMPRESS`` setting (see :mod:`jsonit.compression`).
+
+    Set the :attr:`json_indexed_errors` attribute to ``True`` to group the
+    errors of any formsets by form index (see
+    :class:`~jsonit.http.JSONFormResponse`).
+
+    The :attr:`json_fields` attribute is passed to the JSON response as its
+    ``fields`` argument. Set it to ``True`` to let clients select the
+    fields of the details they need (see :class:`~jsonit.http.JSONResponse`).
+
+    Set the :attr:`json_delta` attribute to a
+    :class:`~jsonit.delta.DeltaStore` to send clients a patch of the changes
+    to the details since the version they have (see :mod:`jsonit.delta`).
+
+    Set the :attr:`json_binary` attribute to ``True`` or ``False`` to
+    override the ``JSONIT_BINARY`` setting (see :mod:`jsonit.binary`).
+
+    Set the :attr:`json_schema` attribute to a :class:`~jsonit.schema.Schema`
+    (or the spec of one, which is compiled the first time the view responds)
+    if the view's details always have the same shape, to encode them with a
+    serializer compiled for that shape (see :mod:`jsonit.schema`).
     """
     json_success = True
     ajax_redirect = False
+    json_etag = None
+    json_cache = None
+    json_compress = None
+    json_indexed_errors = False
+    json_fields = None
+    json_delta = None
+    json_binary = None
+    json_schema = None
+
+    def dispatch(self, request, *args, **kwargs):
+        dispatch = super(JSONResponseMixin, self).dispatch
+        if self.json_cache is None:
+            return dispatch(request, *args, **kwargs)
+        return self.json_cache.serve(request, dispatch, *args, **kwargs)
 
     def get_json_response(self, response, details=None, redirect=None):
         """
@@ -86,7 +140,7 @@ class JSONResponseMixin(object):
             forms are provided (more specifically, if :meth:`get_forms` doesn't
             return any) then a :class:`JSONResponse` will be used instead.
         """
-        if not self.request.is_ajax():
+        if not self.is_json_client():
             return response
         details = self.get_json_details(details or {}) or None
         kwargs = {'details': details}
@@ -97,17 +151,84 @@ class JSONResponseMixin(object):
         elif self.ajax_redirect and str(response.status_code) in ('301',
                 '302'):
             kwargs['redirect'] = response['Location']
+        etag = self.get_json_etag()
+        if etag is not None:
+            kwargs['etag'] = etag
+        if self.json_compress is not None:
+            kwargs['compress'] = self.json_compress
+        if self.json_fields is not None:
+            kwargs['fields'] = self.json_fields
+        if self.json_delta is not None:
+            kwargs['delta'] = self.json_delta
+        if self.json_binary is not None:
+            kwargs['binary'] = self.json_binary
+        schema = self.get_json_schema()
+        if schema is not None:
+            kwargs['schema'] = schema
         forms = self.get_forms()
         if forms:
             json_response_class = JSONFormResponse
             kwargs['forms'] = forms
+            kwargs['indexed_errors'] = self.json_indexed_errors
         else:
             json_response_class = JSONResponse
         return json_response_class(self.request, **kwargs)
 
+    def get_ndjson_response(self, response, records, details=None):
+        """
+        Override a standard response for AJAX initiated requests, instead
+        streaming records as newline delimited JSON, followed by the JSON
+        response dictionary (see :class:`~jsonit.http.NDJSONResponse`).
+
+        :param response: The standard response to return if this is not an
+            AJAX initiated request.
+        :param records: An iterable (usually a generator) of the records, or
+            messages, to stream.
+        :param details: An optional dictionary of extra JSON details for the
+            last line.
+        """
+        if not self.is_json_client():
+            return response
+        details = self.get_json_details(details or {}) or None
+        kwargs = {'details': details}
+        if self.json_success is not None:
+            kwargs['success'] = self.json_success
+        return NDJSONResponse(self.request, records, **kwargs)
+
+    def is_json_client(self):
+        """
+        Return whether the client should receive a JSON response, which by
+        default is whether the request was AJAX initiated.
+        """
+        return self.request.is_ajax()
+
     def get_forms(self):
         return []
 
+    def get_json_etag(self):
+        """
+        Return the ``etag`` argument for the JSON response: ``True`` to
+        compute the ``ETag`` from the encoded content, or a function which is
+        passed the request and returns a version string. For example::
+
+            def get_json_etag(self):
+                return lambda request: str(self.object.modified)
+
+        Defaults to :attr:`json_etag`.
+        """
+        return self.json_etag
+
+    def get_json_schema(self):
+        """
+        Return the :class:`~jsonit.schema.Schema` of the details, compiling
+        the spec set as :attr:`json_schema` once for the class.
+        """
+        schema = self.json_schema
+        if schema is None or isinstance(schema, Schema):
+            return schema
+        schema = self.__class__.json_schema = Schema(schema)
+        return schema
+
     def get_json_details(self, details):
         """
         Hook method used to amend or modify JSON details.
@@ -117,6 +238,50 @@ class JSONResponseMixin(object):
         return details
 
 
+class JSONRequestMixin(object):
+    """
+    A mixin for views which accept JSON request bodies (see
+    :mod:`jsonit.request`).
+
+    :meth:`get_json_body` returns the decoded body, which is only decoded
+    once for each request, and :meth:`iter_json_array` decodes a JSON array
+    body one item at a time. The maximum size of the body is the
+    :attr:`json_max_body_size` attribute (in bytes), defaulting to the
+    ``JSONIT_MAX_BODY_SIZE`` setting.
+
+    A body which is too large or isn't valid JSON results in a JSON exception
+    response, with a 413 or 400 status code.
+
+    Requests with a JSON body also receive JSON responses when used with
+    :class:`JSONResponseMixin`, even if they weren't sent as AJAX requests.
+    """
+    json_max_body_size = None
+
+    def dispatch(self, request, *args, **kwargs):
+        try:
+            return super(JSONRequestMixin, self).dispatch(request, *args,
+                                                          **kwargs)
+        except InvalidJSONBody as e:
+            return error_response(request, e)
+
+    def get_json_body(self):
+        """
+        Return the decoded JSON body of the request.
+        """
+        return get_json_body(self.request, self.json_max_body_size)
+
+    def iter_json_array(self, chunk_size=65536):
+        """
+        Yield each item of a JSON array body as it is read.
+        """
+        return iter_json_array(self.request, self.json_max_body_size,
+                               chunk_size)
+
+    def is_json_client(self):
+        return (is_json_request(self.request) or
+                super(JSONRequestMixin, self).is_json_client())
+
+
 class AJAXMixin(AJAXTemplateResponseMixin, JSONResponseMixin):
     """
     A mixin that will look for AJAX alternatives to templates and that provides
@@ -134,13 +299,27 @@ class AJAXMixin(AJAXTemplateResponseMixin, JSONResponseMixin):
         return self.get_json_response(response)
 
 
-class AJAXFormMixin(AJAXMixin):
+class AJAXFormMixin(JSONRequestMixin, AJAXMixin):
     """
     A mixin for Django generic form views which will return a
     :class:`JSONFormResponse` for AJAX initiated ``POST`` requests (and also
     look for alternate AJAX versions of templates).
+
+    Requests with a JSON body (a JSON object of the form's fields) have it
+    passed to the form as its data, and also receive a
+    :class:`JSONFormResponse` (see :class:`JSONRequestMixin`).
     """
 
+    def get_form_kwargs(self):
+        kwargs = super(AJAXFormMixin, self).get_form_kwargs()
+        if 'data' in kwargs and is_json_request(self.request):
+            data = self.get_json_body()
+            if not isinstance(data, dict):
+                raise InvalidJSONBody('The request body must be a JSON '
+                                      'object.')
+            kwargs['data'] = data
+        return kwargs
+
     def form_valid(self, form, *args, **kwargs):
         self.form = form
         return super(AJAXFormMixin, self).form_valid(form=form, *args,
@@ -1,4 +1,7 @@
-from distutils.core import setup
+try:
+    from setuptools import setup
+except ImportError:
+    from distutils.core import setup
 from jsonit import get_version
 
 try:
@@ -18,6 +21,7 @@ setup(
     packages=[
         'jsonit',
     ],
+    install_requires=['Django>=1.8'],
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Environment :: Web Environment',